@@ -0,0 +1,333 @@
+# answer_cache.py
+# LRU/TTL cache of /query answers keyed on normalized query text + filters + top_k, with optional
+# query-embedding similarity hits and invalidation by the source files that contributed to an answer.
+# AnswerCache lives in this process; SQLiteAnswerCache is shared by every worker process using the same file.
+
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from sqlite_store import SQLiteStore
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+def make_scope(filters, top_k):
+    # Similarity hits are only allowed between queries with the same filters and top_k
+    return json.dumps({"filters": filters or {}, "top_k": top_k}, sort_keys=True, ensure_ascii=False)
+
+
+class CacheEntry:
+    def __init__(self, scope, response, sources, query_vector, expires_at):
+        self.scope = scope
+        self.response = response
+        self.sources = sources
+        self.query_vector = query_vector
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self._by_source = {}
+        # Bumped on every invalidation so answers computed before it are not stored afterwards
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, query, filters, top_k):
+        return make_scope(filters, top_k) + "\n" + normalize_query(query)
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+    def contains(self, key):
+        # Like get, without counting a hit or miss or refreshing the entry
+        with self._lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.expires_at >= time.time()
+
+    def get_similar(self, scope, query_vector):
+        if self.similarity_threshold <= 0 or query_vector is None:
+            return None
+        query_vector = _unit(query_vector)
+        with self._lock:
+            now = time.time()
+            candidates = [
+                (key, entry) for key, entry in self.entries.items()
+                if entry.scope == scope and entry.query_vector is not None and entry.expires_at >= now
+            ]
+            if not candidates:
+                return None
+            scores = np.stack([entry.query_vector for _, entry in candidates]) @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key, entry = candidates[best]
+            self.entries.move_to_end(key)
+            self.similar_hits += 1
+            # get() already counted this lookup as a miss
+            self.misses -= 1
+            return entry.response
+
+    def put(self, key, scope, response, sources, query_vector=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self.entries:
+                self._remove(key)
+            vector = _unit(query_vector) if query_vector is not None else None
+            self.entries[key] = CacheEntry(scope, response, set(sources), vector, time.time() + self.ttl_seconds)
+            for source in sources:
+                self._by_source.setdefault(source, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate_sources(self, filenames, include_sourceless=False):
+        # include_sourceless drops answers that had no supporting documents; a new upload may answer them now
+        with self._lock:
+            self.generation += 1
+            keys = set()
+            for filename in filenames:
+                keys |= self._by_source.get(filename, set())
+            if include_sourceless:
+                keys |= {key for key, entry in self.entries.items() if not entry.sources}
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.entries.clear()
+            self._by_source.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity_threshold": self.similarity_threshold,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for source in entry.sources:
+            keys = self._by_source.get(source)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_source[source]
+
+
+class SQLiteAnswerCache(SQLiteStore):
+    # Same interface as AnswerCache. The generation counter lives in the file too, so an invalidation by one
+    # worker also stops answers computed before it on the other workers from being stored. Hit and miss
+    # counters are per process
+    def __init__(self, path, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.0):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS answer_cache ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " query_vector BLOB,"
+            " expires_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_scope ON answer_cache (scope)")
+        conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_last_used ON answer_cache (last_used_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS answer_cache_sources (source TEXT NOT NULL, key TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_sources_source ON answer_cache_sources (source)")
+        conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_sources_key ON answer_cache_sources (key)")
+        conn.execute("CREATE TABLE IF NOT EXISTS answer_cache_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        for key in ("generation", "evictions", "invalidations"):
+            conn.execute("INSERT OR IGNORE INTO answer_cache_state (key, value) VALUES (?, 0)", (key,))
+        conn.commit()
+
+    @property
+    def generation(self):
+        return self._state(self._connect(), "generation")
+
+    def make_key(self, query, filters, top_k):
+        return make_scope(filters, top_k) + "\n" + normalize_query(query)
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT response, expires_at FROM answer_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                with self._transaction() as conn:
+                    self._remove(conn, [key])
+            self._add_counts(misses=1)
+            return None
+        with conn:
+            conn.execute("UPDATE answer_cache SET last_used_at = ? WHERE key = ?", (now, key))
+        self._add_counts(hits=1)
+        return json.loads(row[0])
+
+    def contains(self, key):
+        row = self._connect().execute(
+            "SELECT 1 FROM answer_cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def get_similar(self, scope, query_vector):
+        if self.similarity_threshold <= 0 or query_vector is None:
+            return None
+        query_vector = _unit(query_vector)
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT key, query_vector FROM answer_cache WHERE scope = ? AND query_vector IS NOT NULL AND expires_at >= ?",
+            (scope, time.time()),
+        ).fetchall()
+        if not rows:
+            return None
+        scores = np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows]) @ query_vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        key = rows[best][0]
+        row = conn.execute("SELECT response FROM answer_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE answer_cache SET last_used_at = ? WHERE key = ?", (time.time(), key))
+        # get() already counted this lookup as a miss
+        self._add_counts(similar_hits=1, misses=-1)
+        return json.loads(row[0])
+
+    def put(self, key, scope, response, sources, query_vector=None, generation=None):
+        vector = _unit(query_vector).tobytes() if query_vector is not None else None
+        now = time.time()
+        with self._transaction() as conn:
+            if generation is not None and generation != self._state(conn, "generation"):
+                return
+            self._remove(conn, [key])
+            conn.execute(
+                "INSERT INTO answer_cache (key, scope, response, query_vector, expires_at, last_used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, json.dumps(response, ensure_ascii=False), vector, now + self.ttl_seconds, now),
+            )
+            conn.executemany("INSERT INTO answer_cache_sources (source, key) VALUES (?, ?)",
+                             [(source, key) for source in set(sources)])
+            excess = conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                oldest = [row[0] for row in conn.execute(
+                    "SELECT key FROM answer_cache ORDER BY last_used_at LIMIT ?", (excess,)
+                ).fetchall()]
+                self._remove(conn, oldest)
+                self._bump(conn, "evictions", len(oldest))
+
+    def invalidate_sources(self, filenames, include_sourceless=False):
+        with self._transaction() as conn:
+            self._bump(conn, "generation")
+            keys = set()
+            for filename in filenames:
+                keys.update(row[0] for row in conn.execute(
+                    "SELECT key FROM answer_cache_sources WHERE source = ?", (filename,)
+                ).fetchall())
+            if include_sourceless:
+                keys.update(row[0] for row in conn.execute(
+                    "SELECT key FROM answer_cache WHERE NOT EXISTS"
+                    " (SELECT 1 FROM answer_cache_sources WHERE answer_cache_sources.key = answer_cache.key)"
+                ).fetchall())
+            self._remove(conn, keys)
+            self._bump(conn, "invalidations", len(keys))
+            return len(keys)
+
+    def clear(self):
+        with self._transaction() as conn:
+            self._bump(conn, "generation")
+            conn.execute("DELETE FROM answer_cache_sources")
+            conn.execute("DELETE FROM answer_cache")
+
+    def stats(self):
+        conn = self._connect()
+        state = dict(conn.execute("SELECT key, value FROM answer_cache_state").fetchall())
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "entries": conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0],
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": state.get("evictions", 0),
+                "invalidations": state.get("invalidations", 0),
+            }
+
+    def _add_counts(self, hits=0, similar_hits=0, misses=0):
+        with self._lock:
+            self.hits += hits
+            self.similar_hits += similar_hits
+            self.misses += misses
+
+    def _state(self, conn, key):
+        return conn.execute("SELECT value FROM answer_cache_state WHERE key = ?", (key,)).fetchone()[0]
+
+    def _bump(self, conn, key, amount=1):
+        conn.execute("UPDATE answer_cache_state SET value = value + ? WHERE key = ?", (amount, key))
+
+    def _remove(self, conn, keys):
+        for key in keys:
+            conn.execute("DELETE FROM answer_cache_sources WHERE key = ?", (key,))
+            conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+
+
+def make_answer_cache(backend, path=None, **options):
+    # "memory" = this process only; "sqlite" = shared by every worker process using the same path
+    if backend == "memory":
+        return AnswerCache(**options)
+    if backend == "sqlite":
+        return SQLiteAnswerCache(path, **options)
+    raise ValueError(f"Unknown state backend '{backend}' (expected 'memory' or 'sqlite')")
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -1,30 +1,54 @@
 # --- IMPORTS ---
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
 import json
 import os
-import io
 import hashlib
+import secrets
+import time
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-import chromadb
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.llms import Ollama
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.documents import Document as LangchainDocument
+from langchain_core.documents import Document
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from starlette.middleware.sessions import SessionMiddleware
 
 # Import สำหรับอ่านไฟล์
-from pypdf import PdfReader
-from docx import Document
+from document_parsers import SECTION_READERS, get_file_type, iter_pdf_pages
+from chunking import iter_chunks, make_text_splitter
+
+from embedding_cache import EmbeddingCache, ChunkIdAssigner, chunk_hash, embed_with_cache
+from document_registry import DocumentRegistry
+from ingest_jobs import IngestJobManager, IngestError, SQLiteJobStore
+from answer_cache import make_answer_cache, make_scope
+from embedding_pipeline import EmbeddingPipeline, EmbeddingBatchError
+from session_store import make_session_store
+from shared_state import ChangeFeed, ChangeFollower, LeaseStore
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, saved_seq
+from rerank import Candidate, make_reranker
+from local_vector_index import open_collection
+from sharding import open_sharded_collection
+from context_packing import ContextPacker
+from query_embedder import QueryEmbedder
+from conversation_memory import BackgroundSummaryMemory, SessionTaskQueue, SharedSummaryMemory
+from uploads import UploadLimitMiddleware, receive_upload
+from http_clients import (
+    CircuitBreaker, CircuitOpenError, GuardedCollection, OllamaHTTP,
+    PooledChatOllama, PooledOllama, PooledOllamaEmbeddings, chroma_health, make_chroma_client,
+)
+from metrics import (
+    Gauge, MetricsMiddleware, StageTimer, count_errors, render_metrics,
+    INGEST_STAGE_SECONDS, INGEST_DURATION_SECONDS, INGEST_CHUNKS, INGEST_JOBS_TOTAL,
+    QUERY_STAGE_SECONDS, QUERIES_TOTAL, BACKEND_ERRORS_TOTAL, HTTP_REQUESTS_IN_FLIGHT, HTTP_REQUESTS_TOTAL,
+    CIRCUIT_BREAKER_OPEN, QUERY_EMBED_BATCH_SIZE, SHARD_QUERY_SECONDS,
+)
 
 app = FastAPI()
 
@@ -45,105 +69,401 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Uploads larger than MAX_UPLOAD_MB are rejected with 413 while they stream in (0 = no limit)
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024)
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES, paths=["/ingest"])
+app.add_middleware(MetricsMiddleware, in_flight=HTTP_REQUESTS_IN_FLIGHT, requests_total=HTTP_REQUESTS_TOTAL)
+
 # --- Configuration สำหรับ RAG ---
 CHROMA_HOST = os.getenv("CHROMA_HOST", "10.10.32.78")
 CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
 COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "rag_documents")
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "nomic-embed-text:latest")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# true = batched /api/embed (normalized vectors); must match the setting the collection was ingested with
+OLLAMA_EMBED_BATCH_API = os.getenv("OLLAMA_EMBED_BATCH_API", "false").lower() in ("1", "true", "yes")
+# Cached vectors from the two APIs differ, so they are kept under separate keys
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL_NAME}@api/embed" if OLLAMA_EMBED_BATCH_API else EMBEDDING_MODEL_NAME
+RAG_DATA_DIR = os.getenv("RAG_DATA_DIR", "rag_data")
+# "chroma" = remote ChromaDB HttpClient; "local" = in-process index with snapshots under LOCAL_INDEX_DIR
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(RAG_DATA_DIR, "vector_index"))
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")
+LOCAL_INDEX_SNAPSHOT_EVERY = int(os.getenv("LOCAL_INDEX_SNAPSHOT_EVERY", "1000"))
+# Sharding: one collection per value of this metadata key (e.g. document_type); empty = a single collection.
+# Queries filtered on the key search only that shard, others search all shards in parallel
+SHARD_KEY = os.getenv("SHARD_KEY", "")
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(RAG_DATA_DIR, "embedding_cache.sqlite3"))
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", os.path.join(RAG_DATA_DIR, "document_registry.sqlite3"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "500"))
+# Thread pools for blocking client calls made from async endpoints
+IO_THREADS = int(os.getenv("IO_THREADS", "16"))
+LLM_THREADS = int(os.getenv("LLM_THREADS", "8"))
+# Background conversation summaries get their own small pool, so a burst of them never queues ahead of answers
+SUMMARY_THREADS = int(os.getenv("SUMMARY_THREADS", "2"))
+# Embedding stage: chunks per request to Ollama, requests in flight per ingest job, retries per failed batch
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+# PDFs with at least this many pages are extracted on a process pool of PDF_PARSE_PROCESSES workers
+PDF_PARSE_PROCESSES = int(os.getenv("PDF_PARSE_PROCESSES", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+# Answer cache: 0 entries disables it; a similarity threshold of 0 disables embedding-similarity hits
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+# Conversation memories: LRU cap on sessions, idle timeout, optional total byte budget (0 = no budget)
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", "0"))
+# Shared state: "memory" keeps sessions, the answer cache and ingest job status in this process (one uvicorn
+# worker); "sqlite" keeps them in STATE_DB_PATH so several workers (uvicorn --workers N) on this machine share them
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(RAG_DATA_DIR, "shared_state.sqlite3"))
+SHARED_STATE = STATE_BACKEND == "sqlite"
+# Seconds between checks for collection writes made by other workers (each query also checks)
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "1"))
+# With STATE_BACKEND=sqlite the BM25 index is saved here, so one worker reads the collection and the others
+# load the file and replay the collection changes made since
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(RAG_DATA_DIR, f"lexical_index-{COLLECTION_NAME}.jsonl.gz"))
+# Hybrid retrieval: BM25 and vector candidates (at least top_k each) fused with reciprocal-rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Re-ranking of an over-fetched pool: "mmr", "none" or "module:function"; MMR_MAX_PER_SOURCE=0 means no cap
+RERANKER = os.getenv("RERANKER", "mmr")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+MMR_MAX_PER_SOURCE = int(os.getenv("MMR_MAX_PER_SOURCE", "0"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "5"))
+# Chunking: "tokens" sizes chunks in CHUNK_TOKENIZER tokens (the embedding model's tokenizer) and cuts at
+# headings, paragraphs, lines, sentences and Thai words; "characters" is the previous 1000-character splitter
+CHUNKER = os.getenv("CHUNKER", "tokens")
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "nomic-ai/nomic-embed-text-v1.5")
+# Prompt context: token budget for retrieved passages (0 = no limit), tokenizer used to count, passage order.
+# The tokenizer must match the generation model (llama3.1:8b); the default is an ungated copy of its tokenizer
+# files (the weights are not downloaded). Without it, tokens are estimated from byte length
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "NousResearch/Meta-Llama-3.1-8B-Instruct")
+CONTEXT_ORDER = os.getenv("CONTEXT_ORDER", "relevance")
+# Connections to Ollama and ChromaDB: keep-alive pool size, timeouts in seconds, retries with exponential
+# backoff on connection errors and 502/503/504, and a circuit breaker per backend that rejects calls for
+# CIRCUIT_RESET_TIMEOUT seconds after CIRCUIT_FAILURE_THRESHOLD consecutive failures (0 = no breaker)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+CHROMA_READ_TIMEOUT = float(os.getenv("CHROMA_READ_TIMEOUT", "60"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+# Query embeddings: queries arriving within QUERY_EMBED_MAX_WAIT_MS are embedded together (needs
+# OLLAMA_EMBED_BATCH_API, otherwise one request per query), plus an LRU of recent query vectors
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "16"))
+QUERY_EMBED_MAX_WAIT_MS = float(os.getenv("QUERY_EMBED_MAX_WAIT_MS", "5"))
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024"))
+QUERY_EMBED_CONCURRENCY = int(os.getenv("QUERY_EMBED_CONCURRENCY", "4"))
+# Stored vectors sampled at startup to check they come from the same Ollama API as query vectors
+EMBEDDING_CHECK_SAMPLE = int(os.getenv("EMBEDDING_CHECK_SAMPLE", "16"))
+
+RAG_PROMPT_TEMPLATE = """
+คุณคือผู้ช่วย AI ที่เชี่ยวชาญในการตอบคำถามจากข้อมูลที่ให้ไว้เท่านั้น
+คุณจะได้รับ:
+- ประวัติการสนทนา (ถ้ามี)
+- บริบทจากเอกสาร (context)
+
+กรุณาตอบคำถามโดยอ้างอิงเฉพาะข้อมูลที่มีในบริบทเท่านั้น
+หากบริบทไม่เพียงพอในการตอบคำถาม ให้ตอบว่า:
+"ไม่สามารถให้คำตอบได้ เนื่องจากไม่มีข้อมูล"
+
+โปรดตอบอย่างสุภาพ ละเอียด และครบถ้วนที่สุด โดยใช้คำลงท้ายว่า "ครับ"
+
+---
+ประวัติการสนทนา:
+{chat_history}
+---
+บริบทจากเอกสาร:
+{context}
+---
+คำถาม:
+{question}
+
+คำตอบ:
+"""
 
 # --- Global Instances ---
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    is_separator_regex=False,
+rag_prompt = PromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+
+text_splitter = make_text_splitter(CHUNKER, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_TOKENIZER)
+context_packer = ContextPacker(
+    tokenizer_name=CONTEXT_TOKENIZER,
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    max_overlap=getattr(text_splitter, "max_overlap_chars", text_splitter._chunk_overlap * 2),
+    order=CONTEXT_ORDER,
 )
 
 embeddings = None
+embedding_cache = None
+document_registry = None
 chroma_client = None
 collection = None
-vectorstore = None
-retriever = None
 llm_qa = None
 llm_memory_summarizer = None
-app.state.memories = {}
+app.state.memories = make_session_store(
+    STATE_BACKEND,
+    STATE_DB_PATH,
+    max_sessions=SESSION_MAX_COUNT,
+    idle_ttl_seconds=SESSION_IDLE_TTL,
+    max_total_bytes=SESSION_MAX_BYTES,
+)
+Gauge("rag_active_sessions", "Conversation sessions held in memory.", callback=lambda: len(app.state.memories))
+Gauge("rag_session_bytes", "Approximate bytes held by conversation memories.", callback=lambda: app.state.memories.total_bytes)
+# Coordination between worker processes (STATE_BACKEND=sqlite only): leases for work one process does at a
+# time, and a feed of collection writes each process replays into its in-memory BM25 index
+leases = LeaseStore(STATE_DB_PATH) if SHARED_STATE else None
+LOCAL_INDEX_LEASE = f"vector_index:{os.path.abspath(LOCAL_INDEX_DIR)}"
+# Held for the life of the process; released early if the process exits without shutting down
+LOCAL_INDEX_LEASE_SECONDS = 365 * 24 * 3600
+change_feed = ChangeFeed(STATE_DB_PATH) if SHARED_STATE else None
+collection_changes = None
+ingest_jobs = IngestJobManager(
+    max_workers=INGEST_WORKERS,
+    history_limit=INGEST_JOB_HISTORY,
+    store=SQLiteJobStore(STATE_DB_PATH) if SHARED_STATE else None,
+    leases=leases,
+)
+# Chroma, retrieval and file I/O run on io_executor; answer generation on llm_executor, so slow LLM calls
+# cannot starve the pool that /files_list and /delete_document depend on.
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+llm_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+# Conversation summaries run after the response, one at a time per session, on summary_executor
+summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_THREADS, thread_name_prefix="summary")
+summary_queue = SessionTaskQueue(summary_executor)
+pdf_process_pool = ProcessPoolExecutor(
+    max_workers=PDF_PARSE_PROCESSES,
+    mp_context=multiprocessing.get_context("spawn"),
+) if PDF_PARSE_PROCESSES > 1 else None
+embedding_pipeline = EmbeddingPipeline(
+    batch_size=EMBED_BATCH_SIZE,
+    concurrency=EMBED_CONCURRENCY,
+    max_retries=EMBED_MAX_RETRIES,
+    max_workers=EMBED_CONCURRENCY * INGEST_WORKERS,
+)
+lexical_index = LexicalIndex() if HYBRID_SEARCH else None
+reranker = make_reranker(RERANKER, lambda_mult=MMR_LAMBDA, max_per_source=MMR_MAX_PER_SOURCE, budget_ms=RERANK_BUDGET_MS)
+answer_cache = make_answer_cache(
+    STATE_BACKEND,
+    STATE_DB_PATH,
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+) if ANSWER_CACHE_SIZE > 0 else None
+
+ollama_breaker = CircuitBreaker("ollama", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, state_gauge=CIRCUIT_BREAKER_OPEN)
+chroma_breaker = CircuitBreaker("chroma", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, state_gauge=CIRCUIT_BREAKER_OPEN)
+# Shared by the embedding model and both LLMs, so all Ollama calls reuse one keep-alive pool
+ollama_http = OllamaHTTP(
+    OLLAMA_BASE_URL,
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=OLLAMA_READ_TIMEOUT,
+    max_retries=HTTP_MAX_RETRIES,
+    backoff=HTTP_RETRY_BACKOFF,
+    keepalive=HTTP_KEEPALIVE,
+    breaker=ollama_breaker,
+)
+query_embedder = QueryEmbedder(
+    lambda texts: embeddings.embed_queries(texts),
+    max_batch_size=QUERY_EMBED_MAX_BATCH if OLLAMA_EMBED_BATCH_API else 1,
+    max_wait_ms=QUERY_EMBED_MAX_WAIT_MS,
+    cache_size=QUERY_EMBED_CACHE_SIZE,
+    concurrency=QUERY_EMBED_CONCURRENCY,
+    batch_size_histogram=QUERY_EMBED_BATCH_SIZE,
+)
 
 # --- Helper Functions ---
-def get_pdf_text(pdf_file):
-    pdf_reader = PdfReader(pdf_file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() or ""
-    return text
-
-def get_docx_text(docx_file):
-    document = Document(docx_file)
-    text = ""
-    for paragraph in document.paragraphs:
-        text += paragraph.text + "\n"
-    return text
-
-def get_txt_text(txt_file):
-    return txt_file.read().decode('utf-8')
-
-# เพิ่มฟังก์ชันสำหรับอ่านไฟล์ .md
-def get_md_text(md_file):
-    return md_file.read().decode('utf-8')
+async def run_blocking(executor, fn, *args, **kwargs):
+    # Keep the event loop free while a blocking client call runs on a worker thread
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+async def run_state(fn, *args, **kwargs):
+    # Session and answer-cache calls: the SQLite backend does file I/O, so it runs on io_executor;
+    # the in-memory one is cheaper to call inline than to hand to a thread
+    if SHARED_STATE:
+        return await run_blocking(io_executor, fn, *args, **kwargs)
+    return fn(*args, **kwargs)
 
 def get_memory(request: Request):
-    session_id = request.session.get("session_id", "default_session_id")
-    if session_id not in app.state.memories:
+    if not llm_memory_summarizer:
+        raise HTTPException(status_code=500, detail="LLM สำหรับ Memory ยังไม่ได้ถูก Initialize")
+    session_id = request.session.get("session_id")
+    if session_id is None:
+        # Each client gets its own session cookie instead of sharing one conversation
+        session_id = secrets.token_urlsafe(16)
+        request.session["session_id"] = session_id
+    request.state.session_id = session_id
+
+    memory_options = dict(llm=llm_memory_summarizer, max_token_limit=1000, memory_key="chat_history", return_messages=True)
+
+    def create_memory():
+        if SHARED_STATE:
+            # A view onto the shared store, built on every request; the conversation itself lives in STATE_DB_PATH
+            return SharedSummaryMemory(store=app.state.memories, session_id=session_id, **memory_options)
         print(f"Initializing new memory for session: {session_id}")
-        if llm_memory_summarizer:
-            app.state.memories[session_id] = ConversationSummaryBufferMemory(
-                llm=llm_memory_summarizer,
-                max_token_limit=1000,
-                memory_key="chat_history",
-                return_messages=True
-            )
-        else:
-            raise HTTPException(status_code=500, detail="LLM สำหรับ Memory ยังไม่ได้ถูก Initialize")
-    return app.state.memories[session_id]
+        return BackgroundSummaryMemory(**memory_options)
+
+    return app.state.memories.get_or_create(session_id, create_memory)
+
+def append_turn(session_id, memory, query, answer):
+    with QUERY_STAGE_SECONDS.time(stage="memory_save"):
+        memory.save_context({"input": query}, {"output": answer})
+    app.state.memories.update_size(session_id)
+
+async def save_memory(request: Request, memory, query, answer):
+    # Appending the turn is cheap; summarizing it into the running summary is an LLM call, queued for later
+    session_id = request.state.session_id
+    await run_state(append_turn, session_id, memory, query, answer)
+    summary_queue.submit(session_id, summarize_memory, session_id, memory)
+
+def summarize_memory(session_id, memory):
+    with QUERY_STAGE_SECONDS.time(stage="memory_summarize"), count_errors(BACKEND_ERRORS_TOTAL, backend="ollama", operation="summarize"):
+        summarized = memory.summarize()
+    if summarized:
+        app.state.memories.update_size(session_id)
+
+async def load_chat_history(memory):
+    with QUERY_STAGE_SECONDS.time(stage="memory_load"):
+        return (await run_blocking(io_executor, memory.load_memory_variables, {}))["chat_history"]
+
+async def timed_retrieval(query, filters, top_k, query_embedding=None):
+    with QUERY_STAGE_SECONDS.time(stage="retrieval"):
+        return await run_blocking(io_executor, retrieve_documents, query, filters, top_k, query_embedding)
+
+async def prepare_query(memory, query, filters, top_k):
+    # Returns (chat_history, cache_lookup, relevant_docs); relevant_docs is None on an answer-cache hit.
+    # Retrieval does not depend on chat history, so it runs alongside the memory load and the cache lookup
+    # (the query embedder shares one embedding between retrieval and the similarity lookup). It is only
+    # held back when an exact cached answer exists and would make it wasted work
+    history_task = asyncio.ensure_future(load_chat_history(memory))
+    retrieval_task = None
+    if answer_cache is None or not await run_state(answer_cache.contains, answer_cache.make_key(query, filters, top_k)):
+        retrieval_task = asyncio.ensure_future(timed_retrieval(query, filters, top_k))
+    try:
+        chat_history = await history_task
+        cache_lookup = await lookup_answer_cache(query, filters, top_k, chat_history)
+        if cache_lookup.response is not None:
+            if retrieval_task is not None:
+                retrieval_task.cancel()
+            return chat_history, cache_lookup, None
+        if retrieval_task is None:
+            retrieval_task = asyncio.ensure_future(timed_retrieval(query, filters, top_k, cache_lookup.query_embedding))
+        return chat_history, cache_lookup, await retrieval_task
+    except BaseException:
+        history_task.cancel()
+        if retrieval_task is not None:
+            retrieval_task.cancel()
+        raise
 
 def format_docs(docs):
-    return "\n\n".join([doc.page_content for doc in docs])
+    # Adjacent chunks are merged without their shared overlap, then trimmed to CONTEXT_TOKEN_BUDGET
+    context, _ = context_packer.pack(docs)
+    return context
+
+def embed_documents_cached(texts, text_hashes):
+    with count_errors(BACKEND_ERRORS_TOTAL, backend="ollama", operation="embed"):
+        return embed_with_cache(embeddings, embedding_cache, EMBEDDING_CACHE_KEY, texts, text_hashes)
 
 # --- Event Listener for FastAPI startup ---
 @app.on_event("startup")
 async def startup_event():
-    global embeddings, chroma_client, collection, vectorstore, retriever, llm_qa, llm_memory_summarizer
+    global embeddings, embedding_cache, document_registry, chroma_client, collection, collection_changes, llm_qa, llm_memory_summarizer
+
+    # Load the context and chunking tokenizers off the request path
+    io_executor.submit(context_packer.load_tokenizer)
+    if CHUNKER == "tokens":
+        io_executor.submit(text_splitter.tokens.load)
 
     try:
-        embeddings = OllamaEmbeddings(base_url="http://localhost:11434", model=EMBEDDING_MODEL_NAME)
+        embeddings = PooledOllamaEmbeddings(
+            base_url=OLLAMA_BASE_URL, model=EMBEDDING_MODEL_NAME, http=ollama_http, batch_api=OLLAMA_EMBED_BATCH_API,
+        )
         print(f"Embedding model '{EMBEDDING_MODEL_NAME}' initialized successfully.")
     except Exception as e:
         print(f"ERROR: Could not initialize embedding model '{EMBEDDING_MODEL_NAME}'. Error: {e}")
         embeddings = None
 
     try:
-        chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=int(CHROMA_PORT))
-        collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
-        print(f"Connected to ChromaDB at {CHROMA_HOST}:{CHROMA_PORT}, using collection: {COLLECTION_NAME}")
-        print(f"Current documents in collection: {collection.count()}")
-        if embeddings:
-            vectorstore = Chroma(
-                client=chroma_client,
-                collection_name=COLLECTION_NAME,
-                embedding_function=embeddings
+        embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+        print(f"Embedding cache at '{EMBEDDING_CACHE_PATH}' ({embedding_cache.count(EMBEDDING_CACHE_KEY)} vectors for this model).")
+    except Exception as e:
+        print(f"WARNING: Could not open embedding cache at '{EMBEDDING_CACHE_PATH}'. Chunks will always be re-embedded. Error: {e}")
+        embedding_cache = None
+
+    try:
+        document_registry = DocumentRegistry(DOCUMENT_REGISTRY_PATH)
+        print(f"Document registry at '{DOCUMENT_REGISTRY_PATH}' ({document_registry.count()} documents).")
+    except Exception as e:
+        print(f"ERROR: Could not open document registry at '{DOCUMENT_REGISTRY_PATH}'. Error: {e}")
+        document_registry = None
+
+    try:
+        if VECTOR_BACKEND == "chroma":
+            chroma_client = make_chroma_client(
+                CHROMA_HOST, CHROMA_PORT, pool_size=HTTP_POOL_SIZE, keepalive=HTTP_KEEPALIVE,
+                connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=CHROMA_READ_TIMEOUT,
+            )
+        if VECTOR_BACKEND == "local" and leases is not None and not leases.acquire(LOCAL_INDEX_LEASE, LOCAL_INDEX_LEASE_SECONDS):
+            # The local index is a single-writer store: a second process would overwrite its snapshots and log
+            raise RuntimeError(f"the local index is already open in worker {leases.holder(LOCAL_INDEX_LEASE)}; "
+                               "VECTOR_BACKEND=local supports one worker process, use chroma for several")
+        local_options = dict(dtype=LOCAL_INDEX_DTYPE, index_mode=LOCAL_INDEX_MODE, snapshot_every=LOCAL_INDEX_SNAPSHOT_EVERY)
+        guard = None
+        if VECTOR_BACKEND == "chroma":
+            guard = lambda shard: GuardedCollection(shard, chroma_breaker, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF)
+        if SHARD_KEY:
+            collection = open_sharded_collection(
+                VECTOR_BACKEND, COLLECTION_NAME, SHARD_KEY,
+                chroma_client=chroma_client, local_path=LOCAL_INDEX_DIR, wrap=guard,
+                max_workers=SHARD_FANOUT_WORKERS, latency_histogram=SHARD_QUERY_SECONDS, **local_options,
             )
-            retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+            print(f"Sharding collection '{COLLECTION_NAME}' by '{SHARD_KEY}': {len(collection.shard_names())} shards.")
         else:
-            print("WARNING: Embeddings model not initialized, vectorstore and retriever will not be available.")
+            collection = open_collection(
+                VECTOR_BACKEND, COLLECTION_NAME, chroma_client=chroma_client, local_path=LOCAL_INDEX_DIR, **local_options,
+            )
+            if guard:
+                collection = guard(collection)
+        if VECTOR_BACKEND == "local":
+            print(f"Opened local vector index at {LOCAL_INDEX_DIR}, using collection: {COLLECTION_NAME}")
+        else:
+            print(f"Connected to ChromaDB at {CHROMA_HOST}:{CHROMA_PORT}, using collection: {COLLECTION_NAME}")
+        chunk_count = collection.count()
+        print(f"Current documents in collection: {chunk_count}")
+        if change_feed is not None:
+            collection_changes = ChangeFollower(change_feed, apply_collection_changes)
+            collection_changes.start(STATE_SYNC_INTERVAL, sync_collection_changes)
+        if document_registry and document_registry.count() == 0 and chunk_count > 0:
+            # Collection predates the registry: build it once from chunk metadata in the background
+            io_executor.submit(bootstrap_document_registry)
+        if lexical_index:
+            # The BM25 index is built or loaded in the background; until then, retrieval is vector-only
+            io_executor.submit(build_lexical_index)
+        if chunk_count > 0:
+            io_executor.submit(check_stored_embeddings)
     except Exception as e:
-        print(f"FATAL ERROR: Could not connect to ChromaDB at {CHROMA_HOST}:{CHROMA_PORT}. Error: {e}")
-        chroma_client = None
+        print(f"FATAL ERROR: Could not open vector backend '{VECTOR_BACKEND}' (ChromaDB at {CHROMA_HOST}:{CHROMA_PORT}). Error: {e}")
         collection = None
-        vectorstore = None
-        retriever = None
 
     try:
-        llm_qa = Ollama(base_url="http://localhost:11434", model="llama3.1:8b", temperature=0.7)
-        llm_memory_summarizer = ChatOllama(base_url="http://localhost:11434", model="llama3.1:8b", temperature=0.1)
+        llm_qa = PooledOllama(base_url=OLLAMA_BASE_URL, model="llama3.1:8b", temperature=0.7, http=ollama_http)
+        llm_memory_summarizer = PooledChatOllama(base_url=OLLAMA_BASE_URL, model="llama3.1:8b", temperature=0.1, http=ollama_http)
         print("LLMs initialized successfully.")
     except Exception as e:
         print(f"ERROR: Could not initialize LLM models. Error: {e}")
@@ -151,6 +471,35 @@ async def startup_event():
         llm_memory_summarizer = None
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    ingest_jobs.shutdown()
+    if collection_changes is not None:
+        collection_changes.stop()
+        if lexical_index and lexical_index.ready and leases.acquire("lexical_index", ttl_seconds=3600):
+            # The next start loads this instead of reading the collection; workers stopping after the first
+            # one find it already up to date
+            try:
+                seq = collection_changes.seq
+                if (saved_seq(LEXICAL_INDEX_PATH) or -1) < seq:
+                    save_lexical_index(seq)
+            finally:
+                leases.release("lexical_index")
+    embedding_pipeline.shutdown()
+    query_embedder.shutdown()
+    if pdf_process_pool:
+        pdf_process_pool.shutdown(wait=False, cancel_futures=True)
+    io_executor.shutdown(wait=False)
+    llm_executor.shutdown(wait=False)
+    summary_executor.shutdown(wait=False)
+    if (VECTOR_BACKEND == "local" or SHARD_KEY) and collection is not None:
+        # Fold the write-ahead log into a snapshot so the next start does not replay it
+        collection.close()
+    if VECTOR_BACKEND == "local" and leases is not None:
+        leases.release(LOCAL_INDEX_LEASE)
+    await ollama_http.aclose()
+
+
 # --- API Endpoints ---
 @app.get("/")
 async def root():
@@ -181,6 +530,10 @@ async def get_dashboard():
                 border-radius: 5px;
             }
             .file-name { font-size: 1.1em; flex-grow: 1; }
+            .file-details { color: #777; font-size: 0.85em; margin-left: 10px; white-space: nowrap; }
+            .toolbar { display: flex; gap: 10px; margin-bottom: 10px; }
+            .toolbar input { flex-grow: 1; padding: 6px; }
+            .pager { display: flex; justify-content: space-between; align-items: center; margin-top: 10px; }
             .delete-btn {
                 background-color: #f44336;
                 color: white;
@@ -209,49 +562,115 @@ async def get_dashboard():
             <h1>RAG Document Dashboard</h1>
             <p>Documents in your ChromaDB collection. You can view and delete them here.</p>
             <div class="status-message" id="statusMessage"></div>
+            <div class="toolbar">
+                <input type="search" id="searchInput" placeholder="Search filenames...">
+            </div>
             <ul id="fileList" class="file-list">
                 <li>Loading files...</li>
             </ul>
+            <div class="pager">
+                <button id="prevPage">&laquo; Previous</button>
+                <span id="pageInfo"></span>
+                <button id="nextPage">Next &raquo;</button>
+            </div>
         </div>
 
         <script>
             const fileListElement = document.getElementById('fileList');
             const statusMessageElement = document.getElementById('statusMessage');
+            const searchInputElement = document.getElementById('searchInput');
+            const pageInfoElement = document.getElementById('pageInfo');
+            const PAGE_SIZE = 50;
+            // Pages are fetched by cursor (the last filename of the previous page); cursors[i] opens page i
+            let cursors = [null];
+            let nextCursor = null;
+            let totalFiles = 0;
+            let searchTimer = null;
 
             async function fetchFiles() {
                 try {
-                    const response = await fetch('/files_list');
+                    const params = new URLSearchParams({ limit: PAGE_SIZE });
+                    const cursor = cursors[cursors.length - 1];
+                    if (cursor !== null) {
+                        params.set('after', cursor);
+                    }
+                    if (searchInputElement.value) {
+                        params.set('q', searchInputElement.value);
+                    }
+                    // The server answers with an ETag, so unchanged pages come back as 304 from the browser cache
+                    const response = await fetch(`/documents?${params}`);
                     if (!response.ok) {
                         throw new Error(`HTTP error! status: ${response.status}`);
                     }
-                    const files = await response.json();
-                    renderFileList(files);
+                    const page = await response.json();
+                    totalFiles = page.total;
+                    nextCursor = page.next_after;
+                    renderFileList(page.items);
                 } catch (error) {
                     console.error('Failed to fetch files:', error);
                     fileListElement.innerHTML = '<li>Error loading files.</li>';
                 }
             }
 
+            function formatSize(bytes) {
+                if (bytes === null || bytes === undefined) return '';
+                if (bytes < 1024) return `${bytes} B`;
+                if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+                return `${(bytes / 1024 / 1024).toFixed(1)} MB`;
+            }
+
             function renderFileList(files) {
                 fileListElement.innerHTML = '';
+                const firstItem = (cursors.length - 1) * PAGE_SIZE;
+                const lastItem = Math.min(firstItem + files.length, totalFiles);
+                pageInfoElement.textContent = files.length ? `${firstItem + 1}-${lastItem} of ${totalFiles}` : '';
+                document.getElementById('prevPage').disabled = cursors.length === 1;
+                document.getElementById('nextPage').disabled = nextCursor === null;
                 if (files.length === 0) {
                     fileListElement.innerHTML = '<li>No documents found in the collection.</li>';
                     return;
                 }
-                files.forEach(filename => {
+                files.forEach(file => {
                     const listItem = document.createElement('li');
                     listItem.className = 'file-item';
-                    listItem.innerHTML = `
-                        <span class="file-name">${filename}</span>
-                        <button class="delete-btn" data-filename="${filename}">Delete</button>
-                    `;
+
+                    const nameElement = document.createElement('span');
+                    nameElement.className = 'file-name';
+                    nameElement.textContent = file.filename;
+
+                    const detailsElement = document.createElement('span');
+                    detailsElement.className = 'file-details';
+                    const ingestedAt = new Date(file.ingested_at * 1000).toLocaleString();
+                    detailsElement.textContent = `${file.chunk_count} chunks ${formatSize(file.byte_size)} · ${ingestedAt}`;
+
+                    const deleteButton = document.createElement('button');
+                    deleteButton.className = 'delete-btn';
+                    deleteButton.dataset.filename = file.filename;
+                    deleteButton.textContent = 'Delete';
+                    deleteButton.addEventListener('click', handleDelete);
+
+                    listItem.append(nameElement, detailsElement, deleteButton);
                     fileListElement.appendChild(listItem);
                 });
-                document.querySelectorAll('.delete-btn').forEach(button => {
-                    button.addEventListener('click', handleDelete);
-                });
             }
 
+            searchInputElement.addEventListener('input', () => {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => { cursors = [null]; fetchFiles(); }, 300);
+            });
+            document.getElementById('prevPage').addEventListener('click', () => {
+                if (cursors.length > 1) {
+                    cursors.pop();
+                }
+                fetchFiles();
+            });
+            document.getElementById('nextPage').addEventListener('click', () => {
+                if (nextCursor !== null) {
+                    cursors.push(nextCursor);
+                }
+                fetchFiles();
+            });
+
             async function handleDelete(event) {
                 const filename = event.target.dataset.filename;
                 if (!confirm(`Are you sure you want to delete all chunks for "${filename}"?`)) {
@@ -297,117 +716,394 @@ async def get_dashboard():
     """
     return HTMLResponse(content=html_content, status_code=200)
 
+def registry_etag(*parts):
+    return '"' + hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()[:20] + '"'
+
+def check_registry_ready():
+    if document_registry is None:
+        raise HTTPException(status_code=500, detail="Document registry not initialized.")
+
 @app.get("/files_list")
-async def get_files_list():
-    if collection is None:
-        raise HTTPException(status_code=500, detail="ChromaDB not initialized.")
-    
+async def get_files_list(request: Request, after: str = None, limit: int = None, q: str = None):
+    check_registry_ready()
+
     try:
-        results = collection.get(limit=collection.count(), include=['metadatas'])
-        unique_filenames = set()
-        if results['metadatas']:
-            for metadata in results['metadatas']:
-                if 'source_filename' in metadata:
-                    unique_filenames.add(metadata['source_filename'])
-        
-        return list(unique_filenames)
+        version = await run_blocking(io_executor, document_registry.version)
+        etag = registry_etag("files_list", version, after, limit, q)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        # Next page: pass the last filename as after
+        documents, total = await run_blocking(
+            io_executor, document_registry.list, after=after, limit=limit, search=q, with_total=True
+        )
+        return JSONResponse(
+            content=[document["filename"] for document in documents],
+            headers={"ETag": etag, "Cache-Control": "no-cache", "X-Total-Count": str(total)},
+        )
     except Exception as e:
-        print(f"Error fetching filenames from ChromaDB: {e}")
+        print(f"Error fetching filenames from document registry: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve filenames from the database.")
 
+@app.get("/documents")
+async def get_documents(request: Request, after: str = None, limit: int = 50, q: str = None):
+    check_registry_ready()
+    limit = max(1, min(limit, 500))
+
+    version = await run_blocking(io_executor, document_registry.version)
+    etag = registry_etag("documents", version, after, limit, q)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    documents, total = await run_blocking(
+        io_executor, document_registry.list, after=after, limit=limit, search=q, with_total=True
+    )
+    # next_after is the cursor for the following page, None on the last one
+    next_after = documents[-1]["filename"] if len(documents) == limit else None
+    return JSONResponse(
+        content={"items": documents, "total": total, "after": after, "next_after": next_after, "limit": limit},
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+def check_stored_embeddings():
+    # /api/embed returns L2-normalized vectors and /api/embeddings does not; under L2 distance, queries
+    # embedded through the other API than the stored chunks rank wrongly, so compare a sample of norms
+    try:
+        sample = collection.get(limit=EMBEDDING_CHECK_SAMPLE, include=["embeddings"])["embeddings"]
+        if sample is None or len(sample) == 0:
+            return
+        normalized = all(abs(sum(x * x for x in vector) ** 0.5 - 1) < 1e-3 for vector in sample)
+    except Exception as e:
+        print(f"WARNING: Could not sample stored embeddings to check OLLAMA_EMBED_BATCH_API. Error: {e}")
+        return
+    if OLLAMA_EMBED_BATCH_API and not normalized:
+        print("WARNING: Stored chunk vectors are not normalized (ingested through /api/embeddings), but "
+              "OLLAMA_EMBED_BATCH_API=true embeds queries through /api/embed. Re-ingest, or set it to false.")
+    elif not OLLAMA_EMBED_BATCH_API and normalized:
+        print("WARNING: Stored chunk vectors are normalized (ingested through /api/embed), but "
+              "OLLAMA_EMBED_BATCH_API=false embeds queries through /api/embeddings. Set it to true, "
+              "which also batches concurrent query embeddings.")
+    elif not OLLAMA_EMBED_BATCH_API:
+        print("Query embeddings are not batched: /api/embeddings takes one text per request (OLLAMA_EMBED_BATCH_API=false).")
+
+def build_lexical_index():
+    # Runs in the background; retrieval stays vector-only until the index is ready
+    try:
+        if collection_changes is None:
+            count = lexical_index.rebuild_from_collection(collection)
+            print(f"Lexical (BM25) index built from ChromaDB: {count} chunks.")
+            return
+        if load_lexical_index():
+            return
+        # One worker reads the collection and saves the index; the others wait for it and load the file
+        with leases.hold("lexical_index", ttl_seconds=3600):
+            if load_lexical_index():
+                return
+            collection_changes.skip_to_latest()
+            seq = collection_changes.seq
+            count = lexical_index.rebuild_from_collection(collection)
+            print(f"Lexical (BM25) index built from ChromaDB: {count} chunks.")
+            save_lexical_index(seq)
+    except Exception as e:
+        print(f"ERROR: Could not build lexical index from ChromaDB. Retrieval stays vector-only. Error: {e}")
+
+def load_lexical_index():
+    # The saved index is used when the change feed still holds every change made since it was written;
+    # a chunk count that differs from the collection afterwards means it missed writes made outside the
+    # API (view_chroma_2.py, collection_snapshot.py), and the caller reads the collection instead
+    seq = lexical_index.load(LEXICAL_INDEX_PATH, max_age=change_feed.retention_seconds)
+    if seq is None:
+        return False
+    collection_changes.rewind(seq)
+    collection_changes.poll(wait=True)
+    count, expected = lexical_index.count(), collection.count()
+    if count != expected:
+        print(f"WARNING: Saved lexical index has {count} chunks but the collection has {expected}; rebuilding it.")
+        lexical_index.clear()
+        return False
+    print(f"Lexical (BM25) index loaded from {LEXICAL_INDEX_PATH}: {count} chunks.")
+    return True
+
+def save_lexical_index(seq):
+    try:
+        count = lexical_index.save(LEXICAL_INDEX_PATH, seq)
+        print(f"Lexical (BM25) index saved to {LEXICAL_INDEX_PATH}: {count} chunks.")
+    except Exception as e:
+        print(f"WARNING: Could not save lexical index to {LEXICAL_INDEX_PATH}. Error: {e}")
+
+def bootstrap_document_registry():
+    # Every worker starts with an empty registry; only the one holding the lease scans the collection
+    if leases is not None and not leases.acquire("bootstrap_document_registry", ttl_seconds=3600):
+        print("Document registry is being rebuilt by another worker process.")
+        return
+    try:
+        if leases is not None and document_registry.count() > 0:
+            return
+        count = document_registry.rebuild_from_collection(collection)
+        print(f"Document registry rebuilt from ChromaDB: {count} documents.")
+    except Exception as e:
+        print(f"ERROR: Could not rebuild document registry from ChromaDB. Error: {e}")
+    finally:
+        if leases is not None:
+            leases.release("bootstrap_document_registry")
+
+def record_collection_change(op, filename):
+    # Tells the other workers to re-read this file's chunks into their BM25 indexes
+    if collection_changes is None:
+        return
+    try:
+        collection_changes.record(op, filename)
+    except Exception as e:
+        print(f"WARNING: Could not record change to '{filename}' for other workers. Error: {e}")
+
+def apply_collection_changes(changes):
+    # Writes made by other worker processes: pick up shards they created, re-read the files they changed.
+    # None means this worker fell too far behind the feed and rebuilds its index instead
+    if SHARD_KEY:
+        collection.refresh()
+    if lexical_index is None:
+        return
+    if changes is None:
+        count = lexical_index.rebuild_from_collection(collection)
+        print(f"Lexical (BM25) index rebuilt from ChromaDB after missing collection changes: {count} chunks.")
+        return
+    for filename in dict.fromkeys(source for _, _, source in changes):
+        lexical_index.reload_source(collection, filename)
+
+def sync_collection_changes():
+    if collection_changes is None:
+        return
+    try:
+        applied = collection_changes.poll()
+        if applied:
+            print(f"Applied {applied} collection changes made by other workers.")
+    except Exception as e:
+        print(f"WARNING: Could not apply collection changes made by other workers. Error: {e}")
+
+
+def iter_document_sections(file_path, filename):
+    reader, label = SECTION_READERS[get_file_type(filename)]
+    options = {}
+    if reader is iter_pdf_pages:
+        options = {"process_pool": pdf_process_pool, "min_pages_for_pool": PDF_PARALLEL_MIN_PAGES}
+    try:
+        yield from reader(file_path, **options)
+    except Exception as e:
+        raise IngestError(f"เกิดข้อผิดพลาดในการอ่านไฟล์ {label}: {e}")
+
+def run_ingest_job(job, file_path, filename, metadata_dict, file_info):
+    # Runs on an ingest worker thread. Parsing, splitting, embedding and upserting overlap:
+    # sections are parsed lazily, split incrementally and new chunks stream into the embedding pipeline.
+    job.set_stage("parse")
+    added_ids = []
+    timer = StageTimer()
+    started = time.perf_counter()
+    succeeded = False
+    try:
+        # Diff against what is already stored for this file instead of deleting everything:
+        # unchanged chunks keep their IDs and vectors, only new chunks are embedded, stale ones removed.
+        with count_errors(BACKEND_ERRORS_TOTAL, backend=VECTOR_BACKEND, operation="get"):
+            existing = collection.get(where={"_filename_hash": {"$eq": metadata_dict["_filename_hash"]}}, include=[])
+        existing_ids = set(existing['ids'])
+        seen_ids = set()
+        kept_ids = []
+        kept_metadatas = []
+        assign_id = ChunkIdAssigner(filename)
+        chunks_embedded = 0
+
+        def iter_new_chunks():
+            # Parsing happens inside the splitter's iteration; split time is the remainder
+            sections = timer.timed_iter("parse", iter_document_sections(file_path, filename))
+            for i, (chunk, page_number) in enumerate(timer.timed_iter("parse_and_split", iter_chunks(sections, text_splitter))):
+                if i == 0:
+                    job.set_stage("embed")
+                h = chunk_hash(chunk)
+                chunk_id = assign_id(h)
+                chunk_metadata = metadata_dict.copy()
+                chunk_metadata["chunk_id"] = i
+                chunk_metadata["_chunk_hash"] = h
+                if page_number is not None:
+                    chunk_metadata["page_number"] = page_number
+                seen_ids.add(chunk_id)
+                job.chunks_total = i + 1
+                if chunk_id in existing_ids:
+                    # Positions and user metadata may have changed even when the text did not
+                    kept_ids.append(chunk_id)
+                    kept_metadatas.append(chunk_metadata)
+                    job.chunks_done += 1
+                else:
+                    yield chunk_id, chunk, h, chunk_metadata
+
+        def embed_batch(batch):
+            with timer.time("embed"):
+                return embed_documents_cached([chunk for _, chunk, _, _ in batch], [h for _, _, h, _ in batch])
+
+        def add_batch(batch, result):
+            nonlocal chunks_embedded
+            chunk_embeddings, embedded = result
+            ids = [chunk_id for chunk_id, _, _, _ in batch]
+            with timer.time("upsert"), count_errors(BACKEND_ERRORS_TOTAL, backend=VECTOR_BACKEND, operation="add"):
+                collection.add(
+                    documents=[chunk for _, chunk, _, _ in batch],
+                    metadatas=[chunk_metadata for _, _, _, chunk_metadata in batch],
+                    embeddings=chunk_embeddings,
+                    ids=ids
+                )
+            added_ids.extend(ids)
+            if lexical_index:
+                lexical_index.add(ids, [chunk for _, chunk, _, _ in batch], [chunk_metadata for _, _, _, chunk_metadata in batch])
+            chunks_embedded += embedded
+            job.chunks_done += len(batch)
+
+        embed_stats = embedding_pipeline.run(iter_new_chunks(), embed_batch, add_batch, label=filename)
+
+        if not seen_ids:
+            raise IngestError("ไม่พบข้อความในเอกสารที่ประมวลผลได้")
+
+        job.set_stage("upsert")
+        stale_ids = [chunk_id for chunk_id in existing['ids'] if chunk_id not in seen_ids]
+        with timer.time("upsert"), count_errors(BACKEND_ERRORS_TOTAL, backend=VECTOR_BACKEND, operation="update"):
+            if kept_ids:
+                collection.update(ids=kept_ids, metadatas=kept_metadatas)
+            if stale_ids:
+                collection.delete(ids=stale_ids)
+        if lexical_index:
+            lexical_index.update_metadata(kept_ids, kept_metadatas)
+            lexical_index.remove(stale_ids)
+        record_collection_change("upsert", filename)
+        if answer_cache:
+            answer_cache.invalidate_sources([filename], include_sourceless=True)
+        if document_registry:
+            document_registry.upsert(
+                filename,
+                metadata_dict["_filename_hash"],
+                len(seen_ids),
+                content_hash=file_info["content_hash"],
+                byte_size=file_info["byte_size"],
+                embedding_model=EMBEDDING_MODEL_NAME,
+                metadata={k: v for k, v in metadata_dict.items() if not k.startswith("_") and k != "source_filename"},
+            )
+
+        print(f"Ingested {filename}: {len(added_ids)} new chunks ({chunks_embedded} embedded, "
+              f"{len(added_ids) - chunks_embedded} from cache), {len(kept_ids)} unchanged, "
+              f"{len(stale_ids)} stale removed")
+        succeeded = True
+
+    except Exception as e:
+        # Roll back chunks added by this run so a failed job does not leave a half-updated document
+        if added_ids:
+            try:
+                collection.delete(ids=added_ids)
+                if lexical_index:
+                    lexical_index.remove(added_ids)
+            except Exception as rollback_error:
+                print(f"WARNING: Could not roll back {len(added_ids)} chunks for {filename}. Error: {rollback_error}")
+        if isinstance(e, IngestError):
+            raise
+        if isinstance(e, EmbeddingBatchError):
+            raise IngestError(f"เกิดข้อผิดพลาดในการสร้าง Embedding: {e}")
+        raise IngestError(f"เกิดข้อผิดพลาดในการเพิ่มข้อมูลเข้า ChromaDB: {e}")
+    finally:
+        os.remove(file_path)
+        stage_seconds = timer.seconds
+        parse_seconds = stage_seconds.get("parse", 0.0)
+        INGEST_STAGE_SECONDS.observe(parse_seconds, stage="parse")
+        INGEST_STAGE_SECONDS.observe(max(stage_seconds.get("parse_and_split", 0.0) - parse_seconds, 0.0), stage="split")
+        INGEST_STAGE_SECONDS.observe(stage_seconds.get("embed", 0.0), stage="embed")
+        INGEST_STAGE_SECONDS.observe(stage_seconds.get("upsert", 0.0), stage="upsert")
+        INGEST_DURATION_SECONDS.observe(time.perf_counter() - started)
+        INGEST_JOBS_TOTAL.inc(status="done" if succeeded else "failed")
+        if succeeded:
+            INGEST_CHUNKS.observe(len(seen_ids))
 
-@app.post("/ingest")
-async def ingest_document(file: UploadFile = File(...), metadata: str = Form(None)):
+    return {
+        "message": f"อัปโหลดและประมวลผล '{filename}' สำเร็จ",
+        "filename": filename,
+        "metadata": metadata_dict,
+        "chunks_total": len(seen_ids),
+        "chunks_added": len(added_ids),
+        "chunks_unchanged": len(kept_ids),
+        "chunks_deleted": len(stale_ids),
+        "chunks_embedded": chunks_embedded,
+        "embedding": embed_stats,
+        "total_documents_in_db": collection.count() if collection else 0
+    }
+
+def ingest_file_type(filename):
+    file_type = get_file_type(filename or "")
+    if file_type is None:
+        raise HTTPException(status_code=400, detail="รูปแบบไฟล์ไม่รองรับ (รองรับเฉพาะ .pdf, .docx, .txt, .md)")
+    return file_type
+
+# The body is parsed by receive_upload rather than by FastAPI, so the form is described here for /docs
+INGEST_REQUEST_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["file"],
+    "properties": {"file": {"type": "string", "format": "binary"}, "metadata": {"type": "string"}},
+}}}}}
+
+@app.post("/ingest", status_code=202, openapi_extra=INGEST_REQUEST_BODY)
+async def ingest_document(request: Request):
     if collection is None or embeddings is None:
         raise HTTPException(status_code=500, detail="RAG system not initialized (ChromaDB or Embedding Model issue).")
 
-    content = await file.read()
-    filename = file.filename
+    # The worker reads the upload from disk, so the request can return as soon as it is stored. The file part
+    # streams straight into that temp file and is hashed on the way: never read into memory whole, never copied
+    fields, filename, tmp_path, file_info = await receive_upload(
+        request, io_executor, suffix_for=ingest_file_type, max_bytes=MAX_UPLOAD_BYTES)
 
     filename_hash = hashlib.sha256(filename.encode('utf-8')).hexdigest()
-    
-    try:
-        collection.delete(where={"_filename_hash": {"$eq": filename_hash}})
-        print(f"Successfully deleted all old chunks for filename '{filename}' before adding new ones.")
-    except Exception as e:
-        print(f"No old chunks found for filename '{filename}' to delete. Proceeding with new ingestion.")
 
     metadata_dict = {}
-    if metadata:
+    if fields.get("metadata"):
         try:
-            metadata_dict = json.loads(metadata)
+            metadata_dict = json.loads(fields["metadata"])
         except json.JSONDecodeError:
+            os.remove(tmp_path)
             raise HTTPException(status_code=400, detail="Metadata JSON ไม่ถูกต้อง")
 
     metadata_dict["source_filename"] = filename
     metadata_dict["_filename_hash"] = filename_hash
 
-    raw_text = ""
-    file_stream = io.BytesIO(content)
-    if filename.endswith(".pdf"):
-        try:
-            raw_text = get_pdf_text(file_stream)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการอ่านไฟล์ PDF: {e}")
-    elif filename.endswith(".docx"):
-        try:
-            raw_text = get_docx_text(file_stream)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการอ่านไฟล์ DOCX: {e}")
-    elif filename.endswith(".txt"):
-        try:
-            raw_text = get_txt_text(file_stream)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการอ่านไฟล์ TXT: {e}")
-    elif filename.endswith(".md"): # <--- ส่วนที่เพิ่มเข้ามา
-        try:
-            raw_text = get_md_text(file_stream)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการอ่านไฟล์ Markdown: {e}")
-    else:
-        raise HTTPException(status_code=400, detail="รูปแบบไฟล์ไม่รองรับ (รองรับเฉพาะ .pdf, .docx, .txt, .md)") # <--- แก้ไขข้อความ
-
-    if not raw_text:
-        raise HTTPException(status_code=400, detail="ไม่พบข้อความในเอกสารที่ประมวลผลได้")
-
-    text_chunks = text_splitter.split_text(raw_text)
-
-    documents_to_add = []
-    metadatas_to_add = []
-    ids_to_add = []
-
-    for i, chunk in enumerate(text_chunks):
-        documents_to_add.append(chunk)
-        chunk_metadata = metadata_dict.copy()
-        chunk_metadata["chunk_id"] = i
-        metadatas_to_add.append(chunk_metadata)
-        ids_to_add.append(f"{filename}_{i}")
-
-    try:
-        if documents_to_add:
-            chunk_embeddings = embeddings.embed_documents(documents_to_add)
-            collection.add(
-                documents=documents_to_add,
-                metadatas=metadatas_to_add,
-                embeddings=chunk_embeddings,
-                ids=ids_to_add
-            )
-            print(f"Added {len(documents_to_add)} chunks to ChromaDB from {filename}")
-            print(f"Total documents in collection now: {collection.count()}")
-        else:
-            print(f"No chunks to add for {filename}")
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการเพิ่มข้อมูลเข้า ChromaDB: {e}")
-
+    job = ingest_jobs.submit(filename, run_ingest_job, tmp_path, filename, metadata_dict, file_info)
     return {
-        "message": f"อัปโหลดและประมวลผล '{filename}' สำเร็จ",
+        "message": f"รับไฟล์ '{filename}' แล้ว กำลังประมวลผลในเบื้องหลัง",
+        "job_id": job.id,
+        "status_url": f"/ingest/jobs/{job.id}",
         "filename": filename,
         "metadata": metadata_dict,
-        "chunks_added": len(documents_to_add),
-        "total_documents_in_db": collection.count() if collection else 0
     }
 
+@app.get("/ingest/jobs")
+async def list_ingest_jobs(limit: int = 50):
+    return ingest_jobs.list(limit=limit)
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"ไม่พบงานนำเข้าเอกสาร '{job_id}'")
+    return job.to_dict()
+
+def run_delete_job(job, filename):
+    # Runs as an ingest job for the file, so it waits for that file's running ingest; returns the chunk count
+    job.set_stage("delete")
+    file_hash = hashlib.sha256(filename.encode('utf-8')).hexdigest()
+    deleted_results = collection.delete(where={"_filename_hash": {"$eq": file_hash}})
+    if answer_cache:
+        answer_cache.invalidate_sources([filename])
+    if lexical_index:
+        lexical_index.remove_source(filename)
+    record_collection_change("delete", filename)
+    registered_chunks = document_registry.delete(filename) if document_registry else 0
+
+    # ChromaDB's delete() return value differs between versions; the registry knows the chunk count
+    if document_registry:
+        return registered_chunks
+    if deleted_results:
+        return deleted_results.get('deleted', len(deleted_results.get('ids', [])))
+    return 0
+
 @app.delete("/delete_document")
 async def delete_document(payload: dict):
     if collection is None:
@@ -417,102 +1113,367 @@ async def delete_document(payload: dict):
     if not filename:
         raise HTTPException(status_code=400, detail="กรุณาใส่ชื่อไฟล์ที่ต้องการลบใน JSON payload: {'filename': 'your_file.pdf'}")
 
-    try:
-        file_hash = hashlib.sha256(filename.encode('utf-8')).hexdigest()
-        deleted_results = collection.delete(where={"_filename_hash": {"$eq": file_hash}})
-        
-        deleted_ids_count = len(deleted_results.get('ids', [])) if deleted_results else 0
-        
-        if deleted_ids_count > 0:
-            print(f"Deleted {deleted_ids_count} chunks related to '{filename}'.")
-            return {"message": f"ลบข้อมูลจากไฟล์ '{filename}' สำเร็จ!", "chunks_deleted": deleted_ids_count}
-        else:
-            print(f"No chunks found for filename '{filename}' to delete. Check filename or metadata.")
-            return {"message": f"ไม่พบข้อมูลสำหรับไฟล์ '{filename}'", "chunks_deleted": 0}
+    # Queued behind any ingest job for the same file and run under its filename lease, so a delete never
+    # interleaves with that job's adds and the registry and the collection end up agreeing
+    job = ingest_jobs.submit(filename, run_delete_job, filename, executor=io_executor)
+    await asyncio.wrap_future(job.completion)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการลบเอกสาร: {job.error}")
 
-    except Exception as e:
-        print(f"Error during document deletion: {e}")
-        raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการลบเอกสาร: {e}")
+    deleted_ids_count = job.result
+    if deleted_ids_count > 0:
+        print(f"Deleted {deleted_ids_count} chunks related to '{filename}'.")
+        return {"message": f"ลบข้อมูลจากไฟล์ '{filename}' สำเร็จ!", "chunks_deleted": deleted_ids_count}
+    print(f"No chunks found for filename '{filename}' to delete. Check filename or metadata.")
+    return {"message": f"ไม่พบข้อมูลสำหรับไฟล์ '{filename}'", "chunks_deleted": 0}
 
 
-@app.post("/query")
-async def query_rag(payload: dict, request: Request, memory: ConversationSummaryBufferMemory = Depends(get_memory)):
-    if collection is None or embeddings is None or llm_qa is None or llm_memory_summarizer is None or vectorstore is None:
-        raise HTTPException(status_code=500, detail="RAG system not fully initialized.")
-
+def parse_query_payload(payload):
     query = payload.get("query")
     filters = payload.get("filters", {})
     top_k = payload.get("top_k", 5)
 
     if not query:
         raise HTTPException(status_code=400, detail="กรุณาใส่คำถาม")
-        
-    try:
-        retriever_kwargs = {"k": top_k}
-        if filters:
-            chroma_filters = {key: {"$eq": value} for key, value in filters.items()}
-            retriever_kwargs["filter"] = chroma_filters
-
-        retriever = vectorstore.as_retriever(search_kwargs=retriever_kwargs)
-        
-        relevant_docs = retriever.invoke(query)
-        
-        template = """
-คุณคือผู้ช่วย AI ที่เชี่ยวชาญในการตอบคำถามจากข้อมูลที่ให้ไว้เท่านั้น
-คุณจะได้รับ:
-- ประวัติการสนทนา (ถ้ามี)
-- บริบทจากเอกสาร (context)
+    return query, filters, top_k
+
+def chroma_where(filters):
+    if not filters:
+        return None
+    conditions = [{key: {"$eq": value}} for key, value in filters.items()]
+    # Chroma accepts a single condition per where clause; several must be combined with $and
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def embed_query(query):
+    # Coalesced with concurrent queries into one batched call; repeated queries come from the LRU
+    with count_errors(BACKEND_ERRORS_TOTAL, backend="ollama", operation="embed_query"):
+        return query_embedder.embed(query)
+
+def retrieve_documents(query, filters, top_k, query_embedding=None):
+    # One indexed read when no other worker has written since the last query
+    sync_collection_changes()
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+
+    # With a re-ranker, over-fetch a candidate pool and let it pick a diverse top_k
+    pool_size = max(top_k, RERANK_CANDIDATES) if reranker else top_k
+    use_lexical = lexical_index is not None and lexical_index.ready
+    n_results = max(pool_size, HYBRID_CANDIDATES) if use_lexical else pool_size
+
+    with count_errors(BACKEND_ERRORS_TOTAL, backend=VECTOR_BACKEND, operation="query"):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=chroma_where(filters),
+            include=['documents', 'metadatas', 'embeddings'] if reranker else ['documents', 'metadatas'],
+        )
+    candidates = [
+        Candidate(chunk_id, Document(page_content=document, metadata=metadata or {}),
+                  results['embeddings'][0][i] if reranker else None)
+        for i, (chunk_id, document, metadata) in enumerate(zip(results['ids'][0], results['documents'][0], results['metadatas'][0]))
+    ]
+    if use_lexical:
+        lexical_hits = lexical_index.search(query, n_results, filters)
+        candidates = fuse_candidates(candidates, lexical_hits, pool_size)
+    else:
+        candidates = candidates[:pool_size]
+
+    if reranker:
+        started = time.perf_counter()
+        candidates = reranker(query, query_embedding, candidates, top_k)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if RERANK_BUDGET_MS and elapsed_ms > RERANK_BUDGET_MS:
+            print(f"WARNING: Re-ranking took {elapsed_ms:.1f} ms (budget {RERANK_BUDGET_MS} ms).")
+    return [candidate.document for candidate in candidates[:top_k]]
+
+def fuse_candidates(vector_candidates, lexical_hits, pool_size):
+    by_id = {candidate.chunk_id: candidate for candidate in vector_candidates}
+    fused = reciprocal_rank_fusion(
+        [[candidate.chunk_id for candidate in vector_candidates], [chunk_id for chunk_id, _, _ in lexical_hits]],
+        k=RRF_K,
+    )[:pool_size]
+    fused_ids = [chunk_id for chunk_id, _ in fused]
+
+    # Chunk text is not kept in the lexical index; fetch the lexical-only hits from Chroma
+    missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in by_id]
+    if missing_ids:
+        include = ['documents', 'metadatas', 'embeddings'] if reranker else ['documents', 'metadatas']
+        fetched = collection.get(ids=missing_ids, include=include)
+        for i, (chunk_id, document, metadata) in enumerate(zip(fetched['ids'], fetched['documents'], fetched['metadatas'])):
+            by_id[chunk_id] = Candidate(chunk_id, Document(page_content=document, metadata=metadata or {}),
+                                        fetched['embeddings'][i] if reranker else None)
+    fused_candidates = []
+    for chunk_id, score in fused:
+        if chunk_id in by_id:
+            # The re-ranker uses the fused score as relevance, so exact lexical matches are not lost
+            by_id[chunk_id].score = score
+            fused_candidates.append(by_id[chunk_id])
+    return fused_candidates
+
+class AnswerCacheLookup:
+    def __init__(self, key=None, scope=None, generation=None, query_embedding=None, response=None):
+        self.key = key
+        self.scope = scope
+        self.generation = generation
+        self.query_embedding = query_embedding
+        self.response = response
+
+def read_answer_cache(key):
+    # The generation is read first: an invalidation after it makes the later put() a no-op
+    return answer_cache.generation, answer_cache.get(key)
+
+async def lookup_answer_cache(query, filters, top_k, chat_history):
+    # Answers that depend on chat history are never served from or stored in the cache
+    if answer_cache is None or chat_history:
+        return AnswerCacheLookup()
+
+    lookup = AnswerCacheLookup(key=answer_cache.make_key(query, filters, top_k), scope=make_scope(filters, top_k))
+    lookup.generation, lookup.response = await run_state(read_answer_cache, lookup.key)
+    if lookup.response is None and answer_cache.similarity_threshold > 0:
+        lookup.query_embedding = await run_blocking(io_executor, embed_query, query)
+        lookup.response = await run_state(answer_cache.get_similar, lookup.scope, lookup.query_embedding)
+    return lookup
+
+async def store_answer_cache(lookup, response_data):
+    if answer_cache is None or lookup.key is None:
+        return
+    await run_state(
+        answer_cache.put,
+        lookup.key,
+        lookup.scope,
+        response_data,
+        response_data["relevant_sources"],
+        query_vector=lookup.query_embedding,
+        generation=lookup.generation,
+    )
+
+def build_rag_chain(relevant_docs):
+    return (
+        RunnablePassthrough.assign(context=(lambda x: format_docs(relevant_docs)))
+        | rag_prompt
+        | llm_qa
+        | StrOutputParser()
+    )
+
+def build_sources(relevant_docs):
+    source_files = set([doc.metadata.get('source_filename', 'Unknown Source') for doc in relevant_docs])
+    return {
+        "relevant_sources": list(source_files),
+        "source_chunks": [{"content": c.page_content, "metadata": c.metadata} for c in relevant_docs]
+    }
 
-กรุณาตอบคำถามโดยอ้างอิงเฉพาะข้อมูลที่มีในบริบทเท่านั้น
-หากบริบทไม่เพียงพอในการตอบคำถาม ให้ตอบว่า:
-"ไม่สามารถให้คำตอบได้ เนื่องจากไม่มีข้อมูล"
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-โปรดตอบอย่างสุภาพ ละเอียด และครบถ้วนที่สุด โดยใช้คำลงท้ายว่า "ครับ"
+def check_query_ready():
+    if collection is None or embeddings is None or llm_qa is None or llm_memory_summarizer is None:
+        raise HTTPException(status_code=500, detail="RAG system not fully initialized.")
 
----
-ประวัติการสนทนา:
-{chat_history}
----
-บริบทจากเอกสาร:
-{context}
----
-คำถาม:
-{question}
+@app.post("/query")
+async def query_rag(payload: dict, request: Request, memory: BackgroundSummaryMemory = Depends(get_memory)):
+    check_query_ready()
+    query, filters, top_k = parse_query_payload(payload)
+    started = time.perf_counter()
 
-คำตอบ:
-"""
+    try:
+        chat_history, cache_lookup, relevant_docs = await prepare_query(memory, query, filters, top_k)
+        if cache_lookup.response is not None:
+            await save_memory(request, memory, query, cache_lookup.response["answer"])
+            QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+            QUERIES_TOTAL.inc(endpoint="query", cached="true")
+            return {**cache_lookup.response, "cached": True}
 
-        
-        prompt = PromptTemplate.from_template(template)
-        
-        rag_chain = (
-            RunnablePassthrough.assign(context=(lambda x: format_docs(relevant_docs)))
-            | prompt
-            | llm_qa
-            | StrOutputParser()
-        )
-        
-        chat_history = memory.load_memory_variables({})["chat_history"]
+        rag_chain = build_rag_chain(relevant_docs)
 
         chain_input = {"question": query, "chat_history": chat_history}
-        answer = rag_chain.invoke(chain_input)
-        
-        memory.save_context({"input": query}, {"output": answer})
+        with QUERY_STAGE_SECONDS.time(stage="generation"), count_errors(BACKEND_ERRORS_TOTAL, backend="ollama", operation="generate"):
+            answer = await run_blocking(llm_executor, rag_chain.invoke, chain_input)
+
+        await save_memory(request, memory, query, answer)
+
+        response_data = {"answer": answer, **build_sources(relevant_docs)}
+        await store_answer_cache(cache_lookup, response_data)
+
+        QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        QUERIES_TOTAL.inc(endpoint="query", cached="false")
+        return {**response_data, "cached": False}
+
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"บริการที่เกี่ยวข้องไม่พร้อมใช้งานชั่วคราว: {e}")
+    except Exception as e:
+        print(f"Error during query: {e}")
+        raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการสอบถาม: {e}")
 
-        source_files = set([doc.metadata.get('source_filename', 'Unknown Source') for doc in relevant_docs])
-        
-        response_data = {
-            "answer": answer,
-            "relevant_sources": list(source_files),
-            "source_chunks": [{"content": c.page_content, "metadata": c.metadata} for c in relevant_docs]
-        }
-        
-        return response_data
-    
+@app.post("/query/stream")
+async def query_rag_stream(payload: dict, request: Request, memory: BackgroundSummaryMemory = Depends(get_memory)):
+    # Server-Sent Events: "sources" first, then one "token" event per generated chunk, then "done"
+    check_query_ready()
+    query, filters, top_k = parse_query_payload(payload)
+    started = time.perf_counter()
+
+    try:
+        chat_history, cache_lookup, relevant_docs = await prepare_query(memory, query, filters, top_k)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"บริการที่เกี่ยวข้องไม่พร้อมใช้งานชั่วคราว: {e}")
     except Exception as e:
         print(f"Error during query: {e}")
         raise HTTPException(status_code=500, detail=f"เกิดข้อผิดพลาดในการสอบถาม: {e}")
 
+    async def cached_event_stream():
+        cached = cache_lookup.response
+        yield sse_event("sources", {"relevant_sources": cached["relevant_sources"], "source_chunks": cached["source_chunks"]})
+        yield sse_event("token", {"text": cached["answer"]})
+        await save_memory(request, memory, query, cached["answer"])
+        QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        QUERIES_TOTAL.inc(endpoint="query_stream", cached="true")
+        yield sse_event("done", {"answer": cached["answer"], "cached": True})
+
+    async def event_stream():
+        sources = build_sources(relevant_docs)
+        yield sse_event("sources", sources)
+
+        rag_chain = build_rag_chain(relevant_docs)
+        chain_input = {"question": query, "chat_history": chat_history}
+        answer_parts = []
+        generation_started = time.perf_counter()
+        try:
+            async for token in rag_chain.astream(chain_input):
+                if not answer_parts:
+                    QUERY_STAGE_SECONDS.observe(time.perf_counter() - generation_started, stage="first_token")
+                answer_parts.append(token)
+                yield sse_event("token", {"text": token})
+            QUERY_STAGE_SECONDS.observe(time.perf_counter() - generation_started, stage="generation")
+        except Exception as e:
+            BACKEND_ERRORS_TOTAL.inc(backend="ollama", operation="generate")
+            print(f"Error during streaming query: {e}")
+            yield sse_event("error", {"detail": f"เกิดข้อผิดพลาดในการสอบถาม: {e}"})
+            return
+
+        answer = "".join(answer_parts)
+        await save_memory(request, memory, query, answer)
+        await store_answer_cache(cache_lookup, {"answer": answer, **sources})
+        QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        QUERIES_TOTAL.inc(endpoint="query_stream", cached="false")
+        yield sse_event("done", {"answer": answer, "cached": False})
+
+    return StreamingResponse(
+        cached_event_stream() if cache_lookup.response is not None else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def vector_store_health():
+    if collection is None:
+        return {"status": "error", "error": "not initialized"}
+    if VECTOR_BACKEND == "local":
+        return {"status": "ok", "backend": "local"}
+    return {"backend": "chroma", **chroma_health(chroma_client, chroma_breaker)}
+
+@app.get("/health")
+async def health():
+    # Probes both backends in parallel; 503 when either is down so a load balancer can route around this worker
+    ollama_status, vector_status = await asyncio.gather(
+        run_blocking(io_executor, ollama_http.health, HTTP_CONNECT_TIMEOUT),
+        run_blocking(io_executor, vector_store_health),
+    )
+    # An open circuit counts as down: queries on this worker are being rejected until it closes
+    healthy = all(status["status"] == "ok" and status.get("circuit", {}).get("state") != "open"
+                  for status in (ollama_status, vector_status))
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={"status": "ok" if healthy else "degraded", "ollama": ollama_status, "vector_store": vector_status},
+    )
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/answer_cache")
+async def get_answer_cache_stats():
+    if answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_state(answer_cache.stats)}
+
+@app.delete("/admin/answer_cache")
+async def clear_answer_cache():
+    if answer_cache:
+        await run_state(answer_cache.clear)
+    return {"message": "ล้าง Cache ของคำตอบแล้ว"}
+
+@app.get("/admin/query_embeddings")
+async def get_query_embedding_stats():
+    return query_embedder.stats()
+
+@app.get("/admin/lexical_index")
+async def get_lexical_index_stats():
+    if lexical_index is None:
+        return {"enabled": False}
+    # stats() waits for the index lock, which a rebuild holds for a while
+    stats = {"enabled": True, **(await run_blocking(io_executor, lexical_index.stats))}
+    if collection_changes is not None:
+        stats["changes_from_other_workers"] = {"applied": collection_changes.applied, "seq": collection_changes.seq}
+    return stats
+
+@app.post("/admin/lexical_index/rebuild")
+async def rebuild_lexical_index():
+    if lexical_index is None or collection is None:
+        raise HTTPException(status_code=400, detail="Hybrid search ไม่ได้เปิดใช้งาน หรือ ChromaDB ไม่พร้อมใช้งาน")
+    seq = None
+    if collection_changes is not None:
+        collection_changes.skip_to_latest()
+        seq = collection_changes.seq
+    count = await run_blocking(io_executor, lexical_index.rebuild_from_collection, collection)
+    if seq is not None:
+        # Workers that start later load the rebuilt index rather than the one saved before it
+        await run_blocking(io_executor, save_lexical_index, seq)
+    return {"message": "สร้าง Lexical Index ใหม่แล้ว", "chunks": count}
+
+@app.get("/admin/vector_index")
+async def get_vector_index_stats():
+    if collection is None:
+        raise HTTPException(status_code=500, detail="ฐานข้อมูลเวกเตอร์ไม่พร้อมใช้งาน")
+    if VECTOR_BACKEND != "local" and not SHARD_KEY:
+        return {"backend": VECTOR_BACKEND, "count": await run_blocking(io_executor, collection.count)}
+    return await run_blocking(io_executor, collection.stats)
+
+@app.get("/admin/shards")
+async def get_shard_stats():
+    # Chunk count, routing value and query latency per shard
+    if not SHARD_KEY:
+        return {"enabled": False}
+    if collection is None:
+        raise HTTPException(status_code=500, detail="ฐานข้อมูลเวกเตอร์ไม่พร้อมใช้งาน")
+    return {"enabled": True, **await run_blocking(io_executor, collection.stats)}
+
+@app.post("/admin/shards/refresh")
+async def refresh_shards():
+    # Picks up shards created by another process, e.g. ingest_bulk.py
+    if not SHARD_KEY or collection is None:
+        raise HTTPException(status_code=400, detail="ต้องตั้งค่า SHARD_KEY ก่อนจึงจะใช้ Shard ได้")
+    shards = await run_blocking(io_executor, collection.refresh)
+    return {"message": "อัปเดตรายการ Shard แล้ว", "shards": shards}
+
+@app.post("/admin/vector_index/snapshot")
+async def snapshot_vector_index():
+    if VECTOR_BACKEND != "local" or collection is None:
+        raise HTTPException(status_code=400, detail="Snapshot ใช้ได้เฉพาะ VECTOR_BACKEND=local")
+    count = await run_blocking(io_executor, collection.snapshot)
+    return {"message": "บันทึก Snapshot ของ Vector Index แล้ว", "chunks": count}
+
+@app.get("/admin/sessions")
+async def get_session_stats():
+    return {**await run_state(app.state.memories.stats), "summaries": summary_queue.stats()}
+
+@app.delete("/admin/sessions")
+async def clear_sessions():
+    await run_state(app.state.memories.clear)
+    return {"message": "ล้างประวัติการสนทนาทั้งหมดแล้ว"}
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,97 @@
+# benchmarks/rerank_benchmark.py
+# Measures the per-query latency of the MMR re-ranking stage on synthetic candidate pools shaped like
+# overlapping chunks (clusters of near-duplicates), and how much it diversifies the final top-k.
+# Run from the repository root: python -m benchmarks.rerank_benchmark
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from rerank import mmr_select
+
+
+def make_pool(rng, pool_size, dim, cluster_size):
+    # Each cluster mimics overlapping chunks of one page: one direction plus a little noise
+    n_clusters = -(-pool_size // cluster_size)
+    centers = rng.normal(size=(n_clusters, dim))
+    vectors = np.repeat(centers, cluster_size, axis=0)[:pool_size] + 0.15 * rng.normal(size=(pool_size, dim))
+    query = centers[0] + 0.5 * rng.normal(size=dim)
+    # Candidates arrive in relevance order, as they do from the retriever
+    relevance = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)) @ (query / np.linalg.norm(query))
+    order = np.argsort(-relevance)
+    sources = [f"doc{i // cluster_size}" for i in range(pool_size)]
+    return query.astype(np.float32), vectors[order].astype(np.float32), [sources[i] for i in order]
+
+
+def mean_pairwise_similarity(vectors):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = unit @ unit.T
+    n = len(vectors)
+    return float((similarity.sum() - n) / (n * (n - 1))) if n > 1 else 0.0
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_case(rng, pool_size, dim, k, cluster_size, iterations, lambda_mult, max_per_source):
+    timings = []
+    plain_similarity = []
+    mmr_similarity = []
+    for _ in range(iterations):
+        query, vectors, sources = make_pool(rng, pool_size, dim, cluster_size)
+        started = time.perf_counter()
+        picks = mmr_select(query, vectors, k, lambda_mult=lambda_mult, sources=sources, max_per_source=max_per_source)
+        timings.append((time.perf_counter() - started) * 1000)
+        plain_similarity.append(mean_pairwise_similarity(vectors[:k]))
+        mmr_similarity.append(mean_pairwise_similarity(vectors[picks]))
+    return {
+        "pool_size": pool_size,
+        "dim": dim,
+        "k": k,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "topk_mean_similarity": round(float(np.mean(plain_similarity)), 3),
+        "mmr_mean_similarity": round(float(np.mean(mmr_similarity)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MMR re-ranking stage.")
+    parser.add_argument("--pool-sizes", default="20,50,100", help="Comma-separated candidate pool sizes")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension (nomic-embed-text: 768)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--cluster-size", type=int, default=4, help="Near-duplicate chunks per page")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--max-per-source", type=int, default=0)
+    parser.add_argument("--budget-ms", type=float, default=5.0, help="Fail if any p99 exceeds this")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for pool_size in [int(size) for size in args.pool_sizes.split(",")]:
+        result = run_case(rng, pool_size, args.dim, args.k, args.cluster_size, args.iterations,
+                          args.lambda_mult, args.max_per_source)
+        results.append(result)
+        print(f"pool={result['pool_size']:>4} k={result['k']} p50={result['p50_ms']:.3f}ms "
+              f"p95={result['p95_ms']:.3f}ms p99={result['p99_ms']:.3f}ms "
+              f"similarity top-k={result['topk_mean_similarity']:.3f} mmr={result['mmr_mean_similarity']:.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"benchmark": "rerank", "budget_ms": args.budget_ms, "results": results}, output_file, indent=2)
+
+    over_budget = [result for result in results if result["p99_ms"] > args.budget_ms]
+    if over_budget:
+        print(f"FAIL: p99 over the {args.budget_ms} ms budget for pool sizes {[r['pool_size'] for r in over_budget]}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
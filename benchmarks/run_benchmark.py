@@ -0,0 +1,340 @@
+# benchmarks/run_benchmark.py
+# End-to-end offline benchmark: starts a stub Ollama server, a vector store (embedded local index or a local
+# `chroma run` server) and app.py under uvicorn, then drives /ingest and /query at configurable concurrency.
+# Reports ingest docs/sec and chunks/sec and query p50/p95/p99, and writes JSON comparable between commits.
+# Run from the repository root: python -m benchmarks.run_benchmark --output results.json [--baseline old.json]
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmarks.stub_ollama import StubOllamaConfig, StubOllamaServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WORDS = (
+    "policy leave employee budget report contract invoice herbal clinic patient dosage schedule review "
+    "approval department training safety procedure vendor quality audit request form record"
+).split()
+_THAI_WORDS = "นโยบาย การลา พนักงาน งบประมาณ รายงาน สัญญา สมุนไพร คลินิก ผู้ป่วย ขนาดยา ตารางเวลา อนุมัติ แผนก".split()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout, process=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} became ready")
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def make_corpus(n_docs, paragraphs, rng):
+    # Each document carries a unique code so queries can target it, like policy or form numbers
+    docs = []
+    for i in range(n_docs):
+        code = f"DOC-{i:05d}"
+        body = []
+        for _ in range(paragraphs):
+            words = rng.choices(_WORDS, k=60) + rng.choices(_THAI_WORDS, k=20)
+            rng.shuffle(words)
+            body.append(" ".join(words) + ".")
+        docs.append((f"bench_{i:05d}.txt", f"{code}\n\n" + "\n\n".join(body)))
+    return docs
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    array = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(array, 50)), 2),
+        "p95": round(float(np.percentile(array, 95)), 2),
+        "p99": round(float(np.percentile(array, 99)), 2),
+        "mean": round(float(array.mean()), 2),
+        "max": round(float(array.max()), 2),
+    }
+
+
+def run_ingest(base_url, docs, concurrency, timeout):
+    results = []
+    lock = threading.Lock()
+
+    def ingest_one(doc):
+        filename, text = doc
+        with requests.Session() as session:
+            job = session.post(f"{base_url}/ingest", files={"file": (filename, text.encode("utf-8"))},
+                               data={"metadata": json.dumps({"document_type": "benchmark"})}, timeout=timeout).json()
+            while True:
+                status = session.get(f"{base_url}/ingest/jobs/{job['job_id']}", timeout=timeout).json()
+                if status["status"] in ("done", "failed"):
+                    break
+                time.sleep(0.05)
+        with lock:
+            results.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ingest_one, docs))
+    elapsed = time.perf_counter() - started
+
+    done = [job for job in results if job["status"] == "done"]
+    chunks = sum((job.get("result") or {}).get("chunks_total", 0) for job in done)
+    return {
+        "docs": len(docs),
+        "failed": len(results) - len(done),
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(len(done) / elapsed, 2) if elapsed else None,
+        "chunks_per_sec": round(chunks / elapsed, 2) if elapsed else None,
+    }
+
+
+def run_queries(base_url, queries, concurrency, top_k, stream, timeout):
+    latencies = []
+    first_token = []
+    errors = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def query_one(query):
+        # One session per worker thread, like one browser tab per user
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            if stream:
+                ttft = None
+                with local.session.post(f"{base_url}/query/stream", json={"query": query, "top_k": top_k},
+                                        stream=True, timeout=timeout) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line == "event: token" and ttft is None:
+                            ttft = time.perf_counter() - started
+                        if line == "event: error":
+                            raise RuntimeError("stream error event")
+                with lock:
+                    if ttft is not None:
+                        first_token.append(ttft)
+            else:
+                response = local.session.post(f"{base_url}/query", json={"query": query, "top_k": top_k}, timeout=timeout)
+                response.raise_for_status()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(query_one, queries))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "queries_per_sec": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+    }
+    if stream:
+        result["first_token_ms"] = percentiles(first_token)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def scrape_stage_means(base_url):
+    # Mean seconds per stage from the app's own histograms (rag_*_stage_seconds_sum / _count)
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if line.startswith("#") or "_stage_seconds_" not in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        if "_sum{" in name:
+            sums[name.replace("_sum{", "{")] = float(value)
+        elif "_count{" in name:
+            counts[name.replace("_count{", "{")] = float(value)
+    return {key: round(sums[key] / counts[key] * 1000, 3) for key in sums if counts.get(key)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    rows = [
+        ("ingest docs/sec", ("ingest", "docs_per_sec"), True),
+        ("ingest chunks/sec", ("ingest", "chunks_per_sec"), True),
+        ("query p50 ms", ("query", "latency_ms", "p50"), False),
+        ("query p95 ms", ("query", "latency_ms", "p95"), False),
+        ("query p99 ms", ("query", "latency_ms", "p99"), False),
+        ("queries/sec", ("query", "queries_per_sec"), True),
+    ]
+    print(f"\nCompared with baseline {baseline.get('commit', '?')[:12]}:")
+    for label, path, higher_is_better in rows:
+        old, new = baseline, current
+        for key in path:
+            old = (old or {}).get(key)
+            new = (new or {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_is_better else change < 0
+        print(f"  {label:<18} {old:>10} -> {new:>10}  ({change:+.1f}%{' better' if better else ' worse' if change else ''})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of /ingest and /query.")
+    parser.add_argument("--backend", choices=["local", "chroma"], default="local",
+                        help="local = embedded vector index; chroma = starts `chroma run` on a temporary directory")
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs (~80 words each) per document")
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--stream", action="store_true", help="Use /query/stream and also report time to first token")
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--first-token-latency-ms", type=float, default=50.0)
+    parser.add_argument("--token-latency-ms", type=float, default=2.0)
+    parser.add_argument("--answer-tokens", type=int, default=32)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker processes; more than one needs --app-env STATE_BACKEND=sqlite")
+    parser.add_argument("--answer-cache-size", type=int, default=0, help="Passed to the app; 0 measures uncached queries")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for app.py, e.g. --app-env RERANKER=none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    processes = []
+    stub = StubOllamaServer(config=StubOllamaConfig(
+        dim=args.dim, embed_latency_ms=args.embed_latency_ms, first_token_latency_ms=args.first_token_latency_ms,
+        token_latency_ms=args.token_latency_ms, answer_tokens=args.answer_tokens,
+    )).start()
+    print(f"Stub Ollama at {stub.base_url}; work directory {workdir}")
+
+    try:
+        app_port = free_port()
+        env = dict(os.environ)
+        env.update({
+            "OLLAMA_BASE_URL": stub.base_url,
+            "RAG_DATA_DIR": os.path.join(workdir, "rag_data"),
+            "VECTOR_BACKEND": args.backend,
+            "CHROMA_COLLECTION_NAME": "benchmark",
+            "ANSWER_CACHE_SIZE": str(args.answer_cache_size),
+            "SESSION_SECRET_KEY": "benchmark",
+            # Tokenizers must come from the local cache; the benchmark never waits on the network
+            "HF_HUB_OFFLINE": "1",
+            "TRANSFORMERS_OFFLINE": "1",
+        })
+        for item in args.app_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        if args.backend == "chroma":
+            chroma_port = free_port()
+            chroma_log = open(os.path.join(workdir, "chroma.log"), "w")
+            processes.append(subprocess.Popen(
+                ["chroma", "run", "--path", os.path.join(workdir, "chroma"), "--host", "127.0.0.1", "--port", str(chroma_port)],
+                stdout=chroma_log, stderr=subprocess.STDOUT,
+            ))
+            wait_for(f"http://127.0.0.1:{chroma_port}/api/v2/heartbeat", 60, processes[-1])
+            env.update({"CHROMA_HOST": "127.0.0.1", "CHROMA_PORT": str(chroma_port)})
+
+        app_log = open(os.path.join(workdir, "app.log"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning",
+             "--workers", str(args.workers)],
+            cwd=REPO_ROOT, env=env, stdout=app_log, stderr=subprocess.STDOUT,
+        ))
+        base_url = f"http://127.0.0.1:{app_port}"
+        wait_for(f"{base_url}/admin/vector_index", 120, processes[-1])
+
+        docs = make_corpus(args.docs, args.paragraphs, rng)
+        print(f"Ingesting {len(docs)} documents at concurrency {args.ingest_concurrency}...")
+        ingest = run_ingest(base_url, docs, args.ingest_concurrency, args.timeout)
+        print(f"  {ingest['docs_per_sec']} docs/s, {ingest['chunks_per_sec']} chunks/s, {ingest['failed']} failed")
+
+        queries = []
+        for i in range(args.queries):
+            doc_index = rng.randrange(len(docs))
+            queries.append(f"DOC-{doc_index:05d} " + " ".join(rng.choices(_WORDS + _THAI_WORDS, k=6)) + f" #{i}")
+        print(f"Running {len(queries)} queries at concurrency {args.query_concurrency}...")
+        query = run_queries(base_url, queries, args.query_concurrency, args.top_k, args.stream, args.timeout)
+        latency = query["latency_ms"]
+        print(f"  p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms "
+              f"{query['queries_per_sec']} q/s, {query['errors']} errors")
+
+        results = {
+            "benchmark": "end_to_end",
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": vars(args),
+            "ingest": ingest,
+            "query": query,
+            "server_stage_mean_ms": scrape_stage_means(base_url),
+            "stub_ollama_requests": stub.stats(),
+        }
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output_file:
+                json.dump(results, output_file, indent=2, ensure_ascii=False)
+            print(f"Results written to {args.output}")
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as baseline_file:
+                compare(json.load(baseline_file), results)
+        return 0 if not ingest["failed"] and not query["errors"] else 1
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        stub.stop()
+        if args.keep_workdir:
+            print(f"Kept work directory {workdir} (app.log has the server output)")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
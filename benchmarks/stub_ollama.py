@@ -0,0 +1,198 @@
+# benchmarks/stub_ollama.py
+# Stand-in for the Ollama HTTP API used by app.py (/api/embeddings, /api/generate, /api/chat) with configurable
+# artificial latency and deterministic vectors, so performance can be measured without the GPU box.
+# Standalone: python -m benchmarks.stub_ollama --port 11500 --embed-latency-ms 20
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def deterministic_embedding(text, dim):
+    # Hashed bag of words: the same text always maps to the same unit vector and texts sharing
+    # words land close together, so retrieval over the stub still behaves like retrieval
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(text.casefold()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little") % dim] = 1.0
+        return vector.tolist()
+    return (vector / norm).tolist()
+
+
+class StubOllamaConfig:
+    def __init__(self, dim=768, embed_latency_ms=0.0, first_token_latency_ms=0.0, token_latency_ms=0.0,
+                 answer_tokens=64, error_rate=0.0):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.first_token_latency_ms = first_token_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like Ollama's Go server: without TCP_NODELAY, header and body writes on a keep-alive connection
+    # wait on the client's delayed ACK (~40 ms per call)
+    disable_nagle_algorithm = True
+    config = StubOllamaConfig()
+    counters = {"embeddings": 0, "embed": 0, "generate": 0, "chat": 0, "errors": 0}
+    counters_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, name):
+        with self.counters_lock:
+            self.counters[name] += 1
+            # Deterministic error injection: every 1/error_rate-th request fails
+            if self.config.error_rate > 0 and self.counters[name] % max(int(1 / self.config.error_rate), 1) == 0:
+                self.counters["errors"] += 1
+                return True
+        return False
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, make_line):
+        # NDJSON streaming like Ollama: one object per token, then a final done object
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            time.sleep(self.config.first_token_latency_ms / 1000)
+            for i in range(self.config.answer_tokens):
+                if i:
+                    time.sleep(self.config.token_latency_ms / 1000)
+                self._write_chunk(json.dumps(make_line(f"token{i} ", False)) + "\n")
+            self._write_chunk(json.dumps(make_line("", True)) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up (e.g. its read timeout fired)
+            self.close_connection = True
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "stub"})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": []})
+        elif self.path == "/stub/stats":
+            with self.counters_lock:
+                self._send_json(200, dict(self.counters))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == "/api/embeddings":
+            if self._count("embeddings"):
+                self._send_json(500, {"error": "injected failure"})
+                return
+            time.sleep(self.config.embed_latency_ms / 1000)
+            self._send_json(200, {"embedding": deterministic_embedding(body.get("prompt", ""), self.config.dim)})
+        elif self.path == "/api/embed":
+            # Batched API: one latency per request however many inputs it carries
+            if self._count("embed"):
+                self._send_json(500, {"error": "injected failure"})
+                return
+            time.sleep(self.config.embed_latency_ms / 1000)
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json(200, {"embeddings": [deterministic_embedding(text, self.config.dim) for text in inputs]})
+        elif self.path == "/api/generate":
+            if self._count("generate"):
+                self._send_json(500, {"error": "injected failure"})
+                return
+            model = body.get("model", "stub")
+            self._stream(lambda text, done: {"model": model, "response": text, "done": done})
+        elif self.path == "/api/chat":
+            if self._count("chat"):
+                self._send_json(500, {"error": "injected failure"})
+                return
+            model = body.get("model", "stub")
+            self._stream(lambda text, done: {"model": model, "message": {"role": "assistant", "content": text}, "done": done})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+
+class StubOllamaServer:
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        handler = type("ConfiguredStubOllamaHandler", (StubOllamaHandler,), {
+            "config": config or StubOllamaConfig(),
+            "counters": {"embeddings": 0, "embed": 0, "generate": 0, "chat": 0, "errors": 0},
+            "counters_lock": threading.Lock(),
+        })
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.handler = handler
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.handler.counters_lock:
+            return dict(self.handler.counters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub Ollama server with artificial latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--first-token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = StubOllamaConfig(args.dim, args.embed_latency_ms, args.first_token_latency_ms, args.token_latency_ms,
+                              args.answer_tokens, args.error_rate)
+    server = StubOllamaServer(args.host, args.port, config)
+    print(f"Stub Ollama listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# chunking.py
+# Feeds lazily parsed sections through a text splitter incrementally, so only a bounded window of text
+# is held at a time, and tags each chunk with the page it starts on.
+# TokenTextSplitter measures chunks in embedding-model tokens and cuts at Markdown/DOCX headings, paragraphs,
+# lines, sentences and (Thai) words, in that order of preference.
+
+import bisect
+import functools
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from token_counting import TokenCounter
+
+try:
+    from pythainlp.tokenize import word_tokenize as thai_word_tokenize
+except ImportError:
+    thai_word_tokenize = None
+
+# Separators stay attached to the piece before them, so pieces concatenate back to the original text
+# and every chunk is an exact substring of it
+_SECTION_BREAK = re.compile(r"\n[ \t]*\n\s*|\n(?=#{1,6} )")
+_LINE_BREAK = re.compile(r"\n")
+# Thai separates sentences and clauses with a space rather than punctuation
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?\u2026])\s+|(?<=[\u0e00-\u0e7f])[ \t]+")
+_WORD = re.compile(r"\s*\S+\s*")
+_THAI_RUN = re.compile(r"[\u0e00-\u0e7f]+|[^\u0e00-\u0e7f]+")
+_THAI_CHAR = re.compile(r"[\u0e00-\u0e7f]")
+# Thai characters a cut must not come before (following vowels, tone and other marks) or after (leading vowels)
+_THAI_NO_CUT_BEFORE = re.compile(r"[\u0e30-\u0e3a\u0e45\u0e47-\u0e4e]")
+_THAI_NO_CUT_AFTER = re.compile(r"[\u0e40-\u0e44]")
+_HEADING = re.compile(r"\s*#{1,6} ")
+
+
+def make_text_splitter(chunker="tokens", chunk_size=512, chunk_overlap=64, tokenizer_name="nomic-ai/nomic-embed-text-v1.5"):
+    # chunker="characters" keeps the original 1000-character splitter
+    if chunker == "characters":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len,
+            is_separator_regex=False,
+        )
+    if chunker != "tokens":
+        raise ValueError(f"Unknown chunker '{chunker}'. Use 'tokens' or 'characters'.")
+    return TokenTextSplitter(get_token_counter(tokenizer_name), chunk_size, chunk_overlap)
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(tokenizer_name):
+    # One tokenizer per process, shared by every splitter (ingest_bulk creates one per file)
+    return TokenCounter(tokenizer_name)
+
+
+def _split_at(pattern, text):
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def _split_words(text):
+    pieces = []
+    for match in _WORD.finditer(text):
+        word = match.group()
+        if thai_word_tokenize is None or not _THAI_CHAR.search(word):
+            pieces.append(word)
+            continue
+        for run in _THAI_RUN.findall(word):
+            if _THAI_CHAR.match(run):
+                pieces.extend(thai_word_tokenize(run, engine="newmm"))
+            else:
+                pieces.append(run)
+    return pieces
+
+
+class TokenTextSplitter:
+    # Same interface as langchain's splitters (split_text, _chunk_size, _chunk_overlap), sizes in tokens.
+    # Each level is tokenized once in a batch and only oversized pieces go down a level, so time is linear
+    def __init__(self, token_counter, chunk_size=512, chunk_overlap=64):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.tokens = token_counter
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self.levels = [
+            lambda text: _split_at(_SECTION_BREAK, text),
+            lambda text: _split_at(_LINE_BREAK, text),
+            lambda text: _split_at(_SENTENCE_BREAK, text),
+            _split_words,
+            self._split_characters,
+        ]
+        # Several chunks per window, so re-splitting the carried-over tail costs little (see iter_chunks)
+        self.window_chars = chunk_size * 32
+        # Upper bound on the characters two neighbouring chunks share, for context_packing.remove_overlap
+        self.max_overlap_chars = chunk_overlap * 8
+
+    def _split_characters(self, text):
+        # Last resort for a single word longer than a chunk: fixed slices, never separating a Thai mark
+        # from its consonant. Four characters per token is a conservative bound for any tokenizer
+        size = max(self._chunk_size // 4, 1)
+        pieces = []
+        start = 0
+        while start < len(text):
+            end = min(start + size, len(text))
+            while end < len(text) and (_THAI_NO_CUT_BEFORE.match(text, end) or _THAI_NO_CUT_AFTER.match(text, end - 1)):
+                end += 1
+            pieces.append(text[start:end])
+            start = end
+        return pieces
+
+    def _pieces(self, text, level=0):
+        parts = self.levels[level](text)
+        for part, count in zip(parts, self.tokens.count_many(parts)):
+            if count > self._chunk_size and level + 1 < len(self.levels):
+                yield from self._pieces(part, level + 1)
+            else:
+                yield part, count, level == 0 and _HEADING.match(part) is not None
+
+    def split_text_with_offsets(self, text):
+        # Greedy packing of pieces into chunks of at most chunk_size tokens; yields (chunk, start offset)
+        current = []
+        total = 0
+        start = 0
+        offset = 0
+
+        def emit():
+            chunk = "".join(piece for piece, _ in current)
+            stripped = chunk.strip()
+            if stripped:
+                return stripped, start + (len(chunk) - len(chunk.lstrip()))
+            return None
+
+        for piece, count, starts_section in self._pieces(text):
+            # A heading starts a new chunk once the current one is half full, without overlap
+            if current and (total + count > self._chunk_size or (starts_section and total >= self._chunk_size // 2)):
+                located = emit()
+                if located:
+                    yield located
+                kept = []
+                kept_tokens = 0
+                if not starts_section:
+                    for previous, previous_count in reversed(current):
+                        if kept_tokens + previous_count > self._chunk_overlap or kept_tokens + previous_count + count > self._chunk_size:
+                            break
+                        kept.append((previous, previous_count))
+                        kept_tokens += previous_count
+                kept.reverse()
+                start = offset - sum(len(previous) for previous, _ in kept)
+                current = kept
+                total = kept_tokens
+            current.append((piece, count))
+            total += count
+            offset += len(piece)
+
+        if current:
+            located = emit()
+            if located:
+                yield located
+
+    def split_text(self, text):
+        return [chunk for chunk, _ in self.split_text_with_offsets(text)]
+
+
+def iter_chunks(sections, text_splitter, window_size=None):
+    # sections: iterable of (page_number or None, text); yields (chunk_text, page_number or None)
+    chunk_size = getattr(text_splitter, "_chunk_size", 1000)
+    chunk_overlap = getattr(text_splitter, "_chunk_overlap", 0)
+    window_size = window_size or getattr(text_splitter, "window_chars", chunk_size * 8)
+
+    buffer = ""
+    # Parallel lists: buffer offset where a section starts, and that section's page number
+    mark_offsets = []
+    mark_pages = []
+
+    def page_at(offset):
+        index = bisect.bisect_right(mark_offsets, offset) - 1
+        return mark_pages[index] if index >= 0 else None
+
+    def locate_chunks():
+        if hasattr(text_splitter, "split_text_with_offsets"):
+            return list(text_splitter.split_text_with_offsets(buffer))
+        located = []
+        search_from = 0
+        previous_length = 0
+        for chunk in text_splitter.split_text(buffer):
+            start = buffer.find(chunk, max(0, search_from + previous_length - chunk_overlap))
+            if start < 0:
+                start = buffer.find(chunk, search_from)
+            if start < 0:
+                start = search_from
+            located.append((chunk, start))
+            search_from = start
+            previous_length = len(chunk)
+        return located
+
+    for page_number, text in sections:
+        if not text:
+            continue
+        mark_offsets.append(len(buffer))
+        mark_pages.append(page_number)
+        buffer += text
+        if len(buffer) < window_size:
+            continue
+
+        located = locate_chunks()
+        if len(located) < 2 or located[-1][1] == 0:
+            continue
+        # The last chunk may continue in the next section, so it is re-split together with it
+        for chunk, start in located[:-1]:
+            yield chunk, page_at(start)
+
+        cut = located[-1][1]
+        carried_page = page_at(cut)
+        buffer = buffer[cut:]
+        kept = [(offset - cut, page) for offset, page in zip(mark_offsets, mark_pages) if offset > cut]
+        mark_offsets = [0] + [offset for offset, _ in kept]
+        mark_pages = [carried_page] + [page for _, page in kept]
+
+    if buffer.strip():
+        for chunk, start in locate_chunks():
+            yield chunk, page_at(start)
@@ -0,0 +1,138 @@
+# collection_scanner.py
+# Batched scans over a collection with get(limit=..., offset=...) pages, plus the bulk admin operations built
+# on them. Memory stays bounded by one page (and by the number of files for per-file aggregates), however
+# many chunks the collection holds.
+
+import hashlib
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_pages(collection, where=None, include=("metadatas",), batch_size=DEFAULT_BATCH_SIZE):
+    # Pages are addressed by offset, so the collection must not change while it is being scanned
+    offset = 0
+    while True:
+        page = collection.get(where=where, limit=batch_size, offset=offset, include=list(include))
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+        if len(page["ids"]) < batch_size:
+            return
+
+
+def iter_chunks(collection, where=None, include=("metadatas",), batch_size=DEFAULT_BATCH_SIZE):
+    # Yields (chunk_id, metadata, document); fields not in include are None
+    for page in iter_pages(collection, where, include, batch_size):
+        metadatas = page.get("metadatas") if "metadatas" in include else None
+        documents = page.get("documents") if "documents" in include else None
+        for i, chunk_id in enumerate(page["ids"]):
+            yield (chunk_id,
+                   (metadatas[i] or {}) if metadatas is not None else None,
+                   documents[i] if documents is not None else None)
+
+
+def count_where(collection, where=None, batch_size=DEFAULT_BATCH_SIZE):
+    if not where:
+        return collection.count()
+    return sum(len(page["ids"]) for page in iter_pages(collection, where, include=(), batch_size=batch_size))
+
+
+def _add_sources(sources, metadatas):
+    # Collects the source_filename of deleted chunks, for callers that tell the API workers about them
+    if sources is not None:
+        sources.update(metadata["source_filename"] for metadata in metadatas
+                       if metadata and metadata.get("source_filename") is not None)
+
+
+def delete_where(collection, where, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, sources=None):
+    # Deletes matching chunks one page of IDs at a time; dry_run only counts them. sources, a set, gets the
+    # filenames of the deleted chunks
+    if not where:
+        raise ValueError("delete_where needs a non-empty filter")
+    if dry_run:
+        return count_where(collection, where, batch_size)
+    deleted = 0
+    while True:
+        # Always offset 0: each delete shifts the remaining matches to the front
+        page = collection.get(where=where, limit=batch_size, include=["metadatas"] if sources is not None else [])
+        if not page["ids"]:
+            return deleted
+        collection.delete(ids=page["ids"])
+        _add_sources(sources, page.get("metadatas") or [])
+        deleted += len(page["ids"])
+
+
+def filename_hash(filename):
+    # Same key app.py stores in each chunk's _filename_hash
+    return hashlib.sha256(filename.encode("utf-8")).hexdigest()
+
+
+def delete_filenames(collection, filenames, registry=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    # Returns {filename: chunks deleted (or matched, for dry_run)}; registry rows are removed alongside
+    results = {}
+    for filename in filenames:
+        where = {"_filename_hash": {"$eq": filename_hash(filename)}}
+        results[filename] = delete_where(collection, where, batch_size, dry_run)
+        if registry is not None and not dry_run:
+            registry.delete(filename)
+    return results
+
+
+def file_stats(collection, batch_size=DEFAULT_BATCH_SIZE):
+    # {filename: {"chunks", "characters", "document_type"}}; chunks without source_filename count under None
+    stats = {}
+    for _, metadata, document in iter_chunks(collection, include=("metadatas", "documents"), batch_size=batch_size):
+        entry = stats.setdefault(metadata.get("source_filename"), {
+            "chunks": 0, "characters": 0, "document_type": metadata.get("document_type"),
+        })
+        entry["chunks"] += 1
+        entry["characters"] += len(document or "")
+    return stats
+
+
+def _page_orphans(page, registry=None):
+    # [(chunk_id, metadata, reason)] for one page: chunks no file owns, because they have no source_filename,
+    # a _filename_hash that does not match it (so delete-by-filename would miss them), or a file the
+    # registry does not list. The registry is asked once per page, for that page's filenames only
+    metadatas = [metadata or {} for metadata in page["metadatas"]]
+    known = None
+    if registry is not None:
+        known = registry.existing({metadata["source_filename"] for metadata in metadatas
+                                   if metadata.get("source_filename") is not None})
+    orphans = []
+    for chunk_id, metadata in zip(page["ids"], metadatas):
+        filename = metadata.get("source_filename")
+        if filename is None:
+            orphans.append((chunk_id, metadata, "no source_filename"))
+        elif metadata.get("_filename_hash") != filename_hash(filename):
+            orphans.append((chunk_id, metadata, "filename hash mismatch"))
+        elif known is not None and filename not in known:
+            orphans.append((chunk_id, metadata, "file not in registry"))
+    return orphans
+
+
+def find_orphans(collection, registry=None, batch_size=DEFAULT_BATCH_SIZE):
+    # Yields (chunk_id, metadata, reason); see _page_orphans
+    for page in iter_pages(collection, batch_size=batch_size):
+        yield from _page_orphans(page, registry)
+
+
+def delete_orphans(collection, registry=None, batch_size=DEFAULT_BATCH_SIZE, sources=None):
+    # Finds and deletes orphans one page at a time. Deleting shifts the chunks after them forward, so the
+    # offset only advances past the chunks that were kept. sources works as in delete_where
+    deleted = 0
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            return deleted
+        orphans = _page_orphans(page, registry)
+        orphan_ids = [chunk_id for chunk_id, _, _ in orphans]
+        if orphan_ids:
+            collection.delete(ids=orphan_ids)
+            _add_sources(sources, [metadata for _, metadata, _ in orphans])
+            deleted += len(orphan_ids)
+        offset += len(page["ids"]) - len(orphan_ids)
+        if len(page["ids"]) < batch_size:
+            return deleted
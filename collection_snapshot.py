@@ -0,0 +1,223 @@
+# collection_snapshot.py
+# Export a collection (ids, documents, metadatas and embeddings) to a compact on-disk snapshot and restore it
+# into ChromaDB or the local index without re-parsing or re-embedding anything. Embeddings are one contiguous
+# float32/float16 matrix that np.memmap can open directly; the other columns are gzip-compressed JSON lines
+# in the same row order. Export pages through the collection in bounded batches, import writes large batches
+# from several threads.
+#
+# ตัวอย่าง: python3 collection_snapshot.py export rag_data/exports/rag_documents
+#          VECTOR_BACKEND=local python3 collection_snapshot.py import rag_data/exports/rag_documents
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from local_vector_index import open_collection
+from sharding import open_sharded_collection
+
+# Configuration (ต้องตรงกับที่ใช้ใน app.py ของคุณ)
+CHROMA_HOST = os.getenv("CHROMA_HOST", "10.10.32.78")
+CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "rag_documents")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "nomic-embed-text:latest")
+OLLAMA_EMBED_BATCH_API = os.getenv("OLLAMA_EMBED_BATCH_API", "false").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL_NAME}@api/embed" if OLLAMA_EMBED_BATCH_API else EMBEDDING_MODEL_NAME
+RAG_DATA_DIR = os.getenv("RAG_DATA_DIR", "rag_data")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(RAG_DATA_DIR, "vector_index"))
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")
+SHARD_KEY = os.getenv("SHARD_KEY", "")
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+COLUMN_FILES = {"ids": "ids.jsonl.gz", "documents": "documents.jsonl.gz", "metadatas": "metadatas.jsonl.gz"}
+
+
+def open_target(collection_name):
+    options = dict(chroma_host=CHROMA_HOST, chroma_port=CHROMA_PORT,
+                   local_path=LOCAL_INDEX_DIR, dtype=LOCAL_INDEX_DTYPE, index_mode=LOCAL_INDEX_MODE)
+    if SHARD_KEY:
+        return open_sharded_collection(VECTOR_BACKEND, collection_name, SHARD_KEY, **options)
+    return open_collection(VECTOR_BACKEND, collection_name, **options)
+
+
+def load_snapshot(directory):
+    # Returns (manifest, embeddings memmap of shape (count, dimension)); columns are read with iter_column
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version {manifest.get('format_version')}")
+    count, dimension = manifest["count"], manifest["dimension"]
+    if count and dimension:
+        embeddings = np.memmap(os.path.join(directory, EMBEDDINGS_FILE), dtype=manifest["dtype"], mode="r",
+                               shape=(count, dimension))
+    else:
+        embeddings = np.zeros((0, dimension or 0), dtype=manifest["dtype"])
+    return manifest, embeddings
+
+
+def iter_column(directory, column):
+    with gzip.open(os.path.join(directory, COLUMN_FILES[column]), "rt", encoding="utf-8") as column_file:
+        for line in column_file:
+            yield json.loads(line)
+
+
+def print_progress(action, done, total, started_at):
+    elapsed = time.time() - started_at
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"{action}: {done}/{total} chunks, {rate:.0f} chunks/s, {elapsed:.0f}s elapsed")
+
+
+# --- Export ---
+def export_collection(collection, directory, dtype="float32", batch_size=2000, collection_name=COLLECTION_NAME):
+    # Writes are not blocked during export: stop ingestion first so paging sees a stable row order
+    os.makedirs(directory, exist_ok=True)
+    total = collection.count()
+    started_at = time.time()
+    exported = 0
+    dimension = None
+    column_files = {column: gzip.open(os.path.join(directory, name), "wt", encoding="utf-8", compresslevel=3)
+                    for column, name in COLUMN_FILES.items()}
+    try:
+        with open(os.path.join(directory, EMBEDDINGS_FILE), "wb") as embeddings_file:
+            while True:
+                page = collection.get(limit=batch_size, offset=exported,
+                                      include=["documents", "metadatas", "embeddings"])
+                if not len(page["ids"]):
+                    break
+                vectors = np.asarray(page["embeddings"], dtype=dtype)
+                if dimension is None:
+                    dimension = vectors.shape[1]
+                elif vectors.shape[1] != dimension:
+                    raise ValueError(f"Embedding dimension changed from {dimension} to {vectors.shape[1]} at row {exported}")
+                embeddings_file.write(np.ascontiguousarray(vectors).tobytes())
+                for column in COLUMN_FILES:
+                    column_files[column].write("".join(
+                        json.dumps(value, ensure_ascii=False) + "\n" for value in page[column]))
+                exported += len(page["ids"])
+                print_progress("Exported", exported, total, started_at)
+    finally:
+        for column_file in column_files.values():
+            column_file.close()
+
+    if exported != total:
+        print(f"WARNING: Collection had {total} chunks at start but {exported} were exported; it changed during export.")
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "collection": collection_name,
+        "embedding_model": EMBEDDING_CACHE_KEY,
+        "count": exported,
+        "dimension": dimension,
+        "dtype": np.dtype(dtype).name,
+        "created_at": time.time(),
+    }
+    # Written last: a directory without a manifest is an incomplete export
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    return manifest
+
+
+# --- Import ---
+def import_collection(collection, directory, batch_size=2000, workers=4, upsert=False):
+    manifest, embeddings = load_snapshot(directory)
+    total = manifest["count"]
+    write = collection.upsert if upsert else collection.add
+    started_at = time.time()
+    imported = 0
+    columns = {column: iter_column(directory, column) for column in COLUMN_FILES}
+
+    def write_batch(start, ids, documents, metadatas):
+        # float16 snapshots are upcast a batch at a time, so memory stays bounded by batch_size
+        write(ids=ids, embeddings=np.asarray(embeddings[start:start + len(ids)], dtype=np.float32),
+              metadatas=metadatas, documents=documents)
+        return len(ids)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as executor:
+        in_flight = []
+        for start in range(0, total, batch_size):
+            size = min(batch_size, total - start)
+            ids = [next(columns["ids"]) for _ in range(size)]
+            documents = [next(columns["documents"]) for _ in range(size)]
+            metadatas = [next(columns["metadatas"]) for _ in range(size)]
+            in_flight.append(executor.submit(write_batch, start, ids, documents, metadatas))
+            # Bounded read-ahead: at most two batches per worker are held in memory
+            while len(in_flight) >= workers * 2:
+                imported += in_flight.pop(0).result()
+                print_progress("Imported", imported, total, started_at)
+        for future in in_flight:
+            imported += future.result()
+            print_progress("Imported", imported, total, started_at)
+    return imported
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export or restore the RAG collection without re-embedding.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Dump the collection to a snapshot directory")
+    export_parser.add_argument("directory", help="Output directory (created if missing)")
+    export_parser.add_argument("--collection", default=COLLECTION_NAME, help="Collection to export")
+    export_parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                               help="Embedding storage type; float16 halves the size")
+    export_parser.add_argument("--batch-size", type=int, default=2000, help="Chunks per page read from the collection")
+
+    import_parser = subparsers.add_parser("import", help="Restore a snapshot directory into the collection")
+    import_parser.add_argument("directory", help="Snapshot directory written by export")
+    import_parser.add_argument("--collection", default=None, help="Target collection (default: the exported one)")
+    import_parser.add_argument("--batch-size", type=int, default=2000, help="Chunks per add call")
+    import_parser.add_argument("--workers", type=int, default=4, help="Add calls in flight")
+    import_parser.add_argument("--upsert", action="store_true", help="Replace existing IDs instead of adding")
+    import_parser.add_argument("--force", action="store_true",
+                               help="Import even if the snapshot was made with a different embedding model")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    manifest = None
+    if args.command == "import":
+        try:
+            manifest, _ = load_snapshot(args.directory)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ERROR: '{args.directory}' is not a complete snapshot. Error: {e}")
+            return 2
+        if manifest["embedding_model"] != EMBEDDING_CACHE_KEY and not args.force:
+            print(f"ERROR: Snapshot embeddings come from '{manifest['embedding_model']}' but this deployment uses "
+                  f"'{EMBEDDING_CACHE_KEY}'. Queries would not match them; use --force to import anyway.")
+            return 2
+    collection_name = args.collection or manifest["collection"]
+
+    try:
+        # The local index is a single-process store: stop app.py before importing into it
+        collection = open_target(collection_name)
+        print(f"Opened vector backend '{VECTOR_BACKEND}', collection: {collection_name}")
+    except Exception as e:
+        print(f"ERROR: Could not open vector backend '{VECTOR_BACKEND}'. Error: {e}")
+        return 1
+
+    started_at = time.time()
+    try:
+        if args.command == "export":
+            manifest = export_collection(collection, args.directory, dtype=args.dtype, batch_size=args.batch_size,
+                                         collection_name=collection_name)
+            print(f"Exported {manifest['count']} chunks to '{args.directory}' in {time.time() - started_at:.1f}s")
+        else:
+            imported = import_collection(collection, args.directory, batch_size=args.batch_size,
+                                         workers=args.workers, upsert=args.upsert)
+            print(f"Imported {imported} chunks into '{collection_name}' in {time.time() - started_at:.1f}s")
+    finally:
+        if VECTOR_BACKEND == "local" or SHARD_KEY:
+            collection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# context_packing.py
+# Builds the prompt context from retrieved chunks: merges chunks that are adjacent in the same file,
+# drops the text they share through the splitter's chunk_overlap, orders passages and trims them to a token budget.
+
+from token_counting import TokenCounter
+
+# Overlaps shorter than this are treated as coincidence rather than splitter overlap
+MIN_OVERLAP_CHARS = 20
+
+
+def remove_overlap(previous, following, max_overlap):
+    # Longest suffix of `previous` that `following` starts with, up to max_overlap characters
+    for size in range(min(max_overlap, len(previous), len(following)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:size]):
+            return following[size:]
+    return None
+
+
+def merge_adjacent(docs, max_overlap):
+    # Returns passages as (best retrieval rank, text), one per run of consecutive chunk_ids of a file
+    chunks = {}
+    loose = []
+    for rank, doc in enumerate(docs):
+        source = doc.metadata.get("source_filename")
+        chunk_id = doc.metadata.get("chunk_id")
+        if source is None or chunk_id is None:
+            loose.append((rank, doc.page_content))
+        elif (source, chunk_id) not in chunks:
+            chunks[(source, chunk_id)] = (rank, doc.page_content)
+
+    passages = []
+    run = None
+    for (source, chunk_id), (rank, text) in sorted(chunks.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        if run and run["source"] == source and run["last_id"] == chunk_id - 1:
+            rest = remove_overlap(run["text"], text, max_overlap)
+            run["text"] = run["text"] + rest if rest is not None else run["text"] + "\n" + text
+            run["rank"] = min(run["rank"], rank)
+            run["last_id"] = chunk_id
+            continue
+        if run:
+            passages.append((run["rank"], run["text"]))
+        run = {"source": source, "last_id": chunk_id, "rank": rank, "text": text}
+    if run:
+        passages.append((run["rank"], run["text"]))
+    return passages + loose
+
+
+def order_passages(passages, order):
+    ranked = [text for _, text in sorted(passages, key=lambda passage: passage[0])]
+    if order != "edges":
+        return ranked
+    # Best passages at both ends of the context, weakest in the middle, where models attend least
+    front, back = [], []
+    for i, text in enumerate(ranked):
+        (front if i % 2 == 0 else back).append(text)
+    return front + back[::-1]
+
+
+class ContextPacker:
+    def __init__(self, tokenizer_name="gpt2", token_budget=3000, max_overlap=400, order="relevance"):
+        self.tokens = TokenCounter(tokenizer_name)
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+        self.order = order
+
+    def load_tokenizer(self):
+        return self.tokens.load()
+
+    def count_tokens(self, text):
+        return self.tokens.count(text)
+
+    def truncate(self, text, max_tokens):
+        return self.tokens.truncate(text, max_tokens)
+
+    def pack(self, docs):
+        # Returns (context text, stats). Passages are admitted in relevance order until the budget is used,
+        # then laid out according to self.order
+        passages = sorted(merge_adjacent(docs, self.max_overlap), key=lambda passage: passage[0])
+        selected = []
+        used = 0
+        truncated = 0
+        for rank, text in passages:
+            tokens = self.count_tokens(text)
+            remaining = self.token_budget - used if self.token_budget > 0 else tokens
+            if tokens <= remaining:
+                selected.append((rank, text))
+                used += tokens
+            elif remaining >= 64:
+                # Keep a partial passage only when a meaningful amount of room is left
+                selected.append((rank, self.truncate(text, remaining)))
+                used += remaining
+                truncated += 1
+        return "\n\n".join(order_passages(selected, self.order)), {
+            "chunks": len(docs),
+            "passages": len(passages),
+            "packed_passages": len(selected),
+            "truncated_passages": truncated,
+            "context_tokens": used,
+        }
@@ -0,0 +1,130 @@
+# conversation_memory.py
+# ConversationSummaryBufferMemory with summarization moved off the request path: save_context only appends the
+# turn, and summarize() - the LLM call that folds the oldest messages into the running summary once
+# max_token_limit is exceeded - runs afterwards on a SessionTaskQueue, which keeps each session's tasks in order.
+# SharedSummaryMemory does the same on top of a SQLiteSessionStore, for sessions shared by worker processes.
+
+import threading
+from collections import deque
+from typing import Any
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string
+from pydantic import PrivateAttr
+
+
+class BackgroundSummaryMemory(ConversationSummaryBufferMemory):
+    _lock = PrivateAttr(default_factory=threading.Lock)
+
+    def load_memory_variables(self, inputs):
+        # A copy: the live message list changes while the chain is still formatting its prompt
+        with self._lock:
+            variables = super().load_memory_variables(inputs)
+        history = variables[self.memory_key]
+        return {self.memory_key: list(history) if isinstance(history, list) else history}
+
+    def save_context(self, inputs, outputs):
+        # Append only; call summarize() later to bring the buffer back under max_token_limit
+        with self._lock:
+            BaseChatMemory.save_context(self, inputs, outputs)
+
+    def summarize(self):
+        # Returns True when messages were summarized. Must not run concurrently for the same memory: turns
+        # may be appended meanwhile, but only this method removes messages, so the oldest ones stay in place
+        with self._lock:
+            messages = list(self.chat_memory.messages)
+            summary = self.moving_summary_buffer
+        pruned = self._count_pruned(messages)
+        if not pruned:
+            return False
+        # Readers keep seeing the old summary and the unpruned messages until the new summary is ready
+        new_summary = self.predict_new_summary(messages[:pruned], summary)
+        with self._lock:
+            del self.chat_memory.messages[:pruned]
+            self.moving_summary_buffer = new_summary
+        return True
+
+    def _count_pruned(self, messages):
+        # How many of the oldest messages must go into the summary to get under max_token_limit
+        pruned = 0
+        tokens = self.llm.get_num_tokens_from_messages(messages)
+        while tokens > self.max_token_limit and pruned < len(messages):
+            pruned += 1
+            tokens = self.llm.get_num_tokens_from_messages(messages[pruned:])
+        return pruned
+
+
+class SharedSummaryMemory(BackgroundSummaryMemory):
+    # Holds no conversation state itself: every call goes to the SQLiteSessionStore, so any worker process
+    # can serve the next turn. summarize() may run on two workers at once; the store keeps the first result
+    store: Any = None
+    session_id: str = ""
+
+    def load_memory_variables(self, inputs):
+        summary, _, messages = self.store.load(self.session_id)
+        buffer = [message for _, message in messages]
+        if summary:
+            buffer = [self.summary_message_cls(content=summary)] + buffer
+        if not self.return_messages:
+            buffer = get_buffer_string(buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        return {self.memory_key: buffer}
+
+    def save_context(self, inputs, outputs):
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.store.append(self.session_id, [HumanMessage(content=input_str), AIMessage(content=output_str)])
+
+    def summarize(self):
+        summary, summarized_through, messages = self.store.load(self.session_id)
+        pruned = self._count_pruned([message for _, message in messages])
+        if not pruned:
+            return False
+        new_summary = self.predict_new_summary([message for _, message in messages[:pruned]], summary)
+        return self.store.replace_summary(self.session_id, new_summary, messages[pruned - 1][0], summarized_through)
+
+
+class SessionTaskQueue:
+    # Runs tasks with the same key one at a time in submission order; different keys run in parallel on the executor
+    def __init__(self, executor):
+        self.executor = executor
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self._queues[key] = deque([(fn, args)])
+        self.executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                fn, args = self._queues[key][0]
+            try:
+                fn(*args)
+                succeeded = True
+            except Exception as e:
+                print(f"ERROR: Background task for session {key} failed. Error: {e}")
+                succeeded = False
+            with self._lock:
+                self.completed += succeeded
+                self.failed += not succeeded
+                queue = self._queues[key]
+                queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                    return
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": sum(len(queue) for queue in self._queues.values()),
+                "sessions_pending": len(self._queues),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
@@ -0,0 +1,93 @@
+# document_parsers.py
+# Lazy document parsers: each yields (page_number, text) sections instead of building the whole text,
+# so ingestion memory stays bounded. Large PDFs are extracted page-range by page-range on a process pool.
+
+import io
+from collections import deque
+
+from pypdf import PdfReader
+from docx import Document
+
+TEXT_READ_SIZE = 64 * 1024
+
+
+def _extract_pdf_pages(path, start, end):
+    # Runs in a worker process; re-opens the file so only the path crosses the process boundary
+    reader = PdfReader(path)
+    return [(page_number + 1, reader.pages[page_number].extract_text() or "") for page_number in range(start, end)]
+
+
+def iter_pdf_pages(path, process_pool=None, min_pages_for_pool=64, pages_per_task=16, max_tasks_in_flight=8):
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+
+    if process_pool is None or page_count < min_pages_for_pool:
+        for page_number, page in enumerate(reader.pages, start=1):
+            yield page_number, (page.extract_text() or "") + "\n"
+        return
+
+    del reader
+    ranges = iter([(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)])
+    in_flight = deque()
+    try:
+        # Keep a bounded window of page ranges in flight and yield them back in page order
+        for start, end in ranges:
+            in_flight.append(process_pool.submit(_extract_pdf_pages, path, start, end))
+            if len(in_flight) >= max_tasks_in_flight:
+                break
+        while in_flight:
+            pages = in_flight.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                in_flight.append(process_pool.submit(_extract_pdf_pages, path, *next_range))
+            for page_number, text in pages:
+                yield page_number, text + "\n"
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _docx_heading_level(paragraph):
+    # Built-in "Title" / "Heading N" styles; python-docx reports their English names in any Word locale
+    name = paragraph.style.name if paragraph.style is not None else ""
+    if name == "Title":
+        return 1
+    if name.startswith("Heading ") and name[8:].isdigit():
+        return min(int(name[8:]), 6)
+    return 0
+
+
+def iter_docx_sections(path):
+    # Headings are emitted as Markdown headings so the chunker can start chunks at them
+    document = Document(path)
+    for paragraph in document.paragraphs:
+        level = _docx_heading_level(paragraph) if paragraph.text.strip() else 0
+        if level:
+            yield None, "#" * level + " " + paragraph.text + "\n"
+        else:
+            yield None, paragraph.text + "\n"
+
+
+def iter_text_sections(path):
+    with io.open(path, "r", encoding="utf-8", newline="") as text_file:
+        while True:
+            block = text_file.read(TEXT_READ_SIZE)
+            if not block:
+                return
+            yield None, block
+
+
+# File extension -> (section iterator, label used in error messages)
+SECTION_READERS = {
+    ".pdf": (iter_pdf_pages, "PDF"),
+    ".docx": (iter_docx_sections, "DOCX"),
+    ".txt": (iter_text_sections, "TXT"),
+    ".md": (iter_text_sections, "Markdown"),
+}
+
+
+def get_file_type(filename):
+    for extension in SECTION_READERS:
+        if filename.endswith(extension):
+            return extension
+    return None
@@ -0,0 +1,151 @@
+# document_registry.py
+# SQLite sidecar listing every ingested document (one row per file), maintained on ingest and delete,
+# so /files_list and the dashboard no longer scan every chunk's metadata in ChromaDB.
+
+import json
+import time
+
+from collection_scanner import iter_chunks
+from sqlite_store import SQLiteStore
+
+# Distinct searches whose totals are cached per registry version
+COUNT_CACHE_SIZE = 256
+
+COLUMNS = ["filename", "filename_hash", "content_hash", "chunk_count", "byte_size", "ingested_at", "embedding_model", "metadata"]
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class DocumentRegistry(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self._counts = {}
+        self._counts_version = None
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " filename TEXT PRIMARY KEY,"
+            " filename_hash TEXT NOT NULL,"
+            " content_hash TEXT,"
+            " chunk_count INTEGER NOT NULL,"
+            " byte_size INTEGER,"
+            " ingested_at REAL NOT NULL,"
+            " embedding_model TEXT,"
+            " metadata TEXT)"
+        )
+        # Bumped on every change; used as the ETag of list responses
+        conn.execute("CREATE TABLE IF NOT EXISTS registry_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO registry_state (key, value) VALUES ('version', 0)")
+        conn.commit()
+
+    def upsert(self, filename, filename_hash, chunk_count, content_hash=None, byte_size=None,
+               embedding_model=None, metadata=None, ingested_at=None):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (filename, filename_hash, content_hash, chunk_count, byte_size,"
+                " ingested_at, embedding_model, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, filename_hash, content_hash, chunk_count, byte_size, ingested_at or time.time(),
+                 embedding_model, json.dumps(metadata or {}, ensure_ascii=False)),
+            )
+            self._bump_version(conn)
+
+    def delete(self, filename):
+        conn = self._connect()
+        with conn:
+            row = conn.execute("SELECT chunk_count FROM documents WHERE filename = ?", (filename,)).fetchone()
+            conn.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+            self._bump_version(conn)
+        return row[0] if row else 0
+
+    def get(self, filename):
+        row = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE filename = ?", (filename,)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def existing(self, filenames):
+        # The subset of filenames that have a row, looked up in chunks that stay under SQLite's variable limit
+        filenames = list(filenames)
+        found = set()
+        conn = self._connect()
+        for start in range(0, len(filenames), 500):
+            batch = filenames[start:start + 500]
+            rows = conn.execute(
+                f"SELECT filename FROM documents WHERE filename IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def list(self, after=None, limit=None, search=None, with_total=False):
+        # Keyset pagination: after is the last filename of the previous page, so a page is a range scan on the
+        # primary key however deep it is. The total is only counted when asked for (see count)
+        clauses, params = [], []
+        if after is not None:
+            clauses.append("filename > ?")
+            params.append(after)
+        if search:
+            clauses.append("filename LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(search)}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents {where} ORDER BY filename LIMIT ?",
+            [*params, -1 if limit is None else limit],
+        ).fetchall()
+        return [self._row_to_dict(row) for row in rows], self.count(search) if with_total else None
+
+    def count(self, search=None):
+        # Counts are cached against version(), so paging through an unchanged registry counts once per search
+        version = self.version()
+        counts = self._counts
+        if self._counts_version != version:
+            counts = self._counts = {}
+            self._counts_version = version
+        total = counts.get(search or "")
+        if total is None:
+            where, params = "", []
+            if search:
+                where = "WHERE filename LIKE ? ESCAPE '\\'"
+                params.append(f"%{_escape_like(search)}%")
+            total = self._connect().execute(f"SELECT COUNT(*) FROM documents {where}", params).fetchone()[0]
+            if len(counts) < COUNT_CACHE_SIZE:
+                counts[search or ""] = total
+        return total
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM registry_state WHERE key = 'version'").fetchone()[0]
+
+    def rebuild_from_collection(self, collection, page_size=1000):
+        # One-off bootstrap for collections ingested before the registry existed: page through chunk
+        # metadata and aggregate per filename. Size and content hash are unknown for these rows.
+        documents = {}
+        for _, metadata, _ in iter_chunks(collection, include=['metadatas'], batch_size=page_size):
+            filename = metadata.get('source_filename')
+            if filename is None:
+                continue
+            entry = documents.setdefault(filename, {"filename_hash": metadata.get('_filename_hash', ""), "chunk_count": 0,
+                                                    "metadata": {k: v for k, v in metadata.items()
+                                                                 if not k.startswith("_") and k not in ("source_filename", "chunk_id", "page_number")}})
+            entry["chunk_count"] += 1
+
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM documents")
+            conn.executemany(
+                "INSERT INTO documents (filename, filename_hash, content_hash, chunk_count, byte_size, ingested_at,"
+                " embedding_model, metadata) VALUES (?, ?, NULL, ?, NULL, ?, NULL, ?)",
+                [(filename, entry["filename_hash"], entry["chunk_count"], time.time(),
+                  json.dumps(entry["metadata"], ensure_ascii=False)) for filename, entry in documents.items()],
+            )
+            self._bump_version(conn)
+        return len(documents)
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE registry_state SET value = value + 1 WHERE key = 'version'")
+
+    def _row_to_dict(self, row):
+        document = dict(zip(COLUMNS, row))
+        document["metadata"] = json.loads(document["metadata"]) if document["metadata"] else {}
+        return document
@@ -0,0 +1,104 @@
+# embedding_cache.py
+# Persistent chunk-level embedding cache keyed on (embedding model, SHA-256 of chunk text).
+# Lets re-ingestion of an edited file embed only the chunks whose text actually changed.
+
+import hashlib
+from array import array
+
+from sqlite_store import SQLiteStore
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ChunkIdAssigner:
+    # Content-addressed IDs: identical chunk text keeps the same ID across re-ingestion.
+    # The occurrence counter keeps IDs unique when a file repeats the same chunk text.
+    def __init__(self, filename):
+        self.filename = filename
+        self.seen = {}
+
+    def __call__(self, text_hash):
+        occurrence = self.seen.get(text_hash, 0)
+        self.seen[text_hash] = occurrence + 1
+        return f"{self.filename}_{text_hash[:16]}_{occurrence}"
+
+
+def make_chunk_ids(filename, chunk_hashes):
+    assign_id = ChunkIdAssigner(filename)
+    return [assign_id(h) for h in chunk_hashes]
+
+
+class EmbeddingCache(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        conn.commit()
+
+    def get_many(self, model, text_hashes):
+        found = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        conn = self._connect()
+        for start in range(0, len(unique_hashes), _LOOKUP_BATCH_SIZE):
+            batch = unique_hashes[start:start + _LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch],
+            )
+            for text_hash, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                found[text_hash] = vector.tolist()
+        return found
+
+    def put_many(self, model, items):
+        rows = [
+            (model, text_hash, len(vector), array('f', vector).tobytes())
+            for text_hash, vector in items
+        ]
+        if not rows:
+            return
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+    def count(self, model=None):
+        conn = self._connect()
+        if model is None:
+            return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+
+def embed_with_cache(embeddings, cache, model, texts, text_hashes):
+    # Look up every chunk in the persistent cache first and only send the misses to Ollama.
+    # Returns (vectors in input order, number of chunks that had to be embedded).
+    cached = cache.get_many(model, text_hashes) if cache else {}
+    missing_positions = [i for i, h in enumerate(text_hashes) if h not in cached]
+    if missing_positions:
+        new_vectors = embeddings.embed_documents([texts[i] for i in missing_positions])
+        new_items = {}
+        for i, vector in zip(missing_positions, new_vectors):
+            cached[text_hashes[i]] = vector
+            new_items[text_hashes[i]] = vector
+        if cache:
+            try:
+                cache.put_many(model, new_items.items())
+            except Exception as e:
+                print(f"WARNING: Could not write embeddings to cache. Error: {e}")
+    return [cached[h] for h in text_hashes], len(missing_positions)
@@ -0,0 +1,91 @@
+# embedding_pipeline.py
+# Splits chunks into batches, keeps a bounded number of embedding requests in flight, retries failed
+# batches on their own and hands every finished batch to a sink (e.g. collection.add) right away.
+
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class EmbeddingBatchError(Exception):
+    pass
+
+
+def iter_batches(items, batch_size):
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class EmbeddingPipeline:
+    def __init__(self, batch_size=32, concurrency=4, max_retries=3, retry_backoff=1.0, max_workers=None):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # Shared by every ingest job; each run() still keeps at most `concurrency` batches in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or concurrency, thread_name_prefix="embed")
+
+    def run(self, items, embed_fn, sink, label=""):
+        # embed_fn(batch) -> vectors runs on the pool; sink(batch, vectors) runs on the calling thread
+        stats = {"chunks": 0, "batches": 0, "retries": 0}
+        started_at = time.time()
+        batches = iter_batches(items, self.batch_size)
+        in_flight = set()
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            future = self.executor.submit(self._embed_with_retry, batch, embed_fn, stats, label)
+            future.batch = batch
+            in_flight.add(future)
+            return True
+
+        try:
+            while len(in_flight) < self.concurrency and submit_next():
+                pass
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    vectors = future.result()
+                    sink(future.batch, vectors)
+                    stats["chunks"] += len(future.batch)
+                    stats["batches"] += 1
+                    submit_next()
+        except Exception:
+            for future in in_flight:
+                future.cancel()
+            raise
+
+        elapsed = time.time() - started_at
+        stats["seconds"] = round(elapsed, 3)
+        stats["chunks_per_second"] = round(stats["chunks"] / elapsed, 2) if elapsed > 0 else 0.0
+        stats["batch_size"] = self.batch_size
+        stats["concurrency"] = self.concurrency
+        if stats["chunks"]:
+            print(f"Embedded {stats['chunks']} chunks{' for ' + label if label else ''} in {stats['batches']} batches "
+                  f"({stats['chunks_per_second']} chunks/s, batch_size={self.batch_size}, concurrency={self.concurrency}, "
+                  f"retries={stats['retries']})")
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _embed_with_retry(self, batch, embed_fn, stats, label):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return embed_fn(batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise EmbeddingBatchError(
+                        f"Embedding batch of {len(batch)} chunks failed after {attempt + 1} attempts: {e}"
+                    ) from e
+                stats["retries"] += 1
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"WARNING: Embedding batch{' for ' + label if label else ''} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
@@ -0,0 +1,378 @@
+# http_clients.py
+# Shared connection layer for Ollama and Chroma: pooled keep-alive sessions, connect/read timeouts,
+# bounded retries with backoff on connection errors and 502/503/504, and a circuit breaker per backend
+# that fails fast while a backend is down instead of letting every request wait for its timeout.
+
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain_community.chat_models import ChatOllama
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms import Ollama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold consecutive failures; after reset_timeout seconds one trial call
+    # is let through (half_open) and its outcome closes or re-opens the circuit
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, state_gauge=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state_gauge = state_gauge
+        self._set_state("closed")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        if self.state_gauge is not None:
+            self.state_gauge.set(1 if state == "open" else 0, backend=self.name)
+
+    def before_call(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_in = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+            if self.state != "closed":
+                print(f"Circuit for {self.name} closed.")
+                self._set_state("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.failure_threshold > 0 and (
+                    self.state == "half_open" or self.consecutive_failures >= self.failure_threshold):
+                if self.state != "open":
+                    print(f"WARNING: Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures.")
+                self._set_state("open")
+                self.opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self, is_failure=lambda e: True):
+        # is_failure decides which exceptions count against the backend (e.g. not a 404 for a missing model)
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected_calls": self.rejected,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+            }
+
+
+def make_session(pool_size, max_retries, backoff):
+    # Connection errors and gateway statuses are retried with exponential backoff; read timeouts are not,
+    # since a hung generation would otherwise hang max_retries more times
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        backoff_factor=backoff,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class OllamaHTTP:
+    # One pooled requests.Session for worker threads and one aiohttp session per event loop for streaming
+    def __init__(self, base_url, pool_size=16, connect_timeout=5.0, read_timeout=120.0,
+                 max_retries=2, backoff=0.5, keepalive=60.0, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.breaker = breaker or CircuitBreaker("ollama")
+        self.session = make_session(pool_size, max_retries, backoff)
+        self._async_sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_failure(e):
+        return not isinstance(e, OllamaEndpointNotFoundError)
+
+    def _record(self, e):
+        if self._is_failure(e):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _check_status(self, status, text):
+        if status == 200:
+            return
+        if status == 404:
+            raise OllamaEndpointNotFoundError(f"Ollama call failed with status code 404. Details: {text}")
+        raise ValueError(f"Ollama call failed with status code {status}. Details: {text}")
+
+    def post_json(self, path, payload, headers=None, auth=None):
+        with self.breaker.guard(self._is_failure):
+            response = self.session.post(f"{self.base_url}{path}", json=payload, headers=headers, auth=auth,
+                                         timeout=(self.connect_timeout, self.read_timeout))
+            self._check_status(response.status_code, response.text)
+            return response.json()
+
+    def stream_lines(self, path, payload, headers=None, auth=None):
+        # The read timeout applies between streamed lines, so a stalled generation fails instead of hanging
+        self.breaker.before_call()
+        try:
+            response = self.session.post(f"{self.base_url}{path}", json=payload, headers=headers, auth=auth,
+                                         stream=True, timeout=(self.connect_timeout, self.read_timeout))
+            response.encoding = "utf-8"
+            if response.status_code != 200:
+                text = response.text
+                response.close()
+                self._check_status(response.status_code, text)
+        except Exception as e:
+            self._record(e)
+            raise
+        return self._iter_lines(response)
+
+    def _iter_lines(self, response):
+        # A consumer that stops early still counts as a success, so a half-open trial is never left pending
+        failed = False
+        try:
+            yield from response.iter_lines(decode_unicode=True)
+        except Exception:
+            failed = True
+            self.breaker.record_failure()
+            raise
+        finally:
+            response.close()
+            if not failed:
+                self.breaker.record_success()
+
+    def _async_session(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._async_sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive)
+                session = self._async_sessions[loop] = aiohttp.ClientSession(connector=connector)
+            return session
+
+    async def astream_lines(self, path, payload, headers=None, auth=None):
+        self.breaker.before_call()
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        failed = False
+        try:
+            async with self._async_session().post(f"{self.base_url}{path}", json=payload, headers=headers,
+                                                  auth=auth, timeout=timeout) as response:
+                if response.status != 200:
+                    self._check_status(response.status, await response.text())
+                async for line in response.content:
+                    yield line.decode("utf-8")
+        except Exception as e:
+            failed = True
+            self._record(e)
+            raise
+        finally:
+            if not failed:
+                self.breaker.record_success()
+
+    def health(self, timeout=2.0):
+        # Probe bypasses the breaker so it can report recovery while the circuit is still open
+        started = time.perf_counter()
+        try:
+            response = requests.get(f"{self.base_url}/api/version", timeout=timeout)
+            response.raise_for_status()
+            status = {"status": "ok", "version": response.json().get("version")}
+        except Exception as e:
+            status = {"status": "error", "error": str(e)}
+        status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        status["circuit"] = self.breaker.stats()
+        return status
+
+    async def aclose(self):
+        with self._lock:
+            sessions = list(self._async_sessions.values())
+            self._async_sessions.clear()
+        for session in sessions:
+            await session.close()
+        self.session.close()
+
+
+class _PooledOllamaStream:
+    # Replaces the per-call requests.post / aiohttp.ClientSession of langchain_community's Ollama classes
+    # with OllamaHTTP; the request payload is built exactly as _OllamaCommon builds it
+    def _request_payload(self, payload, stop, kwargs):
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+        if payload.get("messages"):
+            return {"messages": payload.get("messages", []), **params}
+        return {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+    def _headers(self):
+        return {"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})}
+
+    def _create_stream(self, api_url, payload, stop=None, **kwargs):
+        return self.http.stream_lines(api_url[len(self.base_url):], self._request_payload(payload, stop, kwargs),
+                                      headers=self._headers(), auth=self.auth)
+
+    async def _acreate_stream(self, api_url, payload, stop=None, **kwargs):
+        async for line in self.http.astream_lines(api_url[len(self.base_url):], self._request_payload(payload, stop, kwargs),
+                                                  headers=self._headers(), auth=self.auth):
+            yield line
+
+
+class PooledOllama(_PooledOllamaStream, Ollama):
+    http: object = None
+
+
+class PooledChatOllama(_PooledOllamaStream, ChatOllama):
+    http: object = None
+
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    http: object = None
+    # True: one /api/embed request per list of texts (Ollama >= 0.3). Its vectors are L2-normalized, unlike
+    # /api/embeddings, so a collection must be ingested and queried with the same setting
+    batch_api: bool = False
+
+    def _headers(self):
+        return {"Content-Type": "application/json", **(self.headers or {})}
+
+    def _process_emb_response(self, input):
+        payload = {"model": self.model, "prompt": input, **self._default_params}
+        return self.http.post_json("/api/embeddings", payload, headers=self._headers())["embedding"]
+
+    def _embed(self, input):
+        if not self.batch_api:
+            return super()._embed(input)
+        payload = {"model": self.model, "input": list(input), "options": self._default_params["options"]}
+        return self.http.post_json("/api/embed", payload, headers=self._headers())["embeddings"]
+
+    def embed_queries(self, texts):
+        return self._embed([f"{self.query_instruction}{text}" for text in texts])
+
+
+def make_chroma_client(host, port, pool_size=16, keepalive=60.0, connect_timeout=5.0, read_timeout=60.0):
+    import chromadb
+    import httpx
+    from chromadb.config import Settings
+
+    client = chromadb.HttpClient(host=host, port=int(port), settings=Settings(
+        chroma_http_max_connections=pool_size,
+        chroma_http_max_keepalive_connections=pool_size,
+        chroma_http_keepalive_secs=keepalive,
+    ))
+    # chromadb 1.x creates its httpx.Client with timeout=None: Settings has no client timeout, and a custom
+    # chroma_api_impl is rejected for HTTP clients. The timeout is set with httpx's own Client.timeout on the
+    # session of the pinned chromadb range (requirements.txt); any other layout is reported, never guessed at
+    session = getattr(getattr(client, "_server", None), "_session", None)
+    if chromadb.__version__.split(".")[0] == "1" and isinstance(session, httpx.Client):
+        session.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    else:
+        print(f"WARNING: ChromaDB client {chromadb.__version__} has no known way to set timeouts; "
+              "calls to ChromaDB will wait without a timeout.")
+    return client
+
+
+def chroma_health(client, breaker=None, timeout=2.0):
+    started = time.perf_counter()
+    try:
+        client.heartbeat()
+        status = {"status": "ok"}
+    except Exception as e:
+        status = {"status": "error", "error": str(e)}
+    status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if breaker is not None:
+        status["circuit"] = breaker.stats()
+    return status
+
+
+class GuardedCollection:
+    # Wraps a Chroma collection: every call goes through the breaker and transport errors are retried
+    # with backoff (collection operations are idempotent apart from add, which is sent once)
+    GUARDED = ("count", "add", "upsert", "update", "delete", "get", "query", "peek")
+
+    def __init__(self, collection, breaker, max_retries=2, backoff=0.5):
+        import httpx
+
+        self._transport_errors = (httpx.TransportError, ConnectionError)
+        self._collection = collection
+        self._breaker = breaker
+        self._max_retries = max_retries
+        self._backoff = backoff
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in self.GUARDED:
+            return attribute
+        retries = 0 if name == "add" else self._max_retries
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            with self._breaker.guard(lambda e: isinstance(e, self._transport_errors)):
+                for attempt in range(retries + 1):
+                    try:
+                        return attribute(*args, **kwargs)
+                    except self._transport_errors:
+                        if attempt == retries:
+                            raise
+                        time.sleep(self._backoff * 2 ** attempt)
+        return call
@@ -0,0 +1,454 @@
+# ingest_bulk.py
+# Bulk ingestion of a directory or an archive (.zip, .tar, .tar.gz) into ChromaDB.
+# Parsing runs on a process pool, embedding on a bounded async pool and Chroma upserts in large batches,
+# with the three stages overlapping. A checkpoint file makes runs resumable and skips unchanged files.
+#
+# ตัวอย่าง: python3 ingest_bulk.py /data/corpus --metadata '{"document_type": "นโยบาย"}'
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from chunking import iter_chunks, make_text_splitter
+from document_parsers import SECTION_READERS, get_file_type
+from embedding_cache import EmbeddingCache, ChunkIdAssigner, chunk_hash, embed_with_cache
+from document_registry import DocumentRegistry
+from answer_cache import SQLiteAnswerCache
+from shared_state import ChangeFeed
+from embedding_pipeline import iter_batches
+from local_vector_index import open_collection
+from sharding import open_sharded_collection
+from http_clients import CircuitBreaker, OllamaHTTP, PooledOllamaEmbeddings
+
+# Configuration (ต้องตรงกับที่ใช้ใน app.py ของคุณ)
+CHROMA_HOST = os.getenv("CHROMA_HOST", "10.10.32.78")
+CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "rag_documents")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "nomic-embed-text:latest")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_EMBED_BATCH_API = os.getenv("OLLAMA_EMBED_BATCH_API", "false").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL_NAME}@api/embed" if OLLAMA_EMBED_BATCH_API else EMBEDDING_MODEL_NAME
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+RAG_DATA_DIR = os.getenv("RAG_DATA_DIR", "rag_data")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(RAG_DATA_DIR, "vector_index"))
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")
+SHARD_KEY = os.getenv("SHARD_KEY", "")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(RAG_DATA_DIR, "embedding_cache.sqlite3"))
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", os.path.join(RAG_DATA_DIR, "document_registry.sqlite3"))
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(RAG_DATA_DIR, "shared_state.sqlite3"))
+
+CHUNKER = os.getenv("CHUNKER", "tokens")
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "nomic-ai/nomic-embed-text-v1.5")
+
+HASH_READ_SIZE = 1024 * 1024
+
+
+# --- Source entries ---
+class SourceEntry:
+    # A file to ingest; materialize() returns (path on disk, sha256 of content, is_temporary)
+    def __init__(self, name, materialize):
+        self.name = name
+        self.materialize = materialize
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy_to_temp(source_stream, suffix):
+    # Extract an archive member to a temp file, hashing it on the way
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        for block in iter(lambda: source_stream.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+            tmp_file.write(block)
+    return tmp_file.name, digest.hexdigest(), True
+
+
+def iter_source_entries(source):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, source).replace(os.sep, "/")
+                if get_file_type(name):
+                    yield SourceEntry(name, lambda path=path: (path, _hash_file(path), False))
+        return
+
+    # Archive members are extracted one at a time; the lock keeps reads of the archive sequential
+    archive_lock = threading.Lock()
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        for info in archive.infolist():
+            if info.is_dir() or not get_file_type(info.filename):
+                continue
+
+            def materialize(info=info):
+                with archive_lock, archive.open(info) as member:
+                    return _copy_to_temp(member, get_file_type(info.filename))
+            yield SourceEntry(info.filename, materialize)
+    elif tarfile.is_tarfile(source):
+        archive = tarfile.open(source)
+        for info in archive:
+            if not info.isfile() or not get_file_type(info.name):
+                continue
+
+            def materialize(info=info):
+                with archive_lock:
+                    member = archive.extractfile(info)
+                    try:
+                        return _copy_to_temp(member, get_file_type(info.name))
+                    finally:
+                        member.close()
+            yield SourceEntry(info.name, materialize)
+    else:
+        raise ValueError(f"'{source}' is not a directory, zip or tar archive")
+
+
+# --- Checkpoint ---
+def load_checkpoint(path):
+    # JSON lines of {"path", "sha256", ...}; the last line for a path wins
+    checkpoint = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                checkpoint[record["path"]] = record["sha256"]
+    return checkpoint
+
+
+def append_checkpoint(path, record):
+    if not path:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# --- Parse stage (runs in worker processes) ---
+def parse_file(path, filename):
+    reader, _ = SECTION_READERS[get_file_type(filename)]
+    return list(iter_chunks(reader(path), make_text_splitter(CHUNKER, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_TOKENIZER)))
+
+
+# --- Pipeline ---
+class BulkIngestor:
+    def __init__(self, args, collection, embeddings, embedding_cache, document_registry=None, change_feed=None,
+                 answer_cache=None):
+        self.args = args
+        self.collection = collection
+        self.embeddings = embeddings
+        self.embedding_cache = embedding_cache
+        self.document_registry = document_registry
+        # STATE_BACKEND=sqlite: running API workers re-read these files and drop answers that cited them
+        self.change_feed = change_feed
+        self.answer_cache = answer_cache
+        self.base_metadata = json.loads(args.metadata) if args.metadata else {}
+        self.checkpoint = load_checkpoint(args.checkpoint)
+        self.stats = {"files_done": 0, "files_skipped": 0, "files_failed": 0,
+                      "chunks_written": 0, "chunks_unchanged": 0, "chunks_embedded": 0, "chunks_deleted": 0}
+        self.started_at = time.time()
+        self.abort_error = None
+
+    async def run(self, source):
+        self.parse_pool = ProcessPoolExecutor(max_workers=self.args.parse_workers,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        self.io_pool = ThreadPoolExecutor(max_workers=self.args.embed_concurrency + 4, thread_name_prefix="bulk-io")
+        self.embed_semaphore = asyncio.Semaphore(self.args.embed_concurrency)
+        self.upsert_queue = asyncio.Queue(maxsize=self.args.embed_concurrency * 4)
+        file_slots = asyncio.Semaphore(self.args.parse_workers * 2)
+
+        upsert_task = asyncio.create_task(self.upsert_worker())
+        reporter_task = asyncio.create_task(self.report_progress())
+        file_tasks = set()
+        try:
+            for entry in iter_source_entries(source):
+                if self.abort_error:
+                    break
+                await file_slots.acquire()
+                task = asyncio.create_task(self.process_file(entry))
+                task.add_done_callback(lambda t: file_slots.release())
+                file_tasks.add(task)
+                task.add_done_callback(file_tasks.discard)
+            await asyncio.gather(*file_tasks)
+            await self.upsert_queue.put(None)
+            await upsert_task
+        finally:
+            reporter_task.cancel()
+            self.parse_pool.shutdown(cancel_futures=True)
+            self.io_pool.shutdown(wait=False)
+        self.print_progress(final=True)
+        return self.abort_error is None and self.stats["files_failed"] == 0
+
+    async def run_io(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, lambda: fn(*args, **kwargs))
+
+    async def process_file(self, entry):
+        loop = asyncio.get_running_loop()
+        path = None
+        is_temp = False
+        try:
+            path, digest, is_temp = await self.run_io(entry.materialize)
+            if self.checkpoint.get(entry.name) == digest:
+                self.stats["files_skipped"] += 1
+                return
+            byte_size = os.path.getsize(path)
+            try:
+                chunks = await loop.run_in_executor(self.parse_pool, parse_file, path, entry.name)
+            finally:
+                if is_temp:
+                    os.remove(path)
+                    is_temp = False
+            if not chunks:
+                print(f"WARNING: No text found in '{entry.name}', skipping.")
+                self.stats["files_failed"] += 1
+                return
+
+            filename_hash = hashlib.sha256(entry.name.encode('utf-8')).hexdigest()
+            existing = await self.run_io(self.collection.get, where={"_filename_hash": {"$eq": filename_hash}}, include=[])
+            existing_ids = set(existing['ids'])
+            assign_id = ChunkIdAssigner(entry.name)
+
+            new_records = []
+            kept_ids = []
+            kept_metadatas = []
+            for i, (chunk, page_number) in enumerate(chunks):
+                h = chunk_hash(chunk)
+                chunk_id = assign_id(h)
+                metadata = {**self.base_metadata, "source_filename": entry.name, "_filename_hash": filename_hash,
+                            "chunk_id": i, "_chunk_hash": h}
+                if page_number is not None:
+                    metadata["page_number"] = page_number
+                if chunk_id in existing_ids:
+                    kept_ids.append(chunk_id)
+                    kept_metadatas.append(metadata)
+                else:
+                    new_records.append((chunk_id, chunk, h, metadata))
+            del chunks
+            seen_ids = set(kept_ids) | {record[0] for record in new_records}
+            stale_ids = [chunk_id for chunk_id in existing['ids'] if chunk_id not in seen_ids]
+
+            await asyncio.gather(*(self.embed_batch(batch) for batch in iter_batches(new_records, self.args.embed_batch_size)))
+            await self.upsert_queue.put(("finalize", {
+                "name": entry.name, "sha256": digest, "chunks": len(seen_ids), "byte_size": byte_size,
+                "filename_hash": filename_hash,
+                "kept_ids": kept_ids, "kept_metadatas": kept_metadatas, "stale_ids": stale_ids,
+            }))
+        except Exception as e:
+            print(f"ERROR: Failed to ingest '{entry.name}': {e}")
+            self.stats["files_failed"] += 1
+        finally:
+            if is_temp and path:
+                os.remove(path)
+
+    async def embed_batch(self, batch):
+        async with self.embed_semaphore:
+            if self.abort_error:
+                return
+            vectors, embedded = await self.run_io(
+                embed_with_cache, self.embeddings, self.embedding_cache, EMBEDDING_CACHE_KEY,
+                [chunk for _, chunk, _, _ in batch], [h for _, _, h, _ in batch],
+            )
+        self.stats["chunks_embedded"] += embedded
+        await self.upsert_queue.put(("chunks", batch, vectors))
+
+    async def upsert_worker(self):
+        # Single consumer: accumulates embedded chunks into large upserts and finalizes files in order
+        ids, documents, metadatas, vectors = [], [], [], []
+
+        async def flush():
+            if not ids:
+                return
+            await self.run_io(self.collection.upsert, ids=list(ids), documents=list(documents),
+                              metadatas=list(metadatas), embeddings=list(vectors))
+            self.stats["chunks_written"] += len(ids)
+            ids.clear(); documents.clear(); metadatas.clear(); vectors.clear()
+
+        while True:
+            item = await self.upsert_queue.get()
+            if item is None:
+                break
+            if self.abort_error:
+                continue
+            try:
+                if item[0] == "chunks":
+                    _, batch, batch_vectors = item
+                    for (chunk_id, chunk, _, metadata), vector in zip(batch, batch_vectors):
+                        ids.append(chunk_id)
+                        documents.append(chunk)
+                        metadatas.append(metadata)
+                        vectors.append(vector)
+                    if len(ids) >= self.args.upsert_batch_size:
+                        await flush()
+                else:
+                    # Every chunk of this file was queued before its finalize marker, so flush then finish it
+                    await flush()
+                    await self.finalize_file(item[1])
+            except Exception as e:
+                # Stop checkpointing: anything not yet recorded will be retried on the next run
+                print(f"ERROR: Upsert to ChromaDB failed, aborting run: {e}")
+                self.abort_error = e
+        if not self.abort_error:
+            try:
+                await flush()
+            except Exception as e:
+                print(f"ERROR: Upsert to ChromaDB failed: {e}")
+                self.abort_error = e
+
+    async def finalize_file(self, result):
+        if result["kept_ids"]:
+            await self.run_io(self.collection.update, ids=result["kept_ids"], metadatas=result["kept_metadatas"])
+        if result["stale_ids"]:
+            await self.run_io(self.collection.delete, ids=result["stale_ids"])
+        self.stats["chunks_unchanged"] += len(result["kept_ids"])
+        self.stats["chunks_deleted"] += len(result["stale_ids"])
+        self.stats["files_done"] += 1
+        if self.document_registry:
+            await self.run_io(
+                self.document_registry.upsert, result["name"], result["filename_hash"], result["chunks"],
+                content_hash=result["sha256"], byte_size=result["byte_size"],
+                embedding_model=EMBEDDING_MODEL_NAME, metadata=self.base_metadata,
+            )
+        if self.change_feed:
+            await self.run_io(self.change_feed.append, "upsert", result["name"])
+        if self.answer_cache:
+            await self.run_io(self.answer_cache.invalidate_sources, [result["name"]], include_sourceless=True)
+        append_checkpoint(self.args.checkpoint, {
+            "path": result["name"], "sha256": result["sha256"], "chunks": result["chunks"],
+            "embedding_model": EMBEDDING_MODEL_NAME, "ingested_at": time.time(),
+        })
+
+    async def report_progress(self):
+        while True:
+            await asyncio.sleep(self.args.progress_interval)
+            self.print_progress()
+
+    def print_progress(self, final=False):
+        elapsed = time.time() - self.started_at
+        s = self.stats
+        rate = s["chunks_written"] / elapsed if elapsed > 0 else 0.0
+        files_rate = s["files_done"] / elapsed if elapsed > 0 else 0.0
+        prefix = "Finished" if final else "Progress"
+        print(f"{prefix}: {s['files_done']} files ingested, {s['files_skipped']} unchanged/skipped, "
+              f"{s['files_failed']} failed | {s['chunks_written']} chunks written ({s['chunks_embedded']} embedded), "
+              f"{s['chunks_unchanged']} unchanged, {s['chunks_deleted']} stale removed | "
+              f"{files_rate:.2f} files/s, {rate:.1f} chunks/s, {elapsed:.0f}s elapsed")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory or archive into the RAG ChromaDB collection.")
+    parser.add_argument("source", help="Directory, .zip or .tar(.gz) archive to ingest")
+    parser.add_argument("--metadata", default=None, help='JSON metadata added to every chunk, e.g. \'{"document_type": "general"}\'')
+    parser.add_argument("--checkpoint", default=os.path.join(RAG_DATA_DIR, "bulk_ingest_checkpoint.jsonl"),
+                        help="Checkpoint file used to resume and to skip unchanged files ('' disables)")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1, help="Parser processes")
+    parser.add_argument("--embed-concurrency", type=int, default=int(os.getenv("EMBED_CONCURRENCY", "4")),
+                        help="Embedding requests in flight")
+    parser.add_argument("--embed-batch-size", type=int, default=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+                        help="Chunks per embedding request")
+    parser.add_argument("--upsert-batch-size", type=int, default=1000, help="Chunks per ChromaDB upsert")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metadata:
+        try:
+            json.loads(args.metadata)
+        except json.JSONDecodeError:
+            print("ERROR: --metadata is not valid JSON")
+            return 2
+    if args.checkpoint:
+        directory = os.path.dirname(args.checkpoint)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    try:
+        # The local index is a single-process store: stop app.py before bulk-loading into it
+        backend_options = dict(
+            chroma_host=CHROMA_HOST, chroma_port=CHROMA_PORT,
+            local_path=LOCAL_INDEX_DIR, dtype=LOCAL_INDEX_DTYPE, index_mode=LOCAL_INDEX_MODE,
+        )
+        if SHARD_KEY:
+            # One collection per value of this metadata key; POST /admin/shards/refresh makes app.py see new shards
+            collection = open_sharded_collection(VECTOR_BACKEND, COLLECTION_NAME, SHARD_KEY, **backend_options)
+        else:
+            collection = open_collection(VECTOR_BACKEND, COLLECTION_NAME, **backend_options)
+        print(f"Opened vector backend '{VECTOR_BACKEND}', collection: {COLLECTION_NAME}"
+              + (f", sharded by '{SHARD_KEY}'" if SHARD_KEY else ""))
+    except Exception as e:
+        print(f"ERROR: Could not open vector backend '{VECTOR_BACKEND}'. Error: {e}")
+        return 1
+
+    # One keep-alive connection per concurrent embed request; no circuit breaker, a batch job should keep retrying
+    ollama_http = OllamaHTTP(
+        OLLAMA_BASE_URL, pool_size=args.embed_concurrency, connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=OLLAMA_READ_TIMEOUT, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF,
+        breaker=CircuitBreaker("ollama", failure_threshold=0),
+    )
+    embeddings = PooledOllamaEmbeddings(
+        base_url=OLLAMA_BASE_URL, model=EMBEDDING_MODEL_NAME, http=ollama_http, batch_api=OLLAMA_EMBED_BATCH_API,
+    )
+    try:
+        embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    except Exception as e:
+        print(f"WARNING: Could not open embedding cache at '{EMBEDDING_CACHE_PATH}'. Error: {e}")
+        embedding_cache = None
+
+    try:
+        document_registry = DocumentRegistry(DOCUMENT_REGISTRY_PATH)
+    except Exception as e:
+        print(f"WARNING: Could not open document registry at '{DOCUMENT_REGISTRY_PATH}'. /files_list will not show these files. Error: {e}")
+        document_registry = None
+
+    change_feed = answer_cache = None
+    if STATE_BACKEND == "sqlite":
+        try:
+            change_feed = ChangeFeed(STATE_DB_PATH)
+            answer_cache = SQLiteAnswerCache(STATE_DB_PATH)
+        except Exception as e:
+            print(f"WARNING: Could not open shared state at '{STATE_DB_PATH}'. Running API workers will not see "
+                  f"these files in keyword search until restarted. Error: {e}")
+            change_feed = answer_cache = None
+
+    ingestor = BulkIngestor(args, collection, embeddings, embedding_cache, document_registry, change_feed, answer_cache)
+    try:
+        ok = asyncio.run(ingestor.run(args.source))
+    finally:
+        if VECTOR_BACKEND == "local":
+            collection.close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# ingest_jobs.py
+# Background job queue for /ingest: a bounded worker pool runs the parse -> split -> embed -> upsert
+# pipeline, while jobs for the same filename are serialized so their delete/add sequences never interleave.
+# Deleting a document goes through the same queue, so it never runs while that file is being ingested.
+# With several worker processes, a SQLiteJobStore lets any worker report any job, and a filename lease
+# serializes jobs for the same filename across processes too.
+
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlite_store import SQLiteStore
+
+# Filename leases are short and renewed every flush interval while their job runs, so a worker that hangs
+# or dies on another host blocks that filename for at most this long
+INGEST_LEASE_SECONDS = 60
+
+
+class IngestError(Exception):
+    pass
+
+
+class IngestJob:
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.stage = "queued"
+        self.chunks_done = 0
+        self.chunks_total = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_started_at = None
+        self.error = None
+        self.result = None
+        # Resolved with the job once it has finished, for callers that wait for it
+        self.completion = Future()
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.stage_started_at = time.time()
+        print(f"[ingest job {self.id[:8]}] {self.filename}: {stage}")
+
+    def to_dict(self):
+        now = self.finished_at or time.time()
+        elapsed = (now - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": round(self.chunks_done / elapsed, 2) if elapsed > 0 else 0.0,
+            "queued_seconds": round((self.started_at or now) - self.created_at, 3),
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class StoredJob:
+    # A job as last written to the SQLiteJobStore, typically by another worker process
+    def __init__(self, data):
+        self.id = data["job_id"]
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class SQLiteJobStore(SQLiteStore):
+    # Unfinished jobs are re-saved every few seconds by the process running them; one that has not been
+    # saved for stale_after seconds belonged to a worker that exited, and is reported as failed
+    def __init__(self, path, stale_after=60):
+        super().__init__(path)
+        self.stale_after = stale_after
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished INTEGER NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_created ON ingest_jobs (created_at)")
+        conn.commit()
+
+    def save(self, jobs):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingest_jobs (job_id, created_at, updated_at, finished, data) VALUES (?, ?, ?, ?, ?)",
+                [(job.id, job.created_at, now, job.finished_at is not None,
+                  json.dumps(job.to_dict(), ensure_ascii=False)) for job in jobs],
+            )
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            "SELECT updated_at, finished, data FROM ingest_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list(self, limit=50):
+        rows = self._connect().execute(
+            "SELECT updated_at, finished, data FROM ingest_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def trim(self, history_limit):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM ingest_jobs WHERE finished = 1 AND job_id NOT IN"
+                " (SELECT job_id FROM ingest_jobs ORDER BY created_at DESC LIMIT ?)",
+                (history_limit,),
+            )
+
+    def _row_to_dict(self, row):
+        updated_at, finished, data = row
+        data = json.loads(data)
+        if not finished and time.time() - updated_at > self.stale_after:
+            data["status"] = "failed"
+            data["error"] = "worker process ที่รับงานนี้หยุดทำงานก่อนงานเสร็จ"
+        return data
+
+
+class IngestJobManager:
+    def __init__(self, max_workers=2, history_limit=500, store=None, leases=None, flush_interval=2.0):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.history_limit = history_limit
+        self.jobs = OrderedDict()
+        # filename -> jobs waiting behind the one currently running for that filename
+        self._pending_by_filename = {}
+        self._lock = threading.Lock()
+        # Shared by worker processes: store reports jobs across them, leases serialize filenames across them
+        self.store = store
+        self.leases = leases
+        # Lease names held by jobs running in this process, renewed by the flush thread
+        self._leased = set()
+        self._stopped = threading.Event()
+        if store is not None or leases is not None:
+            threading.Thread(target=self._flush_loop, args=(flush_interval,), name="ingest-jobs-flush", daemon=True).start()
+
+    def submit(self, filename, fn, *args, executor=None):
+        # executor runs this job instead of the ingest pool, e.g. a short delete that should not wait
+        # behind ingests of other files; it still waits for the jobs of its own filename
+        job = IngestJob(filename)
+        executor = executor or self.executor
+        with self._lock:
+            self.jobs[job.id] = job
+            self._trim_history()
+            if filename in self._pending_by_filename:
+                self._pending_by_filename[filename].append((job, fn, args, executor))
+                return job
+            self._pending_by_filename[filename] = deque()
+        self._save([job])
+        executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            data = self.store.get(job_id)
+            job = StoredJob(data) if data else None
+        return job
+
+    def list(self, limit=50):
+        if self.store is not None:
+            # Jobs of every worker; this process's own jobs are reported live rather than as last saved
+            with self._lock:
+                local = dict(self.jobs)
+            return [local[data["job_id"]].to_dict() if data["job_id"] in local else data
+                    for data in self.store.list(limit)]
+        with self._lock:
+            recent = list(self.jobs.values())[-limit:]
+        return [job.to_dict() for job in reversed(recent)]
+
+    def shutdown(self):
+        self._stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job, fn, args):
+        # Whatever fails, including taking the filename lease, the job ends up finished and the next job
+        # for the same filename is started
+        try:
+            with self._filename_lease(job):
+                job.status = "running"
+                job.started_at = time.time()
+                job.result = fn(job, *args)
+                job.status = "done"
+                job.set_stage("done")
+        except Exception as e:
+            if job.status == "done":
+                # Only releasing the lease failed; it expires by itself within INGEST_LEASE_SECONDS
+                print(f"WARNING: Could not release the ingest lease for '{job.filename}'. Error: {e}")
+            else:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"[ingest job {job.id[:8]}] {job.filename} failed during '{job.stage}': {e}")
+        finally:
+            job.finished_at = time.time()
+            self._save([job])
+            job.completion.set_result(job)
+            self._start_next(job.filename)
+
+    @contextmanager
+    def _filename_lease(self, job):
+        if self.leases is None:
+            yield
+            return
+        name = f"ingest:{job.filename}"
+        if self.leases.holder(name) is not None:
+            job.set_stage("waiting")
+        with self.leases.hold(name, ttl_seconds=INGEST_LEASE_SECONDS):
+            with self._lock:
+                self._leased.add(name)
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._leased.discard(name)
+
+    def _renew_leases(self):
+        with self._lock:
+            names = list(self._leased)
+        for name in names:
+            try:
+                renewed = self.leases.renew(name, INGEST_LEASE_SECONDS)
+            except Exception as e:
+                print(f"WARNING: Could not renew ingest lease '{name}'. Error: {e}")
+                continue
+            with self._lock:
+                lost = not renewed and name in self._leased
+            if lost:
+                print(f"WARNING: Ingest lease '{name}' expired before it was renewed; another worker may ingest the same file.")
+
+    def _save(self, jobs):
+        if self.store is None or not jobs:
+            return
+        try:
+            self.store.save(jobs)
+        except Exception as e:
+            print(f"WARNING: Could not save ingest job status. Error: {e}")
+
+    def _flush_loop(self, interval):
+        # Progress counters change on every batch; they reach the store at most once per interval, and the
+        # filename leases of running jobs are renewed at the same pace
+        while not self._stopped.wait(interval):
+            if self.leases is not None:
+                self._renew_leases()
+            if self.store is None:
+                continue
+            with self._lock:
+                active = [job for job in self.jobs.values() if job.finished_at is None]
+            self._save(active)
+            try:
+                self.store.trim(self.history_limit)
+            except Exception as e:
+                print(f"WARNING: Could not trim ingest job history. Error: {e}")
+
+    def _start_next(self, filename):
+        with self._lock:
+            pending = self._pending_by_filename.get(filename)
+            if not pending:
+                self._pending_by_filename.pop(filename, None)
+                return
+            next_job, fn, args, executor = pending.popleft()
+        executor.submit(self._run, next_job, fn, args)
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs once the history limit is reached; running jobs are kept
+        excess = len(self.jobs) - self.history_limit
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs.keys()):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].finished_at is not None:
+                del self.jobs[job_id]
+                excess -= 1
@@ -0,0 +1,244 @@
+# lexical_index.py
+# In-process BM25 index over chunk text, kept next to ChromaDB so exact terms (policy codes, herb names,
+# form numbers) are found even when vector search ranks them low. Results are fused with reciprocal-rank fusion.
+
+import gzip
+import json
+import math
+import os
+import re
+import heapq
+import threading
+import time
+from collections import Counter
+
+from collection_scanner import filename_hash, iter_pages
+
+try:
+    from pythainlp.tokenize import word_tokenize as thai_word_tokenize
+except ImportError:
+    thai_word_tokenize = None
+
+# Bumped when the saved index layout changes; older files are ignored and the index is rebuilt instead
+SNAPSHOT_FORMAT = 1
+
+# Thai script runs vs. runs of other letters/digits; everything else separates tokens
+_TOKEN_PATTERN = re.compile(r"[\u0e00-\u0e7f]+|[^\W_]+")
+_THAI_PATTERN = re.compile(r"[\u0e00-\u0e7f]")
+
+
+def tokenize(text):
+    # Thai has no spaces between words: use PyThaiNLP's dictionary segmenter when installed,
+    # otherwise overlapping character bigrams, which match consistently between queries and chunks
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.casefold()):
+        if not _THAI_PATTERN.match(run):
+            tokens.append(run)
+        elif thai_word_tokenize is not None:
+            tokens.extend(word for word in thai_word_tokenize(run, engine="newmm", keep_whitespace=False) if word.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _thai_tokenizer_name():
+    return "pythainlp-newmm" if thai_word_tokenize is not None else "char-bigram"
+
+
+def saved_seq(path):
+    # Change-feed position of a saved index, without reading the rest of it; None when there is none
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as index_file:
+            return json.loads(index_file.readline()).get("seq")
+    except (OSError, ValueError):
+        return None
+
+
+def matches_filters(metadata, filters):
+    # Same semantics as the {"key": {"$eq": value}} filters passed to Chroma
+    return all(metadata.get(key) == value for key, value in (filters or {}).items())
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60):
+    # ranked_lists: lists of keys, best first. Returns [(key, sum of 1 / (k + rank))], best first
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, key in enumerate(ranked, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # chunk id -> (metadata, token count, distinct terms); term -> {chunk id: term frequency}
+        self.chunks = {}
+        self.postings = {}
+        self.total_length = 0
+        self.ready = False
+        self._lock = threading.RLock()
+
+    def add(self, ids, texts, metadatas):
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                self._remove(chunk_id)
+                term_counts = Counter(tokenize(text))
+                length = sum(term_counts.values())
+                self.chunks[chunk_id] = (metadata, length, tuple(term_counts))
+                self.total_length += length
+                for term, count in term_counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = count
+
+    def update_metadata(self, ids, metadatas):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                if chunk_id in self.chunks:
+                    self.chunks[chunk_id] = (metadata, *self.chunks[chunk_id][1:])
+
+    def remove(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+
+    def remove_source(self, filename):
+        with self._lock:
+            ids = [chunk_id for chunk_id, (metadata, _, _) in self.chunks.items() if metadata.get("source_filename") == filename]
+            for chunk_id in ids:
+                self._remove(chunk_id)
+            return len(ids)
+
+    def reload_source(self, collection, filename, page_size=1000):
+        # Re-reads one file's chunks after another process changed them; no chunks left means it was deleted
+        pages = list(iter_pages(collection, where={"_filename_hash": {"$eq": filename_hash(filename)}},
+                                include=['documents', 'metadatas'], batch_size=page_size))
+        with self._lock:
+            self.remove_source(filename)
+            for page in pages:
+                self.add(page['ids'], page['documents'] or [], page['metadatas'] or [])
+        return sum(len(page['ids']) for page in pages)
+
+    def search(self, query, k, filters=None):
+        # Returns [(chunk id, metadata, score)], best first
+        query_terms = set(tokenize(query))
+        with self._lock:
+            n_chunks = len(self.chunks)
+            if not n_chunks or not query_terms:
+                return []
+            avg_length = self.total_length / n_chunks
+            scores = {}
+            for term in query_terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    length = self.chunks[chunk_id][1]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            if filters:
+                scores = {chunk_id: score for chunk_id, score in scores.items() if matches_filters(self.chunks[chunk_id][0], filters)}
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(chunk_id, self.chunks[chunk_id][0], score) for chunk_id, score in best]
+
+    def count(self):
+        with self._lock:
+            return len(self.chunks)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "chunks": len(self.chunks),
+                "terms": len(self.postings),
+                "avg_chunk_tokens": round(self.total_length / len(self.chunks), 1) if self.chunks else 0,
+                "thai_tokenizer": _thai_tokenizer_name(),
+            }
+
+    def save(self, path, seq=0):
+        # Writes the index as of change-feed position seq, so other processes can load it instead of
+        # re-reading every chunk. Postings are copied under the lock and written after it is released;
+        # the file is replaced atomically, so readers never see a partial one
+        with self._lock:
+            chunks = dict(self.chunks)
+            postings = {term: dict(entries) for term, entries in self.postings.items()}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=3) as index_file:
+            index_file.write(json.dumps({
+                "format": SNAPSHOT_FORMAT, "thai_tokenizer": _thai_tokenizer_name(), "seq": seq,
+                "saved_at": time.time(), "chunks": len(chunks),
+            }) + "\n")
+            for chunk_id, (metadata, length, _) in chunks.items():
+                index_file.write(json.dumps([chunk_id, metadata, length], ensure_ascii=False) + "\n")
+            for term, entries in postings.items():
+                index_file.write(json.dumps([term, entries], ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        return len(chunks)
+
+    def load(self, path, max_age=None):
+        # Returns the change-feed position the file was saved at, or None when it is missing, older than
+        # max_age seconds, or was built with another format or Thai tokenizer. Chunks this process added
+        # while the file was read are kept
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as index_file:
+            header = json.loads(index_file.readline())
+            if header.get("format") != SNAPSHOT_FORMAT or header.get("thai_tokenizer") != _thai_tokenizer_name():
+                return None
+            if max_age is not None and time.time() - header["saved_at"] > max_age:
+                return None
+            loaded = LexicalIndex(self.k1, self.b)
+            lengths = {}
+            for _ in range(header["chunks"]):
+                chunk_id, metadata, length = json.loads(index_file.readline())
+                lengths[chunk_id] = (metadata, length)
+            terms = {chunk_id: [] for chunk_id in lengths}
+            for line in index_file:
+                term, entries = json.loads(line)
+                loaded.postings[term] = entries
+                for chunk_id in entries:
+                    terms[chunk_id].append(term)
+        for chunk_id, (metadata, length) in lengths.items():
+            loaded.chunks[chunk_id] = (metadata, length, tuple(terms[chunk_id]))
+            loaded.total_length += length
+
+        with self._lock:
+            for chunk_id, (metadata, length, chunk_terms) in self.chunks.items():
+                loaded._remove(chunk_id)
+                loaded.chunks[chunk_id] = (metadata, length, chunk_terms)
+                loaded.total_length += length
+                for term in chunk_terms:
+                    loaded.postings.setdefault(term, {})[chunk_id] = self.postings[term][chunk_id]
+            self.chunks, self.postings, self.total_length = loaded.chunks, loaded.postings, loaded.total_length
+            self.ready = True
+        return header["seq"]
+
+    def clear(self):
+        with self._lock:
+            self.ready = False
+            self.chunks.clear()
+            self.postings.clear()
+            self.total_length = 0
+
+    def rebuild_from_collection(self, collection, page_size=1000):
+        # The index lives in memory only, so it is rebuilt from ChromaDB on startup
+        self.clear()
+        for page in iter_pages(collection, include=['documents', 'metadatas'], batch_size=page_size):
+            self.add(page['ids'], page['documents'] or [], page['metadatas'] or [])
+        self.ready = True
+        return self.count()
+
+    def _remove(self, chunk_id):
+        entry = self.chunks.pop(chunk_id, None)
+        if entry is None:
+            return
+        metadata, length, terms = entry
+        self.total_length -= length
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
@@ -0,0 +1,553 @@
+# local_vector_index.py
+# In-process vector index exposing the subset of the ChromaDB Collection API this project uses
+# (add/upsert/update/delete/get/query/count), so small-to-medium collections can skip the HTTP round trip.
+# Vectors live in a memory-mapped float32/float16 snapshot plus an in-memory tail. Search is an exact NumPy
+# L2 scan, or HNSW when hnswlib is installed and requested. Every change is appended to a write-ahead log
+# that is replayed on restart and folded into a new snapshot every `snapshot_every` operations and on close.
+# Snapshots keep deleted rows' slots, so row numbers (and the HNSW graph labelled by them) carry over as they
+# are; rows are only renumbered, and the graph rebuilt, once deleted slots pass `compact_ratio`.
+
+import base64
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+CURRENT_FILE = "CURRENT"
+WAL_FILE = "wal.jsonl"
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.jsonl"
+HNSW_FILE = "hnsw.bin"
+# Rows scored per NumPy block, so float16 snapshots are upcast a block at a time
+SEARCH_BLOCK_ROWS = 65536
+_DEFAULT_GET_INCLUDE = ("metadatas", "documents")
+_DEFAULT_QUERY_INCLUDE = ("metadatas", "documents", "distances")
+
+
+def matches_where(metadata, where):
+    # Chroma where semantics for the operators this project uses
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, expected in condition.items():
+                if operator == "$eq":
+                    ok = key in metadata and value == expected
+                elif operator == "$ne":
+                    ok = value != expected
+                elif operator == "$in":
+                    ok = key in metadata and value in expected
+                elif operator == "$nin":
+                    ok = value not in expected
+                else:
+                    raise ValueError(f"Unsupported where operator '{operator}'")
+                if not ok:
+                    return False
+        elif key not in metadata or metadata[key] != condition:
+            return False
+    return True
+
+
+def _encode_vectors(vectors):
+    return base64.b64encode(np.asarray(vectors, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vectors(data, dim):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(-1, dim)
+
+
+class LocalCollection:
+    def __init__(self, path, name, dtype="float32", index_mode="exact", snapshot_every=1000, compact_ratio=0.2,
+                 hnsw_m=16, hnsw_ef_construction=200, hnsw_ef_search=64):
+        self.path = path
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.snapshot_every = snapshot_every
+        self.compact_ratio = compact_ratio
+        if index_mode == "hnsw" and hnswlib is None:
+            print("WARNING: LOCAL_INDEX_MODE=hnsw but hnswlib is not installed. Falling back to exact search.")
+            index_mode = "exact"
+        self.index_mode = index_mode
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self._lock = threading.RLock()
+        # One snapshot at a time; taken before _lock, never while holding it
+        self._snapshot_lock = threading.Lock()
+
+        # Row-aligned state. Deleted rows keep their slot (id None, alive False) until the next compaction
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}
+        self._dim = None
+        self._base = None
+        self._tail = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._hnsw = None
+        self._mask_cache = {}
+        self._wal_ops = 0
+        # Log entries written while a compaction runs, applied to the compacted rows when it switches over
+        self._recorded = None
+
+        os.makedirs(path, exist_ok=True)
+        self._load_snapshot()
+        self._replay_wal()
+        self._wal = open(os.path.join(path, WAL_FILE), "a", encoding="utf-8")
+
+    # --- Chroma Collection API subset ---
+
+    def count(self):
+        with self._lock:
+            return len(self._rows)
+
+    def add(self, ids, embeddings, metadatas=None, documents=None):
+        # Existing IDs are replaced, which keeps write-ahead log replay idempotent
+        self.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        documents = list(documents) if documents is not None else [None for _ in ids]
+        with self._lock:
+            self._apply_upsert(list(ids), vectors, metadatas, documents)
+            self._log({"op": "upsert", "ids": list(ids), "dim": vectors.shape[1], "embeddings": _encode_vectors(vectors),
+                       "metadatas": metadatas, "documents": documents})
+        self._maybe_snapshot()
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        vectors = np.asarray(embeddings, dtype=np.float32) if embeddings is not None else None
+        with self._lock:
+            self._apply_update(list(ids), metadatas, documents, vectors)
+            entry = {"op": "update", "ids": list(ids), "metadatas": metadatas, "documents": documents}
+            if vectors is not None:
+                entry.update(dim=vectors.shape[1], embeddings=_encode_vectors(vectors))
+            self._log(entry)
+        self._maybe_snapshot()
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            if where is not None:
+                targets = [self._ids[row] for row in np.flatnonzero(self._filter_mask(where))]
+                if ids is not None:
+                    wanted = set(ids)
+                    targets = [chunk_id for chunk_id in targets if chunk_id in wanted]
+            else:
+                targets = [chunk_id for chunk_id in (ids or []) if chunk_id in self._rows]
+            self._apply_delete(targets)
+            if targets:
+                self._log({"op": "delete", "ids": targets})
+        self._maybe_snapshot()
+        return {"deleted": len(targets)}
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=_DEFAULT_GET_INCLUDE):
+        with self._lock:
+            if ids is not None:
+                rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+                if where is not None:
+                    rows = [row for row in rows if matches_where(self._metadatas[row], where)]
+            else:
+                rows = np.flatnonzero(self._filter_mask(where)).tolist()
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._rows_result(rows, include)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=_DEFAULT_QUERY_INCLUDE):
+        result = {key: [] for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+        with self._lock:
+            for query_vector in np.asarray(query_embeddings, dtype=np.float32):
+                rows, distances = self._search(query_vector, n_results, where)
+                row_result = self._rows_result(rows, include)
+                for key in ("ids", "documents", "metadatas", "embeddings"):
+                    result[key].append(row_result[key])
+                result["distances"].append(distances.tolist() if "distances" in include else None)
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key not in include:
+                result[key] = None
+        return result
+
+    # --- Persistence ---
+
+    def snapshot(self):
+        # Returns the number of live rows
+        with self._snapshot_lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        with self._lock:
+            slots = len(self._ids)
+            if not slots or (slots - len(self._rows)) / slots <= self.compact_ratio:
+                return self._write_snapshot()
+            rows = np.flatnonzero(self._alive).tolist()
+            ids = [self._ids[row] for row in rows]
+            documents = [self._documents[row] for row in rows]
+            metadatas = [self._metadatas[row] for row in rows]
+            vectors = self._vectors_for(rows)
+            self._recorded = []
+        try:
+            return self._compact(ids, documents, metadatas, vectors)
+        finally:
+            with self._lock:
+                self._recorded = None
+
+    def _write_snapshot(self):
+        # Every slot is written as it is and the live HNSW graph saved unchanged; the new snapshot's vectors
+        # replace the old file and the in-memory tail
+        previous, directory = self._new_snapshot_directory()
+        self._write_rows(directory, self._ids, self._documents, self._metadatas, self._vectors_for)
+        if self._hnsw is not None:
+            self._hnsw.save_index(os.path.join(directory, HNSW_FILE))
+        self._switch_snapshot(directory)
+        if self._ids:
+            self._base = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+            self._tail = None
+        self._remove_snapshot(previous, directory)
+        return len(self._rows)
+
+    def _compact(self, ids, documents, metadatas, vectors):
+        # Live rows are renumbered from 0 and written, and their graph built, without holding _lock, so
+        # queries and writes carry on meanwhile; writes logged in the meantime are applied on top afterwards
+        previous, directory = self._new_snapshot_directory()
+        self._write_rows(directory, ids, documents, metadatas, lambda rows: vectors[rows.start:rows.stop])
+        stored = vectors.astype(self.dtype).astype(np.float32)
+        sq_norms = np.einsum("ij,ij->i", stored, stored)
+        hnsw = None
+        if self.index_mode == "hnsw":
+            hnsw = hnswlib.Index(space="l2", dim=vectors.shape[1])
+            hnsw.init_index(max_elements=max(len(ids), 1), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+            if ids:
+                hnsw.add_items(stored, np.arange(len(ids)))
+            hnsw.set_ef(self.hnsw_ef_search)
+            hnsw.save_index(os.path.join(directory, HNSW_FILE))
+
+        with self._lock:
+            recorded = self._recorded
+            self._switch_snapshot(directory, recorded)
+            self._ids, self._documents, self._metadatas = ids, documents, metadatas
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+            self._base = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r") if ids else None
+            self._tail = None
+            self._dim = vectors.shape[1] if ids else None
+            self._alive = np.ones(len(ids), dtype=bool)
+            self._sq_norms = sq_norms
+            self._hnsw = hnsw if ids else None
+            self._mask_cache.clear()
+            for entry in recorded:
+                self._apply_entry(entry)
+            self._remove_snapshot(previous, directory)
+            return len(self._rows)
+
+    def _new_snapshot_directory(self):
+        previous = self._current_snapshot()
+        generation = int(previous.split("-")[1]) + 1 if previous else 1
+        directory = os.path.join(self.path, f"snapshot-{generation:06d}")
+        os.makedirs(directory, exist_ok=True)
+        return previous, directory
+
+    def _write_rows(self, directory, ids, documents, metadatas, vectors_for):
+        # vectors_for(range of rows) -> float32 block; deleted slots are written with a null id
+        if ids:
+            vectors = np.lib.format.open_memmap(os.path.join(directory, VECTORS_FILE), mode="w+",
+                                                dtype=self.dtype, shape=(len(ids), self._dim))
+            for start in range(0, len(ids), SEARCH_BLOCK_ROWS):
+                rows = range(start, min(start + SEARCH_BLOCK_ROWS, len(ids)))
+                vectors[rows.start:rows.stop] = vectors_for(rows)
+            vectors.flush()
+            del vectors
+        with open(os.path.join(directory, RECORDS_FILE), "w", encoding="utf-8") as records_file:
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                records_file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata},
+                                              ensure_ascii=False) + "\n")
+
+    def _switch_snapshot(self, directory, pending=()):
+        # CURRENT first, then the log is replaced by the entries the snapshot does not hold yet. A crash in
+        # between replays the whole old log over the new snapshot, which ends in the same rows
+        with open(os.path.join(self.path, CURRENT_FILE + ".tmp"), "w") as current_file:
+            current_file.write(os.path.basename(directory))
+        os.replace(os.path.join(self.path, CURRENT_FILE + ".tmp"), os.path.join(self.path, CURRENT_FILE))
+
+        self._wal.close()
+        with open(os.path.join(self.path, WAL_FILE + ".tmp"), "w", encoding="utf-8") as wal_file:
+            for entry in pending:
+                wal_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(os.path.join(self.path, WAL_FILE + ".tmp"), os.path.join(self.path, WAL_FILE))
+        self._wal = open(os.path.join(self.path, WAL_FILE), "a", encoding="utf-8")
+        self._wal_ops = len(pending)
+
+    def _remove_snapshot(self, previous, directory):
+        if previous and previous != os.path.basename(directory):
+            shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+
+    def close(self):
+        if self._wal_ops:
+            self.snapshot()
+        with self._lock:
+            self._wal.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "index_mode": self.index_mode,
+                "dtype": str(self.dtype),
+                "count": len(self._rows),
+                "dimension": self._dim,
+                "deleted_slots": len(self._ids) - len(self._rows),
+                "wal_operations": self._wal_ops,
+            }
+
+    # --- Internals ---
+
+    def _current_snapshot(self):
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE)) as current_file:
+                return current_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load_snapshot(self):
+        self._ids, self._documents, self._metadatas, self._rows = [], [], [], {}
+        self._base, self._tail, self._dim, self._hnsw = None, None, None, None
+        self._alive = np.zeros(0, dtype=bool)
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._mask_cache.clear()
+
+        name = self._current_snapshot()
+        if name:
+            directory = os.path.join(self.path, name)
+            with open(os.path.join(directory, RECORDS_FILE), encoding="utf-8") as records_file:
+                for row, line in enumerate(records_file):
+                    record = json.loads(line)
+                    self._ids.append(record["id"])
+                    self._documents.append(record["document"])
+                    self._metadatas.append(record["metadata"])
+                    if record["id"] is not None:
+                        self._rows[record["id"]] = row
+            vectors_path = os.path.join(directory, VECTORS_FILE)
+            if os.path.exists(vectors_path):
+                self._base = np.load(vectors_path, mmap_mode="r")
+                self._dim = self._base.shape[1]
+                self._sq_norms = np.concatenate([
+                    np.einsum("ij,ij->i", block, block)
+                    for block in (self._base[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+                                  for start in range(0, len(self._base), SEARCH_BLOCK_ROWS))
+                ]) if len(self._base) else np.zeros(0, dtype=np.float32)
+            self._alive = np.array([chunk_id is not None for chunk_id in self._ids], dtype=bool)
+
+        if self.index_mode == "hnsw" and self._dim is not None:
+            hnsw_path = os.path.join(self.path, name, HNSW_FILE) if name else None
+            self._hnsw = hnswlib.Index(space="l2", dim=self._dim)
+            if hnsw_path and os.path.exists(hnsw_path):
+                self._hnsw.load_index(hnsw_path, max_elements=max(len(self._ids), 1))
+            else:
+                self._hnsw.init_index(max_elements=max(len(self._ids), 1), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+                if self._ids:
+                    self._hnsw.add_items(self._vectors_for(range(len(self._ids))), np.arange(len(self._ids)))
+                    for row in np.flatnonzero(~self._alive):
+                        self._hnsw.mark_deleted(int(row))
+            self._hnsw.set_ef(self.hnsw_ef_search)
+
+    def _replay_wal(self):
+        wal_path = os.path.join(self.path, WAL_FILE)
+        if not os.path.exists(wal_path):
+            return
+        with open(wal_path, encoding="utf-8") as wal_file:
+            for line in wal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write; everything before it is intact
+                    break
+                self._apply_entry(entry)
+                self._wal_ops += 1
+
+    def _apply_entry(self, entry):
+        if entry["op"] == "upsert":
+            self._apply_upsert(entry["ids"], _decode_vectors(entry["embeddings"], entry["dim"]),
+                               entry["metadatas"], entry["documents"])
+        elif entry["op"] == "update":
+            vectors = _decode_vectors(entry["embeddings"], entry["dim"]) if entry.get("embeddings") else None
+            self._apply_update(entry["ids"], entry.get("metadatas"), entry.get("documents"), vectors)
+        elif entry["op"] == "delete":
+            self._apply_delete(entry["ids"])
+
+    def _log(self, entry):
+        self._wal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._wal.flush()
+        self._wal_ops += 1
+        if self._recorded is not None:
+            self._recorded.append(entry)
+
+    def _maybe_snapshot(self):
+        # Runs after a write released _lock. Skipped while another snapshot is running: writes logged during
+        # a compaction stay in the new log and count towards the next one
+        if self.snapshot_every and self._wal_ops >= self.snapshot_every and self._snapshot_lock.acquire(blocking=False):
+            try:
+                self._snapshot()
+            finally:
+                self._snapshot_lock.release()
+
+    def _apply_upsert(self, ids, vectors, metadatas, documents):
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self._dim}")
+        self._apply_delete([chunk_id for chunk_id in ids if chunk_id in self._rows])
+
+        start = len(self._ids)
+        n_base = len(self._base) if self._base is not None else 0
+        tail_rows = start + len(ids) - n_base
+        if self._tail is None:
+            self._tail = np.zeros((max(tail_rows, 1024), self._dim), dtype=self.dtype)
+        elif tail_rows > len(self._tail):
+            grown = np.zeros((max(tail_rows, len(self._tail) * 2), self._dim), dtype=self.dtype)
+            grown[:len(self._tail)] = self._tail
+            self._tail = grown
+        self._tail[start - n_base:start - n_base + len(ids)] = vectors
+
+        for offset, chunk_id in enumerate(ids):
+            self._rows[chunk_id] = start + offset
+        self._ids.extend(ids)
+        self._metadatas.extend(metadatas)
+        self._documents.extend(documents)
+        stored = vectors.astype(self.dtype).astype(np.float32)
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._sq_norms = np.concatenate([self._sq_norms, np.einsum("ij,ij->i", stored, stored)])
+        self._mask_cache.clear()
+
+        if self._hnsw is None and self.index_mode == "hnsw":
+            self._hnsw = hnswlib.Index(space="l2", dim=self._dim)
+            self._hnsw.init_index(max_elements=1024, ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+            self._hnsw.set_ef(self.hnsw_ef_search)
+        if self._hnsw is not None:
+            if len(self._ids) > self._hnsw.get_max_elements():
+                self._hnsw.resize_index(max(len(self._ids), self._hnsw.get_max_elements() * 2))
+            self._hnsw.add_items(stored, np.arange(start, start + len(ids)))
+
+    def _apply_update(self, ids, metadatas, documents, vectors):
+        present = [(i, self._rows[chunk_id]) for i, chunk_id in enumerate(ids) if chunk_id in self._rows]
+        for i, row in present:
+            if metadatas is not None:
+                self._metadatas[row] = metadatas[i]
+            if documents is not None:
+                self._documents[row] = documents[i]
+        if vectors is not None and present:
+            # A new vector moves the row to the tail; metadata and text carry over
+            self._apply_upsert([ids[i] for i, _ in present], vectors[[i for i, _ in present]],
+                               [self._metadatas[row] for _, row in present],
+                               [self._documents[row] for _, row in present])
+        self._mask_cache.clear()
+
+    def _apply_delete(self, ids):
+        for chunk_id in ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            self._alive[row] = False
+            self._ids[row] = None
+            self._documents[row] = None
+            self._metadatas[row] = None
+            if self._hnsw is not None:
+                self._hnsw.mark_deleted(row)
+        if ids:
+            self._mask_cache.clear()
+
+    def _filter_mask(self, where):
+        if not where:
+            return self._alive
+        # Filter masks are O(n) in Python, so they are cached until the next change
+        cache_key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        mask = self._mask_cache.get(cache_key)
+        if mask is None:
+            mask = np.fromiter(
+                (alive and matches_where(metadata, where) for alive, metadata in zip(self._alive, self._metadatas)),
+                dtype=bool, count=len(self._metadatas),
+            )
+            if len(self._mask_cache) >= 64:
+                self._mask_cache.clear()
+            self._mask_cache[cache_key] = mask
+        return mask
+
+    def _vectors_for(self, rows):
+        rows = np.asarray(list(rows), dtype=np.int64)
+        n_base = len(self._base) if self._base is not None else 0
+        out = np.empty((len(rows), self._dim), dtype=np.float32)
+        in_base = rows < n_base
+        if in_base.any():
+            out[in_base] = self._base[rows[in_base]]
+        if (~in_base).any():
+            out[~in_base] = self._tail[rows[~in_base] - n_base]
+        return out
+
+    def _search(self, query_vector, n_results, where):
+        mask = self._filter_mask(where)
+        n_candidates = int(mask.sum())
+        if n_candidates == 0 or n_results <= 0:
+            return [], np.zeros(0, dtype=np.float32)
+        n_results = min(n_results, n_candidates)
+
+        if self._hnsw is not None:
+            try:
+                labels, distances = self._hnsw.knn_query(
+                    query_vector, k=n_results, filter=(lambda label: bool(mask[label])) if where else None,
+                )
+                return labels[0].tolist(), distances[0]
+            except RuntimeError:
+                # Very selective filters can leave HNSW short of n_results; the exact scan always has them
+                pass
+
+        # Squared L2 (Chroma's default space): |x|^2 - 2 x.q + |q|^2, scored block by block
+        n_base = len(self._base) if self._base is not None else 0
+        scores = np.empty(len(self._ids), dtype=np.float32)
+        for start in range(0, n_base, SEARCH_BLOCK_ROWS):
+            block = self._base[start:start + SEARCH_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query_vector
+        if len(self._ids) > n_base:
+            scores[n_base:] = self._tail[:len(self._ids) - n_base].astype(np.float32, copy=False) @ query_vector
+        distances = self._sq_norms - 2 * scores + float(query_vector @ query_vector)
+        distances[~mask] = np.inf
+
+        top = np.argpartition(distances, n_results - 1)[:n_results]
+        top = top[np.argsort(distances[top])]
+        return top.tolist(), distances[top]
+
+    def _rows_result(self, rows, include):
+        return {
+            "ids": [self._ids[row] for row in rows],
+            "documents": [self._documents[row] for row in rows] if "documents" in include else None,
+            "metadatas": [self._metadatas[row] for row in rows] if "metadatas" in include else None,
+            "embeddings": self._vectors_for(rows) if "embeddings" in include and self._dim is not None else
+                          ([] if "embeddings" in include else None),
+        }
+
+
+def open_collection(backend, collection_name, chroma_host=None, chroma_port=None, local_path=None,
+                    chroma_client=None, **local_options):
+    # VECTOR_BACKEND=chroma keeps the remote HttpClient (or a preconfigured chroma_client);
+    # "local" uses the in-process index under local_path
+    if backend == "local":
+        return LocalCollection(os.path.join(local_path, collection_name), collection_name, **local_options)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector backend '{backend}'. Use 'chroma' or 'local'.")
+    if chroma_client is None:
+        import chromadb
+        chroma_client = chromadb.HttpClient(host=chroma_host, port=int(chroma_port))
+    return chroma_client.get_or_create_collection(name=collection_name)
@@ -0,0 +1,229 @@
+# metrics.py
+# Minimal Prometheus-format metrics (counters, gauges, histograms) plus an ASGI middleware for in-flight and
+# per-status request counts. Recording is a dict lookup and a few additions under a per-metric lock.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+REGISTRY = []
+
+# Seconds; spans sub-millisecond cache hits up to multi-minute ingests of large files
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        # callback() -> value is read at scrape time, for values another object already tracks
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception as e:
+                print(f"WARNING: Could not read metric {self.name}. Error: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+@contextmanager
+def count_errors(counter, **labels):
+    # Counts exceptions raised inside the block and re-raises them
+    try:
+        yield
+    except Exception:
+        counter.inc(**labels)
+        raise
+
+
+class StageTimer:
+    # Accumulates time per stage across a multi-step operation, e.g. one ingest job
+    def __init__(self):
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def timed_iter(self, stage, iterable):
+        # Charges the time spent producing each item to `stage`
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # Pure ASGI so streaming responses are counted as in flight until their last byte is sent
+    def __init__(self, app, in_flight, requests_total):
+        self.app = app
+        self.in_flight = in_flight
+        self.requests_total = requests_total
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            self.requests_total.inc(method=scope["method"], status=status["code"])
+
+
+# --- Metrics exported by app.py ---
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds", "Time per ingest job spent in each stage (parse, split, embed, upsert).", ["stage"])
+INGEST_DURATION_SECONDS = Histogram("rag_ingest_duration_seconds", "Wall time of ingest jobs.")
+INGEST_CHUNKS = Histogram(
+    "rag_ingest_chunks", "Chunks per ingested document.", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+INGEST_JOBS_TOTAL = Counter("rag_ingest_jobs_total", "Finished ingest jobs by status.", ["status"])
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds",
+    "Time per query stage (memory_load, retrieval, generation, first_token, memory_save, memory_summarize, total).", ["stage"])
+QUERY_EMBED_BATCH_SIZE = Histogram(
+    "rag_query_embed_batch_size", "Query texts per batched embedding call.", buckets=(1, 2, 4, 8, 16, 32, 64))
+SHARD_QUERY_SECONDS = Histogram("rag_shard_query_seconds", "Vector query latency per collection shard.", ["shard"])
+QUERIES_TOTAL = Counter("rag_queries_total", "Queries by endpoint and whether the answer cache served them.",
+                        ["endpoint", "cached"])
+BACKEND_ERRORS_TOTAL = Counter("rag_backend_errors_total", "Failed calls to Ollama and the vector store.",
+                               ["backend", "operation"])
+CIRCUIT_BREAKER_OPEN = Gauge("rag_circuit_breaker_open", "1 while the circuit breaker for a backend is open.", ["backend"])
+HTTP_REQUESTS_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests currently being served.")
+HTTP_REQUESTS_TOTAL = Counter("rag_http_requests_total", "HTTP requests by method and status code.", ["method", "status"])
@@ -0,0 +1,143 @@
+# query_embedder.py
+# Coalesces query embeddings across concurrent requests: texts arriving within max_wait_ms of each other are
+# embedded in one batched call and the vectors fanned back out to the waiting requests. Identical queries in
+# flight share one embedding, and recent query vectors are kept in a small LRU.
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_STOP = object()
+
+
+class QueryEmbedder:
+    def __init__(self, embed_batch, max_batch_size=16, max_wait_ms=5.0, cache_size=1024, concurrency=4,
+                 batch_size_histogram=None):
+        # embed_batch(texts) -> one vector per text; max_batch_size <= 1 embeds inline in the calling thread
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.batch_size_histogram = batch_size_histogram
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.batching = max_batch_size > 1
+        # Without batching there is nothing to coalesce into: no queue, collector thread or executor
+        self._queue = queue.Queue() if self.batching else None
+        self._executor = (
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="query-embed") if self.batching else None
+        )
+        self._collector = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    def embed(self, text):
+        # Blocking; call from a worker thread. The returned vector is shared, so callers must not modify it
+        inline = False
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return vector
+            future = self._pending.get(text)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                future = self._pending[text] = Future()
+                if not self.batching:
+                    inline = True
+                else:
+                    self._ensure_collector()
+                    self._queue.put(text)
+        if inline:
+            self._run_batch([text])
+        return future.result()
+
+    def _ensure_collector(self):
+        if self._collector is None:
+            self._collector = threading.Thread(target=self._collect, name="query-embed-collector", daemon=True)
+            self._collector.start()
+
+    def _collect(self):
+        while True:
+            text = self._queue.get()
+            if text is _STOP:
+                return
+            batch = [text]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            # Batches run on the executor so the next one can form while this one is being embedded
+            self._executor.submit(self._run_batch, batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        try:
+            vectors = self.embed_batch(batch)
+            if len(vectors) != len(batch):
+                raise ValueError(f"Embedding batch returned {len(vectors)} vectors for {len(batch)} texts")
+        except Exception as e:
+            with self._lock:
+                futures = [self._pending.pop(text) for text in batch]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            futures = []
+            for text, vector in zip(batch, vectors):
+                if self.cache_size > 0:
+                    self._cache[text] = vector
+                    self._cache.move_to_end(text)
+                futures.append(self._pending.pop(text))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.batches += 1
+            self.batched_texts += len(batch)
+        if self.batch_size_histogram is not None:
+            self.batch_size_histogram.observe(len(batch))
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "cache_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else None,
+                "batching": self.batching,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    def shutdown(self):
+        if self._collector is not None:
+            self._queue.put(_STOP)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,103 @@
+# rerank.py
+# Post-retrieval re-ranking over an over-fetched candidate pool: NumPy-vectorized maximal marginal relevance
+# with optional per-document caps, or a pluggable local re-ranker, under a per-query latency budget.
+
+import importlib
+import time
+
+import numpy as np
+
+
+class Candidate:
+    def __init__(self, chunk_id, document, embedding=None, score=None):
+        self.chunk_id = chunk_id
+        self.document = document
+        self.embedding = embedding
+        # Retrieval score (e.g. fused RRF score); None means relevance is the cosine similarity to the query
+        self.score = score
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_vector, candidate_vectors, k, lambda_mult=0.5, sources=None, max_per_source=0, deadline=None,
+               relevance=None):
+    # Greedy MMR: each step picks argmax(lambda * relevance - (1 - lambda) * max similarity to the picks so far).
+    # Candidates are assumed to be in relevance order; once the deadline passes, the rest is filled in that order.
+    n = len(candidate_vectors)
+    if n == 0 or k <= 0:
+        return []
+    vectors = _unit_rows(np.asarray(candidate_vectors, dtype=np.float32))
+    if relevance is None:
+        relevance = vectors @ _unit_rows(np.asarray(query_vector, dtype=np.float32))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float32)
+    per_source = {}
+    selected = []
+
+    def take(index):
+        selected.append(index)
+        available[index] = False
+        if max_per_source and sources is not None:
+            source = sources[index]
+            per_source[source] = per_source.get(source, 0) + 1
+            if per_source[source] >= max_per_source:
+                available[[i for i in range(n) if sources[i] == source]] = False
+
+    while len(selected) < k and available.any():
+        if deadline is not None and time.perf_counter() > deadline:
+            for index in range(n):
+                if len(selected) >= k:
+                    break
+                if available[index]:
+                    take(index)
+            break
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+        take(index)
+        np.maximum(max_similarity, similarity[index], out=max_similarity)
+    return selected
+
+
+def mmr_rerank(query, query_vector, candidates, k, lambda_mult=0.5, max_per_source=0, budget_ms=None):
+    with_vectors = [c for c in candidates if c.embedding is not None]
+    if not candidates or query_vector is None or len(with_vectors) < len(candidates):
+        return candidates[:k]
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+    sources = [c.document.metadata.get("source_filename") for c in candidates]
+    relevance = None
+    if all(c.score is not None for c in candidates):
+        # Rescale retrieval scores to [0, 1] so they weigh against cosine similarities
+        scores = np.array([c.score for c in candidates], dtype=np.float32)
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    picks = mmr_select(
+        query_vector, [c.embedding for c in candidates], k,
+        lambda_mult=lambda_mult, sources=sources, max_per_source=max_per_source, deadline=deadline,
+        relevance=relevance,
+    )
+    return [candidates[i] for i in picks]
+
+
+def make_reranker(name, lambda_mult=0.5, max_per_source=0, budget_ms=None):
+    # "mmr", "none", or "package.module:function" for a local re-ranker with the signature
+    # fn(query, query_vector, candidates, k) -> candidates (e.g. a cross-encoder)
+    if not name or name == "none":
+        return None
+    if name == "mmr":
+        def rerank(query, query_vector, candidates, k):
+            return mmr_rerank(query, query_vector, candidates, k, lambda_mult=lambda_mult,
+                              max_per_source=max_per_source, budget_ms=budget_ms)
+        return rerank
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown reranker '{name}'. Use 'mmr', 'none' or 'module:function'.")
+    return getattr(importlib.import_module(module_name), attribute)
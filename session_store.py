@@ -0,0 +1,346 @@
+# session_store.py
+# Bounded store of per-session conversation memories: max-sessions cap, idle TTL, LRU eviction and
+# approximate per-session byte accounting, so long-running processes do not grow without limit.
+# SessionStore keeps them in this process; SQLiteSessionStore keeps them in a SQLite file that several
+# worker processes share, so a conversation continues whichever worker serves the next request.
+
+import json
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+from sqlite_store import SQLiteStore
+
+# Rough per-message overhead of the message object and its dicts on top of the text itself
+_MESSAGE_OVERHEAD_BYTES = 500
+
+
+def estimate_memory_bytes(memory):
+    # Approximate size of a ConversationSummaryBufferMemory: buffered messages plus the running summary
+    size = sys.getsizeof(getattr(memory, "moving_summary_buffer", "") or "")
+    chat_memory = getattr(memory, "chat_memory", None)
+    for message in getattr(chat_memory, "messages", []) or []:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        size += sys.getsizeof(content) + _MESSAGE_OVERHEAD_BYTES
+    return size
+
+
+class SessionEntry:
+    def __init__(self, memory, now):
+        self.memory = memory
+        self.created_at = now
+        self.last_used_at = now
+        self.size_bytes = estimate_memory_bytes(memory)
+
+
+class SessionStore:
+    def __init__(self, max_sessions=1000, idle_ttl_seconds=3600, max_total_bytes=0):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # 0 disables the byte budget; only the session count and idle TTL apply then
+        self.max_total_bytes = max_total_bytes
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get_or_create(self, session_id, factory):
+        with self._lock:
+            now = time.time()
+            self._expire_idle(now)
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                entry.last_used_at = now
+                self.sessions.move_to_end(session_id)
+                return entry.memory
+
+            entry = SessionEntry(factory(), now)
+            self.sessions[session_id] = entry
+            self.total_bytes += entry.size_bytes
+            self.created += 1
+            self._evict_over_budget(keep=session_id)
+            return entry.memory
+
+    def update_size(self, session_id):
+        # Called after a turn is saved; the memory may have grown or been summarized down
+        with self._lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return
+            size = estimate_memory_bytes(entry.memory)
+            self.total_bytes += size - entry.size_bytes
+            entry.size_bytes = size
+            entry.last_used_at = time.time()
+            self._evict_over_budget(keep=session_id)
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def clear(self):
+        with self._lock:
+            self.sessions.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            self._expire_idle(time.time())
+            sizes = [entry.size_bytes for entry in self.sessions.values()]
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "total_bytes": self.total_bytes,
+                "max_total_bytes": self.max_total_bytes,
+                "avg_session_bytes": int(self.total_bytes / len(sizes)) if sizes else 0,
+                "max_session_bytes": max(sizes, default=0),
+                "created": self.created,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _expire_idle(self, now):
+        if self.idle_ttl_seconds <= 0:
+            return
+        # The OrderedDict is in least-recently-used order, so idle sessions are at the front
+        while self.sessions:
+            session_id, entry = next(iter(self.sessions.items()))
+            if now - entry.last_used_at < self.idle_ttl_seconds:
+                break
+            self._remove(session_id)
+            self.expirations += 1
+
+    def _evict_over_budget(self, keep):
+        def over_budget():
+            return len(self.sessions) > self.max_sessions or (
+                self.max_total_bytes > 0 and self.total_bytes > self.max_total_bytes)
+
+        if not over_budget():
+            return
+        # Least recently used first; the session being used is skipped even when it is the oldest
+        for session_id in list(self.sessions):
+            if not over_budget():
+                break
+            if session_id == keep:
+                continue
+            self._remove(session_id)
+            self.evictions += 1
+
+    def _remove(self, session_id):
+        entry = self.sessions.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size_bytes
+        return entry
+
+
+class SQLiteSessionStore(SQLiteStore):
+    # Same interface as SessionStore, but factory() is called on every get_or_create: it must build a memory
+    # object that reads and writes through load/append/replace_summary below, holding nothing itself.
+    # Turns are rows, so workers append without overwriting each other; the running summary is swapped in
+    # with a compare-and-set on the last message it covers, so concurrent summarizers cannot lose turns
+    def __init__(self, path, max_sessions=1000, idle_ttl_seconds=3600, max_total_bytes=0, expire_interval=30):
+        super().__init__(path)
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_total_bytes = max_total_bytes
+        # Idle sessions are swept at most this often per process rather than on every request
+        self.expire_interval = expire_interval
+        self._last_expired_at = 0.0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL DEFAULT '',"
+            " summarized_through INTEGER NOT NULL DEFAULT 0,"
+            " size_bytes INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " size_bytes INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS session_messages_session ON session_messages (session_id, seq)")
+        conn.execute("CREATE TABLE IF NOT EXISTS session_counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+
+    def get_or_create(self, session_id, factory):
+        now = time.time()
+        if now - self._last_expired_at >= self.expire_interval:
+            self._last_expired_at = now
+            self._expire_idle(now)
+        with self._transaction() as conn:
+            created = conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, last_used_at) VALUES (?, ?, ?)",
+                (session_id, now, now),
+            ).rowcount
+            if created:
+                self._count(conn, "created")
+                self._evict_over_budget(conn, keep=session_id)
+            else:
+                conn.execute("UPDATE sessions SET last_used_at = ? WHERE session_id = ?", (now, session_id))
+        return factory()
+
+    def load(self, session_id):
+        # (summary, summarized_through, [(seq, message)]) with only the messages the summary does not cover
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT summary, summarized_through FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        summary, summarized_through = row if row else ("", 0)
+        rows = conn.execute(
+            "SELECT seq, message FROM session_messages WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (session_id, summarized_through),
+        ).fetchall()
+        messages = messages_from_dict([json.loads(message) for _, message in rows])
+        return summary, summarized_through, list(zip([seq for seq, _ in rows], messages))
+
+    def append(self, session_id, messages):
+        rows = []
+        for message in messages:
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            rows.append((session_id, json.dumps(message_to_dict(message), ensure_ascii=False),
+                         len(content.encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES))
+        now = time.time()
+        with self._transaction() as conn:
+            # Recreated if it expired or was evicted while the request was running
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, last_used_at) VALUES (?, ?, ?)",
+                (session_id, now, now),
+            )
+            conn.executemany("INSERT INTO session_messages (session_id, message, size_bytes) VALUES (?, ?, ?)", rows)
+            conn.execute(
+                "UPDATE sessions SET size_bytes = size_bytes + ?, last_used_at = ? WHERE session_id = ?",
+                (sum(size for _, _, size in rows), now, session_id),
+            )
+
+    def replace_summary(self, session_id, summary, through_seq, expected_through):
+        # Returns False when another worker summarized the session first; its summary is kept
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE sessions SET summary = ?, summarized_through = ? WHERE session_id = ? AND summarized_through = ?",
+                (summary, through_seq, session_id, expected_through),
+            ).rowcount
+            if not updated:
+                return False
+            conn.execute("DELETE FROM session_messages WHERE session_id = ? AND seq <= ?", (session_id, through_seq))
+            self._recompute_size(conn, session_id)
+        return True
+
+    def update_size(self, session_id):
+        # Sizes are kept current by append/replace_summary; this only enforces the budget
+        with self._transaction() as conn:
+            conn.execute("UPDATE sessions SET last_used_at = ? WHERE session_id = ?", (time.time(), session_id))
+            self._evict_over_budget(conn, keep=session_id)
+
+    def remove(self, session_id):
+        with self._transaction() as conn:
+            return self._remove(conn, [session_id]) > 0
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM session_messages")
+            conn.execute("DELETE FROM sessions")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    @property
+    def total_bytes(self):
+        return self._connect().execute("SELECT COALESCE(SUM(size_bytes), 0) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        self._expire_idle(time.time())
+        conn = self._connect()
+        sessions, total_bytes, max_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(MAX(size_bytes), 0) FROM sessions"
+        ).fetchone()
+        counters = dict(conn.execute("SELECT key, value FROM session_counters").fetchall())
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "total_bytes": total_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "avg_session_bytes": int(total_bytes / sessions) if sessions else 0,
+            "max_session_bytes": max_bytes,
+            "created": counters.get("created", 0),
+            "evictions": counters.get("evictions", 0),
+            "expirations": counters.get("expirations", 0),
+        }
+
+    def _expire_idle(self, now):
+        if self.idle_ttl_seconds <= 0:
+            return
+        with self._transaction() as conn:
+            idle = [row[0] for row in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_used_at <= ?", (now - self.idle_ttl_seconds,)
+            ).fetchall()]
+            self._count(conn, "expirations", self._remove(conn, idle))
+
+    def _evict_over_budget(self, conn, keep):
+        sessions, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM sessions").fetchone()
+
+        def over_budget():
+            return sessions > self.max_sessions or (self.max_total_bytes > 0 and total_bytes > self.max_total_bytes)
+
+        if not over_budget():
+            return
+        evicted = []
+        # Least recently used first, as in SessionStore
+        for session_id, size_bytes in conn.execute(
+            "SELECT session_id, size_bytes FROM sessions ORDER BY last_used_at"
+        ).fetchall():
+            if not over_budget():
+                break
+            if session_id == keep:
+                continue
+            evicted.append(session_id)
+            sessions -= 1
+            total_bytes -= size_bytes
+        self._count(conn, "evictions", self._remove(conn, evicted))
+
+    def _remove(self, conn, session_ids):
+        removed = 0
+        for session_id in session_ids:
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            removed += conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+        return removed
+
+    def _recompute_size(self, conn, session_id):
+        conn.execute(
+            "UPDATE sessions SET size_bytes = length(CAST(summary AS BLOB))"
+            " + (SELECT COALESCE(SUM(size_bytes), 0) FROM session_messages WHERE session_id = ?)"
+            " WHERE session_id = ?",
+            (session_id, session_id),
+        )
+
+    def _count(self, conn, key, amount=1):
+        if amount:
+            conn.execute(
+                "INSERT INTO session_counters (key, value) VALUES (?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, amount),
+            )
+
+
+def make_session_store(backend, path=None, **limits):
+    # "memory" = this process only; "sqlite" = shared by every worker process using the same path
+    if backend == "memory":
+        return SessionStore(**limits)
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, **limits)
+    raise ValueError(f"Unknown state backend '{backend}' (expected 'memory' or 'sqlite')")
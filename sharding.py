@@ -0,0 +1,337 @@
+# sharding.py
+# Routes chunks to one collection per value of a metadata key (e.g. document_type or a tenant id) behind the
+# same Collection API the rest of the app uses. Queries whose filters pin the key go to that shard only;
+# all others fan out to every shard concurrently and the hits are merged by distance.
+
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from local_vector_index import open_collection
+
+SHARD_SEPARATOR = "__"
+
+
+def shard_collection_name(base_name, value):
+    # Chroma collection names allow only [a-zA-Z0-9._-]: values get an ASCII slug plus a hash of the value.
+    # Chunks without the key stay in the base collection, so existing data needs no migration
+    if value is None:
+        return base_name
+    text = str(value)
+    slug = re.sub(r"[^a-zA-Z0-9]+", "-", text).strip("-")[:40]
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{base_name}{SHARD_SEPARATOR}{slug + '-' if slug else ''}{digest}"
+
+
+def routing_values(where, key):
+    # Values of `key` a Chroma where clause restricts results to, or None when it does not restrict the key
+    if not where:
+        return None
+    if key in where:
+        condition = where[key]
+        if not isinstance(condition, dict):
+            return {condition}
+        if "$eq" in condition:
+            return {condition["$eq"]}
+        if "$in" in condition:
+            return set(condition["$in"])
+        return None
+    for clause in where.get("$and", []):
+        values = routing_values(clause, key)
+        if values is not None:
+            return values
+    return None
+
+
+def _rows(values):
+    # Chroma may return embeddings as a 2-D numpy array
+    return list(values) if values is not None else None
+
+
+class ShardedCollection:
+    def __init__(self, shard_key, base_name, open_shard, list_shards, max_workers=8, latency_histogram=None, backend=None):
+        # open_shard(name) opens or creates a collection; list_shards() names the collections that exist
+        self.backend = backend
+        self.shard_key = shard_key
+        self.base_name = base_name
+        self.name = base_name
+        self._open_shard = open_shard
+        self._list_shards = list_shards
+        self.latency_histogram = latency_histogram
+        self._shards = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+        self.refresh()
+
+    # --- Shard management ---
+
+    def refresh(self):
+        # Picks up shards created by another process, e.g. ingest_bulk.py
+        names = [name for name in self._list_shards()
+                 if name == self.base_name or name.startswith(self.base_name + SHARD_SEPARATOR)]
+        for name in [self.base_name] + names:
+            self._shard(name)
+        return self.shard_names()
+
+    def shard_names(self):
+        with self._lock:
+            return sorted(self._shards)
+
+    def shard_for(self, metadata):
+        value = (metadata or {}).get(self.shard_key)
+        return shard_collection_name(self.base_name, None if value in (None, "") else value)
+
+    def _shard(self, name, create=True):
+        with self._lock:
+            shard = self._shards.get(name)
+        if shard is not None or not create:
+            return shard
+        # Serialized so a shard is never opened twice (a second local index would write its own log)
+        with self._open_lock:
+            with self._lock:
+                shard = self._shards.get(name)
+            if shard is None:
+                shard = self._open_shard(name)
+                with self._lock:
+                    self._shards[name] = shard
+        return shard
+
+    def _targets(self, where):
+        values = routing_values(where, self.shard_key)
+        with self._lock:
+            if values is None:
+                return sorted(self._shards.items())
+            names = {shard_collection_name(self.base_name, None if value in (None, "") else value) for value in values}
+            return [(name, self._shards[name]) for name in sorted(names) if name in self._shards]
+
+    def _fan_out(self, targets, fn):
+        if len(targets) == 1:
+            name, shard = targets[0]
+            return [(name, fn(name, shard))]
+        futures = [(name, self._executor.submit(fn, name, shard)) for name, shard in targets]
+        return [(name, future.result()) for name, future in futures]
+
+    def _group(self, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+        return groups
+
+    # --- Chroma Collection API subset ---
+
+    def count(self):
+        return sum(result for _, result in self._fan_out(self._targets(None), lambda name, shard: shard.count()))
+
+    def add(self, ids, embeddings, metadatas=None, documents=None):
+        self._write("add", ids, embeddings, metadatas, documents)
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        self._write("upsert", ids, embeddings, metadatas, documents)
+
+    def _write(self, method, ids, embeddings, metadatas, documents):
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        for name, rows in self._group([self.shard_for(metadata) for metadata in metadatas]).items():
+            getattr(self._shard(name), method)(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+                documents=[documents[i] for i in rows] if documents is not None else None,
+            )
+
+    def _locate(self, ids):
+        located = {}
+        results = self._fan_out(self._targets(None), lambda name, shard: shard.get(ids=list(ids), include=[]))
+        for name, result in results:
+            for chunk_id in result["ids"]:
+                located[chunk_id] = name
+        return located
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        # A chunk whose routing value changed (e.g. a re-uploaded file with a new document_type) moves shards
+        located = self._locate(ids)
+        in_place = {}
+        moves = {}
+        for i, chunk_id in enumerate(ids):
+            current = located.get(chunk_id)
+            if current is None:
+                continue
+            target = self.shard_for(metadatas[i]) if metadatas is not None else current
+            if target == current:
+                in_place.setdefault(current, []).append(i)
+            else:
+                moves.setdefault((current, target), []).append(i)
+
+        def pick(values, rows):
+            return [values[i] for i in rows] if values is not None else None
+
+        for name, rows in in_place.items():
+            self._shard(name).update(ids=[ids[i] for i in rows], metadatas=pick(metadatas, rows),
+                                     documents=pick(documents, rows), embeddings=pick(embeddings, rows))
+        for (current, target), rows in moves.items():
+            moved_ids = [ids[i] for i in rows]
+            fetched = self._shard(current).get(ids=moved_ids, include=["documents", "embeddings"])
+            by_id = {chunk_id: (document, vector) for chunk_id, document, vector
+                     in zip(fetched["ids"], fetched["documents"], _rows(fetched["embeddings"]))}
+            self._shard(target).upsert(
+                ids=moved_ids,
+                embeddings=[embeddings[i] if embeddings is not None else by_id[ids[i]][1] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+                documents=[documents[i] if documents is not None else by_id[ids[i]][0] for i in rows],
+            )
+            self._shard(current).delete(ids=moved_ids)
+
+    def delete(self, ids=None, where=None):
+        results = self._fan_out(self._targets(where), lambda name, shard: shard.delete(ids=ids, where=where))
+        deleted = [result.get("deleted") for _, result in results if isinstance(result, dict)]
+        if len(deleted) == len(results) and None not in deleted:
+            return {"deleted": sum(deleted)}
+        return None
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        targets = self._targets(where)
+        if ids is not None or (limit is None and not offset):
+            results = [result for _, result in self._fan_out(
+                targets, lambda name, shard: shard.get(ids=ids, where=where, include=include))]
+            return self._concat(results, include)
+        if where is not None:
+            # Filtered paging: shard counts do not apply, so page over the concatenated matches
+            results = [result for _, result in self._fan_out(
+                targets, lambda name, shard: shard.get(where=where, include=include))]
+            merged = self._concat(results, include)
+            end = (offset or 0) + limit if limit is not None else None
+            return {key: value[offset or 0:end] if isinstance(value, list) and key != "included" else value
+                    for key, value in merged.items()}
+
+        # Unfiltered paging walks the shards in name order, using their counts to skip whole shards
+        results = []
+        skip = offset or 0
+        remaining = limit
+        for name, shard in targets:
+            if remaining is not None and remaining <= 0:
+                break
+            shard_count = shard.count()
+            if skip >= shard_count:
+                skip -= shard_count
+                continue
+            result = shard.get(limit=remaining, offset=skip, include=include)
+            skip = 0
+            if remaining is not None:
+                remaining -= len(result["ids"])
+            results.append(result)
+        return self._concat(results, include)
+
+    def _concat(self, results, include):
+        merged = {"ids": []}
+        for key in ("documents", "metadatas", "embeddings"):
+            merged[key] = [] if key in include else None
+        for result in results:
+            merged["ids"].extend(result["ids"])
+            for key in ("documents", "metadatas", "embeddings"):
+                if merged[key] is not None and result.get(key) is not None:
+                    merged[key].extend(_rows(result[key]))
+        merged["included"] = list(include)
+        return merged
+
+    def peek(self, limit=10):
+        return self.get(limit=limit, include=["documents", "metadatas", "embeddings"])
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        shard_include = list(dict.fromkeys(list(include) + ["distances"]))
+
+        def query_shard(name, shard):
+            started = time.perf_counter()
+            try:
+                return shard.query(query_embeddings=query_embeddings, n_results=n_results, where=where, include=shard_include)
+            finally:
+                self._record_latency(name, time.perf_counter() - started)
+
+        results = [result for _, result in self._fan_out(self._targets(where), query_shard)]
+        merged = {key: [] for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+        for query_index in range(len(query_embeddings)):
+            hits = []
+            for result in results:
+                columns = [result["ids"][query_index], result["distances"][query_index]]
+                for key in ("documents", "metadatas", "embeddings"):
+                    values = result.get(key)
+                    columns.append(_rows(values[query_index]) if key in include and values is not None else None)
+                for j, chunk_id in enumerate(columns[0]):
+                    hits.append((columns[1][j], chunk_id, *(column[j] if column is not None else None for column in columns[2:])))
+            hits.sort(key=lambda hit: hit[0])
+            hits = hits[:n_results]
+            merged["ids"].append([hit[1] for hit in hits])
+            merged["distances"].append([hit[0] for hit in hits])
+            merged["documents"].append([hit[2] for hit in hits])
+            merged["metadatas"].append([hit[3] for hit in hits])
+            merged["embeddings"].append([hit[4] for hit in hits])
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key not in include:
+                merged[key] = None
+        return merged
+
+    # --- Operations ---
+
+    def _record_latency(self, name, seconds):
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(seconds, shard=name)
+        with self._lock:
+            stats = self._latency.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = seconds
+
+    def stats(self):
+        def shard_stats(name, shard):
+            sample = shard.get(limit=1, include=["metadatas"])
+            metadatas = sample.get("metadatas") or [{}]
+            entry = {
+                "name": name,
+                "routing_value": None if name == self.base_name else (metadatas[0] or {}).get(self.shard_key),
+                "count": shard.count(),
+            }
+            if hasattr(shard, "stats"):
+                entry.update({key: value for key, value in shard.stats().items() if key not in ("backend", "count")})
+            with self._lock:
+                queries, total, last = self._latency.get(name, (0, 0.0, 0.0))
+            entry.update(queries=queries, mean_query_ms=round(total / queries * 1000, 2) if queries else None,
+                         last_query_ms=round(last * 1000, 2) if queries else None)
+            return entry
+
+        shards = [result for _, result in self._fan_out(self._targets(None), shard_stats)]
+        return {"backend": self.backend, "shard_key": self.shard_key,
+                "count": sum(shard["count"] for shard in shards), "shards": shards}
+
+    def snapshot(self):
+        return sum(shard.snapshot() for _, shard in self._targets(None))
+
+    def close(self):
+        for _, shard in self._targets(None):
+            if hasattr(shard, "close"):
+                shard.close()
+        self._executor.shutdown(wait=False)
+
+
+def open_sharded_collection(backend, collection_name, shard_key, chroma_client=None, chroma_host=None, chroma_port=None,
+                            local_path=None, wrap=None, max_workers=8, latency_histogram=None, **local_options):
+    # wrap(collection) is applied to every shard, e.g. to put Chroma calls behind a circuit breaker
+    if backend == "chroma" and chroma_client is None:
+        import chromadb
+        chroma_client = chromadb.HttpClient(host=chroma_host, port=int(chroma_port))
+
+    def open_shard(name):
+        shard = open_collection(backend, name, chroma_client=chroma_client, local_path=local_path, **local_options)
+        return wrap(shard) if wrap is not None else shard
+
+    def list_shards():
+        if backend == "local":
+            if not os.path.isdir(local_path):
+                return []
+            return [name for name in os.listdir(local_path) if os.path.isdir(os.path.join(local_path, name))]
+        # chromadb < 0.6 returns names, later versions Collection objects
+        return [item if isinstance(item, str) else item.name for item in chroma_client.list_collections()]
+
+    return ShardedCollection(shard_key, collection_name, open_shard, list_shards, max_workers, latency_histogram, backend)
@@ -0,0 +1,196 @@
+# shared_state.py
+# Coordination between API worker processes (uvicorn --workers N) on one machine, through a SQLite file
+# under RAG_DATA_DIR: named leases for work only one process may do at a time, and a feed of collection
+# changes so each process can bring its in-memory indexes up to date with writes made by the others.
+
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlite_store import SQLiteStore
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LeaseStore(SQLiteStore):
+    # A lease is held until released, until its TTL runs out, or until its holder's process is gone
+    # (checked by PID for holders on this host), so a crashed worker never blocks the others for long
+    def __init__(self, path):
+        super().__init__(path)
+        self.host = socket.gethostname()
+        self.owner = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " host TEXT NOT NULL,"
+            " pid INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def acquire(self, name, ttl_seconds):
+        # Non-blocking; re-acquiring a lease this process already holds extends it
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, host, pid, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and not self._is_stale(row, now):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, host, pid, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (name, self.owner, self.host, os.getpid(), now + ttl_seconds),
+            )
+        return True
+
+    def renew(self, name, ttl_seconds):
+        # Extends a lease this process still holds; False once it was released, or expired and taken over
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?", (time.time() + ttl_seconds, name, self.owner)
+            )
+        return cursor.rowcount > 0
+
+    def release(self, name):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    @contextmanager
+    def hold(self, name, ttl_seconds=3600, poll_interval=0.5):
+        # Waits until the lease is free
+        while not self.acquire(name, ttl_seconds):
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def holder(self, name):
+        row = self._connect().execute(
+            "SELECT owner, host, pid, expires_at FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None or self._is_stale(row, time.time()):
+            return None
+        return row[0]
+
+    def _is_stale(self, row, now):
+        _, host, pid, expires_at = row
+        if expires_at < now:
+            return True
+        return os.name == "posix" and host == self.host and not _pid_alive(pid)
+
+
+class ChangeFeed(SQLiteStore):
+    # Append-only log of (op, source_filename) writes to the collection; readers poll for entries past the
+    # last sequence number they applied. Entries are only hints: readers re-read the collection itself
+    def __init__(self, path, retention_seconds=86400):
+        super().__init__(path)
+        self.retention_seconds = retention_seconds
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS collection_changes ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " op TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def append(self, op, source):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            seq = conn.execute(
+                "INSERT INTO collection_changes (op, source, created_at) VALUES (?, ?, ?)", (op, source, now)
+            ).lastrowid
+            conn.execute("DELETE FROM collection_changes WHERE created_at < ?", (now - self.retention_seconds,))
+        return seq
+
+    def latest(self):
+        return self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM collection_changes").fetchone()[0]
+
+    def oldest(self):
+        return self._connect().execute("SELECT COALESCE(MIN(seq), 0) FROM collection_changes").fetchone()[0]
+
+    def since(self, seq):
+        # [(seq, op, source)] in order
+        return self._connect().execute(
+            "SELECT seq, op, source FROM collection_changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+
+class ChangeFollower:
+    # Tracks how far this process has read a ChangeFeed. record() appends this process's own writes, which
+    # poll() then skips; poll() hands everything else to apply(changes) and only advances once it succeeded.
+    # apply(None) means entries were trimmed before this process read them and it has to resync fully
+    def __init__(self, feed, apply):
+        self.feed = feed
+        self.apply = apply
+        self.seq = feed.latest()
+        self.applied = 0
+        self._own = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self, interval, poll):
+        # Background polling, so changes arrive even while this process serves no queries
+        def loop():
+            while not self._stopped.wait(interval):
+                poll()
+
+        threading.Thread(target=loop, name="change-follower", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def record(self, op, source):
+        seq = self.feed.append(op, source)
+        with self._lock:
+            self._own.add(seq)
+        return seq
+
+    def skip_to_latest(self):
+        # Before a full rebuild: changes made while it runs are applied again afterwards, which is harmless
+        self.seq = self.feed.latest()
+
+    def rewind(self, seq):
+        # After loading state saved at seq: everything after it is applied again, this process's own writes too
+        with self._lock:
+            self.seq = seq
+            self._own.clear()
+
+    def poll(self, wait=False):
+        # Returns the number of changes applied; a poll already running in another thread is only waited
+        # for with wait=True
+        if not self._lock.acquire(blocking=wait):
+            return 0
+        try:
+            latest = self.feed.latest()
+            if latest <= self.seq:
+                return 0
+            if self.feed.oldest() > self.seq + 1:
+                self.apply(None)
+                changes = []
+            else:
+                changes = [change for change in self.feed.since(self.seq) if change[0] not in self._own]
+                if changes:
+                    self.apply(changes)
+            self._own = {seq for seq in self._own if seq > latest}
+            self.seq = latest
+            self.applied += len(changes)
+            return len(changes)
+        finally:
+            self._lock.release()
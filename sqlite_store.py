@@ -0,0 +1,38 @@
+# sqlite_store.py
+# Base class for the local SQLite sidecar files under RAG_DATA_DIR (one connection per thread, WAL mode
+# so several threads and processes can read while one writes).
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a read-then-write is atomic across processes
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
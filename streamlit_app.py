@@ -4,6 +4,12 @@ import streamlit as st
 import requests
 import json
 import os
+import time
+
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
 # --- Configuration ---
 # Make sure this matches the port your FastAPI backend is running on
@@ -15,6 +21,11 @@ st.set_page_config(
     layout="centered"
 )
 
+# Keep the FastAPI session cookie across reruns so each browser tab has its own conversation history
+if "api_session" not in st.session_state:
+    st.session_state.api_session = requests.Session()
+api_session = st.session_state.api_session
+
 st.title("🇹🇭 Thai RAG System PoC")
 st.markdown("---")
 
@@ -37,9 +48,6 @@ metadata_input = st.text_input(
 if st.button("อัปโหลดและประมวลผล", key="upload_button"):
     if uploaded_file is not None:
         try:
-            # Prepare form data
-            files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-
             # Check if metadata_input is valid JSON
             try:
                 json_metadata = json.loads(metadata_input)
@@ -47,18 +55,49 @@ if st.button("อัปโหลดและประมวลผล", key="uplo
                 st.error("Metadata ไม่ถูกต้อง กรุณาใส่ในรูปแบบ JSON ที่ถูกต้อง")
                 st.stop() # Stop execution if JSON is invalid
 
-            data = {'metadata': metadata_input} # Send as string, FastAPI will parse it
+            with st.spinner("กำลังอัปโหลดเอกสาร..."):
+                uploaded_file.seek(0)
+                if MultipartEncoder is not None:
+                    # Streams the multipart body from the uploaded file instead of building it in memory
+                    encoder = MultipartEncoder(fields={
+                        'metadata': metadata_input, # Send as string, FastAPI will parse it
+                        'file': (uploaded_file.name, uploaded_file, uploaded_file.type),
+                    })
+                    response = requests.post(f"{FASTAPI_BASE_URL}/ingest", data=encoder,
+                                             headers={'Content-Type': encoder.content_type})
+                else:
+                    files = {'file': (uploaded_file.name, uploaded_file, uploaded_file.type)}
+                    response = requests.post(f"{FASTAPI_BASE_URL}/ingest", files=files, data={'metadata': metadata_input})
 
-            with st.spinner("กำลังอัปโหลดและประมวลผลเอกสาร..."):
-                response = requests.post(f"{FASTAPI_BASE_URL}/ingest", files=files, data=data)
+            if response.status_code in (200, 202):
+                job_id = response.json()["job_id"]
+                st.info(f"{response.json().get('message', 'เอกสารถูกส่งเข้าคิวแล้ว')} (Job ID: {job_id})")
 
-                if response.status_code == 200:
-                    st.success(f"อัปโหลดสำเร็จ: {response.json().get('message', 'เอกสารถูกประมวลผลแล้ว')}")
-                    st.json(response.json())
+                # Ingestion runs in the background; poll the job until it finishes
+                progress_bar = st.progress(0.0)
+                status_text = st.empty()
+                while True:
+                    job = requests.get(f"{FASTAPI_BASE_URL}/ingest/jobs/{job_id}").json()
+                    if job["chunks_total"]:
+                        progress_bar.progress(min(job["chunks_done"] / job["chunks_total"], 1.0))
+                    status_text.write(
+                        f"ขั้นตอน: {job['stage']} | Chunks: {job['chunks_done']}/{job['chunks_total']} "
+                        f"| {job['chunks_per_second']} chunks/s"
+                    )
+                    if job["status"] in ("done", "failed"):
+                        break
+                    time.sleep(1)
+
+                if job["status"] == "done":
+                    st.success(f"อัปโหลดสำเร็จ: {job['result'].get('message', 'เอกสารถูกประมวลผลแล้ว')}")
+                    st.json(job["result"])
                 else:
-                    st.error(f"เกิดข้อผิดพลาดในการอัปโหลด: {response.status_code}")
-                    st.error(response.json().get("detail", "ไม่ทราบสาเหตุของข้อผิดพลาด"))
-                    st.json(response.json()) # Show full error response
+                    st.error(f"เกิดข้อผิดพลาดในการประมวลผล: {job['error']}")
+                    st.json(job)
+            else:
+                st.error(f"เกิดข้อผิดพลาดในการอัปโหลด: {response.status_code}")
+                st.error(response.json().get("detail", "ไม่ทราบสาเหตุของข้อผิดพลาด"))
+                st.json(response.json()) # Show full error response
         except requests.exceptions.ConnectionError:
             st.error(f"ไม่สามารถเชื่อมต่อกับ FastAPI Backend ได้ กรุณาตรวจสอบว่า Backend กำลังทำงานอยู่ที่ {FASTAPI_BASE_URL} หรือไม่")
         except Exception as e:
@@ -96,6 +135,34 @@ with col2:
         help="จำนวน Context Chunk ที่จะดึงมาช่วยในการตอบ"
     )
 
+stream_answer = st.checkbox("แสดงคำตอบทันทีขณะสร้าง (Streaming)", value=True)
+
+def iter_sse_events(response):
+    # Minimal Server-Sent Events parser for the /query/stream endpoint
+    event, data_lines = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+
+def show_sources(result):
+    st.subheader("แหล่งข้อมูลที่เกี่ยวข้อง:")
+    if result.get("relevant_sources"):
+        for source in result["relevant_sources"]:
+            st.markdown(f"- {source}")
+    else:
+        st.info("ไม่พบแหล่งข้อมูลที่เกี่ยวข้อง")
+
+    # Optionally show raw context chunks for debugging
+    # with st.expander("แสดง Context Chunks ที่ดึงมา"):
+    #     for i, chunk_data in enumerate(result.get("source_chunks", [])):
+    #         st.write(f"**Chunk {i+1}:**")
+    #         st.code(chunk_data.get("content", ""), language="text")
+
 if st.button("ถาม RAG", key="query_button"):
     if query_input:
         try:
@@ -112,31 +179,41 @@ if st.button("ถาม RAG", key="query_button"):
                 "top_k": top_k_input
             }
 
-            with st.spinner("กำลังค้นหาและสร้างคำตอบ..."):
-                response = requests.post(f"{FASTAPI_BASE_URL}/query", json=payload)
-
-                if response.status_code == 200:
-                    result = response.json()
-                    st.subheader("คำตอบ:")
-                    st.success(result.get("answer", "ไม่มีคำตอบ"))
-
-                    st.subheader("แหล่งข้อมูลที่เกี่ยวข้อง:")
-                    if result.get("relevant_sources"):
-                        for source in result["relevant_sources"]:
-                            st.markdown(f"- {source}")
+            if stream_answer:
+                st.subheader("คำตอบ:")
+                answer_placeholder = st.empty()
+                answer_placeholder.info("กำลังค้นหาและสร้างคำตอบ...")
+                answer_text = ""
+                with api_session.post(f"{FASTAPI_BASE_URL}/query/stream", json=payload, stream=True) as response:
+                    if response.status_code == 200:
+                        for event, data in iter_sse_events(response):
+                            if event == "sources":
+                                show_sources(data)
+                            elif event == "token":
+                                answer_text += data["text"]
+                                answer_placeholder.success(answer_text + "▌")
+                            elif event == "done":
+                                answer_placeholder.success(data["answer"] or "ไม่มีคำตอบ")
+                            elif event == "error":
+                                st.error(data["detail"])
                     else:
-                        st.info("ไม่พบแหล่งข้อมูลที่เกี่ยวข้อง")
+                        answer_placeholder.empty()
+                        st.error(f"เกิดข้อผิดพลาดในการสอบถาม: {response.status_code}")
+                        st.error(response.json().get("detail", "ไม่ทราบสาเหตุของข้อผิดพลาด"))
+                        st.json(response.json()) # Show full error response
+            else:
+                with st.spinner("กำลังค้นหาและสร้างคำตอบ..."):
+                    response = api_session.post(f"{FASTAPI_BASE_URL}/query", json=payload)
 
-                    # Optionally show raw context chunks for debugging
-                    # with st.expander("แสดง Context Chunks ที่ดึงมา"):
-                    #     for i, chunk_data in enumerate(result.get("source_chunks", [])):
-                    #         st.write(f"**Chunk {i+1}:**")
-                    #         st.code(chunk_data.get("content", ""), language="text")
-
-                else:
-                    st.error(f"เกิดข้อผิดพลาดในการสอบถาม: {response.status_code}")
-                    st.error(response.json().get("detail", "ไม่ทราบสาเหตุของข้อผิดพลาด"))
-                    st.json(response.json()) # Show full error response
+                    if response.status_code == 200:
+                        result = response.json()
+                        st.subheader("คำตอบ:")
+                        st.success(result.get("answer", "ไม่มีคำตอบ"))
+                        show_sources(result)
+                    else:
+                        st.error(f"เกิดข้อผิดพลาดในการสอบถาม: {response.status_code}")
+                        st.error(response.json().get("detail", "ไม่ทราบสาเหตุของข้อผิดพลาด"))
+                        st.json(response.json()) # Show full error response
         except requests.exceptions.ConnectionError:
             st.error(f"ไม่สามารถเชื่อมต่อกับ FastAPI Backend ได้ กรุณาตรวจสอบว่า Backend กำลังทำงานอยู่ที่ {FASTAPI_BASE_URL} หรือไม่")
         except Exception as e:
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Tests import the top-level modules directly, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py reads its configuration at import time: keep its SQLite files out of the working tree and
+# never reach out to the Hugging Face hub for tokenizers
+os.environ.setdefault("RAG_DATA_DIR", tempfile.mkdtemp(prefix="rag_test_"))
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
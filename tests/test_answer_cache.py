@@ -0,0 +1,103 @@
+import pytest
+
+import answer_cache
+from answer_cache import make_answer_cache, make_scope
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path, clock):
+    def make(**options):
+        return make_answer_cache(request.param, str(tmp_path / "state.sqlite3"), **options)
+
+    return make
+
+
+def put(cache, query, sources=(), query_vector=None, generation=None):
+    cache.put(cache.make_key(query, None, 5), make_scope(None, 5), {"answer": query}, list(sources),
+              query_vector=query_vector, generation=generation)
+
+
+def test_key_ignores_case_and_whitespace_but_not_scope(make_cache):
+    cache = make_cache()
+    key = cache.make_key("  นโยบาย  การลา\tPolicy ", None, 5)
+    assert key == cache.make_key("นโยบาย การลา policy", {}, 5)
+    assert key != cache.make_key("นโยบาย การลา policy", {"document_type": "hr"}, 5)
+    assert key != cache.make_key("นโยบาย การลา policy", None, 3)
+
+    put(cache, "นโยบาย การลา policy")
+    assert cache.get(key) == {"answer": "นโยบาย การลา policy"}
+    assert cache.get(cache.make_key("อื่น", None, 5)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_similar_queries_hit_only_above_the_threshold(make_cache):
+    cache = make_cache(similarity_threshold=0.9)
+    put(cache, "วันลาพักร้อน", query_vector=[1.0, 0.0])
+    scope = make_scope(None, 5)
+
+    assert cache.get_similar(scope, [0.95, 0.31]) == {"answer": "วันลาพักร้อน"}
+    assert cache.get_similar(scope, [0.5, 0.87]) is None
+    assert cache.get_similar(make_scope({"document_type": "hr"}, 5), [1.0, 0.0]) is None
+    assert make_cache(similarity_threshold=0.0).get_similar(scope, [1.0, 0.0]) is None
+
+
+def test_least_recently_used_and_expired_entries_are_dropped(make_cache, clock):
+    cache = make_cache(max_entries=2, ttl_seconds=60)
+    put(cache, "a")
+    clock.now += 1
+    put(cache, "b")
+    clock.now += 1
+    assert cache.get(cache.make_key("a", None, 5)) is not None
+    clock.now += 1
+    put(cache, "c")
+
+    assert cache.get(cache.make_key("b", None, 5)) is None
+    assert cache.stats()["evictions"] == 1
+    clock.now += 59
+    assert cache.contains(cache.make_key("c", None, 5))
+    clock.now += 2
+    assert not cache.contains(cache.make_key("c", None, 5))
+    assert cache.get(cache.make_key("a", None, 5)) is None
+
+
+def test_answer_computed_before_an_invalidation_is_not_stored(make_cache):
+    cache = make_cache()
+    put(cache, "a", sources=["คู่มือ.pdf"])
+    put(cache, "no sources")
+    generation = cache.generation
+
+    # An ingest of คู่มือ.pdf finishes while "b" is being answered from the old chunks
+    assert cache.invalidate_sources(["คู่มือ.pdf"]) == 1
+    put(cache, "b", sources=["คู่มือ.pdf"], generation=generation)
+    assert cache.get(cache.make_key("b", None, 5)) is None
+    assert cache.get(cache.make_key("a", None, 5)) is None
+
+    put(cache, "b", sources=["คู่มือ.pdf"], generation=cache.generation)
+    assert cache.get(cache.make_key("b", None, 5)) is not None
+    assert cache.invalidate_sources(["new.pdf"], include_sourceless=True) == 1
+    assert cache.get(cache.make_key("no sources", None, 5)) is None
+
+
+def test_sqlite_generation_is_shared_between_workers(tmp_path, clock):
+    path = str(tmp_path / "state.sqlite3")
+    worker, other = make_answer_cache("sqlite", path), make_answer_cache("sqlite", path)
+    generation = worker.generation
+    other.invalidate_sources(["คู่มือ.pdf"])
+    put(worker, "a", sources=["คู่มือ.pdf"], generation=generation)
+    assert other.get(other.make_key("a", None, 5)) is None
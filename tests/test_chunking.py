@@ -0,0 +1,76 @@
+import re
+
+import pytest
+
+from chunking import _THAI_NO_CUT_BEFORE, TokenTextSplitter, iter_chunks
+
+
+class CharCounter:
+    # One token per non-space character: deterministic and needs no tokenizer download
+    def count_many(self, texts):
+        return [len(re.sub(r"\s", "", text)) for text in texts]
+
+
+def make_sections():
+    sections = []
+    for i in range(8):
+        sentences = " ".join(f"Sentence {i}.{j} says something." for j in range(6))
+        thai = " ".join(f"ประโยคภาษาไทยที่{j}ของส่วน{i}" for j in range(4))
+        sections.append(f"# Heading {i}\n\n{sentences}\n{thai}")
+    return sections
+
+
+def make_text():
+    return "\n\n".join(make_sections())
+
+
+@pytest.fixture
+def splitter():
+    return TokenTextSplitter(CharCounter(), chunk_size=120, chunk_overlap=30)
+
+
+def test_chunks_fit_the_budget_and_are_substrings_at_their_offsets(splitter):
+    text = make_text()
+    located = list(splitter.split_text_with_offsets(text))
+    assert len(located) > 8
+    for chunk, start in located:
+        assert text[start:start + len(chunk)] == chunk
+        assert CharCounter().count_many([chunk])[0] <= 120
+    # Chunks tile the text: each starts at or before the previous one's end, and the last reaches the end
+    for (previous, previous_start), (_, start) in zip(located, located[1:]):
+        assert previous_start < start <= previous_start + len(previous) + 2
+    assert located[-1][1] + len(located[-1][0]) == len(text.rstrip())
+
+
+def test_headings_start_chunks_without_overlap(splitter):
+    text = make_text()
+    chunks = splitter.split_text(text)
+    for i in range(1, 8):
+        starting = [chunk for chunk in chunks if chunk.startswith(f"# Heading {i}")]
+        assert len(starting) == 1
+        previous = chunks[chunks.index(starting[0]) - 1]
+        assert f"Heading {i}" not in previous
+
+
+def test_oversized_words_are_cut_between_thai_clusters():
+    splitter = TokenTextSplitter(CharCounter(), chunk_size=8, chunk_overlap=2)
+    word = "กำลังเรียนรู้ภาษาที่ยากมากๆ" * 3
+    pieces = splitter._split_characters(word)
+    assert "".join(pieces) == word
+    assert all(not _THAI_NO_CUT_BEFORE.match(piece) for piece in pieces[1:])
+
+
+def test_windowed_chunks_match_the_whole_text_and_keep_pages(splitter):
+    pages = [(page, section + "\n\n") for page, section in enumerate(make_sections(), start=1)]
+    whole = "".join(section for _, section in pages)
+
+    windowed = list(iter_chunks(pages, splitter, window_size=300))
+    assert [chunk for chunk, _ in windowed] == splitter.split_text(whole)
+    for chunk, page in windowed:
+        if chunk.startswith("# Heading "):
+            assert page == int(chunk.split()[2]) + 1
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TokenTextSplitter(CharCounter(), chunk_size=50, chunk_overlap=50)
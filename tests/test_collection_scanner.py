@@ -0,0 +1,81 @@
+import pytest
+
+from collection_scanner import delete_filenames, delete_orphans, delete_where, filename_hash, find_orphans
+from document_registry import DocumentRegistry
+from local_vector_index import LocalCollection
+
+
+def chunk_metadata(filename, **extra):
+    return {"source_filename": filename, "_filename_hash": filename_hash(filename), **extra}
+
+
+@pytest.fixture
+def collection(tmp_path):
+    collection = LocalCollection(str(tmp_path / "index"), "scanner_test")
+    yield collection
+    collection.close()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "registry.sqlite3"))
+    registry.upsert("kept.pdf", filename_hash("kept.pdf"), chunk_count=5)
+    return registry
+
+
+def add_chunks(collection, ids, metadatas):
+    collection.add(ids=ids, embeddings=[[float(i), 1.0] for i in range(len(ids))], metadatas=metadatas,
+                   documents=[f"chunk {chunk_id}" for chunk_id in ids])
+
+
+def test_orphans_found_and_deleted_page_by_page(collection, registry):
+    # Kept and orphaned chunks interleave, so deletes happen in the middle of pages
+    ids, metadatas, orphans = [], [], set()
+    for i in range(23):
+        ids.append(f"c{i:02d}")
+        if i % 4 == 0:
+            metadatas.append(chunk_metadata("kept.pdf"))
+        elif i % 4 == 1:
+            metadatas.append({"document_type": "general"})
+            orphans.add(ids[-1])
+        elif i % 4 == 2:
+            metadatas.append({"source_filename": "renamed.pdf", "_filename_hash": filename_hash("old.pdf")})
+            orphans.add(ids[-1])
+        else:
+            metadatas.append(chunk_metadata("unregistered.pdf"))
+            orphans.add(ids[-1])
+    add_chunks(collection, ids, metadatas)
+
+    found = list(find_orphans(collection, registry, batch_size=5))
+    assert {chunk_id for chunk_id, _, _ in found} == orphans
+    assert {reason for _, _, reason in found} == {"no source_filename", "filename hash mismatch", "file not in registry"}
+    # Without a registry, unregistered files are not orphans
+    assert len(list(find_orphans(collection, batch_size=5))) == len(orphans) - 5
+
+    sources = set()
+    assert delete_orphans(collection, registry, batch_size=5, sources=sources) == len(orphans)
+    assert sources == {"renamed.pdf", "unregistered.pdf"}
+    assert sorted(collection.get(include=[])["ids"]) == [chunk_id for chunk_id in ids if chunk_id not in orphans]
+    assert list(find_orphans(collection, registry, batch_size=5)) == []
+
+
+def test_registry_existing_looks_up_in_batches(registry):
+    names = [f"missing-{i}.pdf" for i in range(1200)] + ["kept.pdf"]
+    assert registry.existing(names) == {"kept.pdf"}
+    assert registry.existing([]) == set()
+
+
+def test_delete_where_and_by_filename(collection, registry):
+    add_chunks(collection, [f"a{i}" for i in range(7)], [chunk_metadata("kept.pdf", page_number=i) for i in range(7)])
+    add_chunks(collection, [f"b{i}" for i in range(4)], [chunk_metadata("other.pdf") for _ in range(4)])
+
+    where = {"page_number": {"$in": [3, 4, 5, 6]}}
+    assert delete_where(collection, where, batch_size=2, dry_run=True) == 4
+    sources = set()
+    assert delete_where(collection, where, batch_size=2, sources=sources) == 4
+    assert sources == {"kept.pdf"}
+    assert collection.count() == 7
+
+    assert delete_filenames(collection, ["kept.pdf"], registry=registry, batch_size=2) == {"kept.pdf": 3}
+    assert registry.get("kept.pdf") is None
+    assert sorted(collection.get(include=[])["ids"]) == [f"b{i}" for i in range(4)]
@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import collection_snapshot
+from collection_snapshot import MANIFEST_FILE, export_collection, import_collection, load_snapshot
+from local_vector_index import LocalCollection
+
+COUNT = 23
+
+
+@pytest.fixture
+def source(tmp_path):
+    collection = LocalCollection(str(tmp_path / "source"), "source", snapshot_every=0)
+    vectors = np.random.default_rng(3).normal(size=(COUNT, 8)).astype(np.float32)
+    collection.add(
+        ids=[f"c{i:02d}" for i in range(COUNT)],
+        embeddings=vectors.tolist(),
+        metadatas=[{"source_filename": f"คู่มือ{i % 4}.pdf", "page_number": i} for i in range(COUNT)],
+        documents=[f"เนื้อหาส่วนที่ {i}" for i in range(COUNT)],
+    )
+    yield collection
+    collection.close()
+
+
+def read_all(collection):
+    result = collection.get(include=["documents", "metadatas", "embeddings"])
+    order = np.argsort(result["ids"])
+    return ([result["ids"][i] for i in order], [result["documents"][i] for i in order],
+            [result["metadatas"][i] for i in order], np.asarray(result["embeddings"])[order])
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 0), ("float16", 1e-2)])
+def test_export_import_round_trip(source, tmp_path, dtype, tolerance):
+    directory = str(tmp_path / "export")
+    manifest = export_collection(source, directory, dtype=dtype, batch_size=5, collection_name="source")
+    assert (manifest["count"], manifest["dimension"], manifest["dtype"]) == (COUNT, 8, dtype)
+    _, embeddings = load_snapshot(directory)
+    assert embeddings.shape == (COUNT, 8)
+
+    target = LocalCollection(str(tmp_path / "target"), "target", snapshot_every=0)
+    assert import_collection(target, directory, batch_size=4, workers=3) == COUNT
+
+    ids, documents, metadatas, vectors = read_all(target)
+    expected = read_all(source)
+    assert (ids, documents, metadatas) == expected[:3]
+    assert np.allclose(vectors, expected[3], atol=tolerance, rtol=0)
+    # Importing again with upsert leaves the collection as it was
+    assert import_collection(target, directory, batch_size=7, upsert=True) == COUNT
+    assert target.count() == COUNT
+    target.close()
+
+
+def test_import_refuses_incomplete_or_foreign_snapshots(source, tmp_path, monkeypatch, capsys):
+    directory = str(tmp_path / "export")
+    export_collection(source, directory, batch_size=10, collection_name="source")
+    monkeypatch.setattr(collection_snapshot, "open_target", lambda name: pytest.fail("target opened"))
+
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest["embedding_model"] = "another-model"
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+    assert collection_snapshot.main(["import", directory]) == 2
+    assert "another-model" in capsys.readouterr().out
+
+    os.remove(os.path.join(directory, MANIFEST_FILE))
+    assert collection_snapshot.main(["import", directory]) == 2
+    assert "not a complete snapshot" in capsys.readouterr().out
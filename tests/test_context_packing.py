@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+
+from context_packing import ContextPacker, merge_adjacent, order_passages, remove_overlap
+
+# The tokenizer cannot load here, so tokens are estimated as 4 UTF-8 bytes each
+OFFLINE_TOKENIZER = "no-such-tokenizer-for-tests"
+
+
+def chunk(text, source=None, chunk_id=None):
+    metadata = {}
+    if source is not None:
+        metadata = {"source_filename": source, "chunk_id": chunk_id}
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_adjacent_chunks_merge_without_their_shared_overlap():
+    shared = "ข้อความที่ซ้ำกันระหว่างสอง chunk"
+    docs = [
+        chunk(shared + " ต่อจากนั้น", "คู่มือ.pdf", 2),
+        chunk("loose passage"),
+        chunk("บทนำ ... " + shared, "คู่มือ.pdf", 1),
+        chunk(shared + " ต่อจากนั้น", "คู่มือ.pdf", 2),
+        chunk("ภาคผนวก", "คู่มือ.pdf", 4),
+        chunk("other file", "other.pdf", 3),
+    ]
+    passages = merge_adjacent(docs, max_overlap=400)
+
+    # One passage per run of chunk_ids in a file, ranked by the best chunk in it; chunks without a position last
+    assert passages == [
+        (5, "other file"),
+        (0, "บทนำ ... " + shared + " ต่อจากนั้น"),
+        (4, "ภาคผนวก"),
+        (1, "loose passage"),
+    ]
+
+
+def test_short_overlaps_are_not_treated_as_splitter_overlap():
+    assert remove_overlap("x" * 50 + "abcdef", "abcdef and more", max_overlap=400) is None
+    shared = "abcdefghijklmnopqrstuvwxy"
+    assert remove_overlap("x" * 30 + shared, shared + " rest", max_overlap=400) == " rest"
+    # The splitter never overlaps by more than max_overlap, so longer matches are not looked for
+    assert remove_overlap("x" * 30 + shared, shared + " rest", max_overlap=22) is None
+    docs = [chunk("end of one", "a.pdf", 1), chunk("one more", "a.pdf", 2)]
+    assert merge_adjacent(docs, max_overlap=400) == [(0, "end of one\none more")]
+
+
+def test_passages_are_admitted_by_relevance_until_the_budget_runs_out():
+    # Each chunk is 100 tokens; after two of them only 80 are left, enough for one truncated passage
+    docs = [chunk(letter * 400, f"{letter}.pdf", 0) for letter in "abcd"]
+    packer = ContextPacker(OFFLINE_TOKENIZER, token_budget=280, order="relevance")
+    context, stats = packer.pack(docs)
+
+    assert context.split("\n\n") == ["a" * 400, "b" * 400, "c" * 320]
+    assert stats == {"chunks": 4, "passages": 4, "packed_passages": 3, "truncated_passages": 1, "context_tokens": 280}
+    # Less than 64 tokens of room is not worth a partial passage
+    assert ContextPacker(OFFLINE_TOKENIZER, token_budget=250).pack(docs)[1]["packed_passages"] == 2
+
+
+def test_edges_order_puts_the_best_passages_first_and_last():
+    passages = [(rank, f"p{rank}") for rank in (3, 0, 4, 1, 2)]
+    assert order_passages(passages, "relevance") == ["p0", "p1", "p2", "p3", "p4"]
+    assert order_passages(passages, "edges") == ["p0", "p2", "p4", "p3", "p1"]
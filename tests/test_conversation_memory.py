@@ -0,0 +1,59 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversation_memory import SessionTaskQueue
+
+
+def wait_idle(queue, timeout=10):
+    deadline = time.time() + timeout
+    while queue.stats()["pending"]:
+        assert time.time() < deadline, queue.stats()
+        time.sleep(0.01)
+
+
+def test_tasks_of_one_session_run_in_order_and_sessions_in_parallel():
+    executor = ThreadPoolExecutor(max_workers=4)
+    queue = SessionTaskQueue(executor)
+    order = {"a": [], "b": []}
+    running = {"a": 0, "b": 0}
+    overlapped = threading.Event()
+    lock = threading.Lock()
+
+    def summarize(session_id, turn):
+        with lock:
+            running[session_id] += 1
+            assert running[session_id] == 1, (session_id, turn)
+            if running["a"] and running["b"]:
+                overlapped.set()
+        time.sleep(0.02)
+        with lock:
+            order[session_id].append(turn)
+            running[session_id] -= 1
+
+    for turn in range(5):
+        queue.submit("a", summarize, "a", turn)
+        queue.submit("b", summarize, "b", turn)
+    wait_idle(queue)
+
+    assert order == {"a": list(range(5)), "b": list(range(5))}
+    assert overlapped.is_set()
+    assert queue.stats() == {"pending": 0, "sessions_pending": 0, "completed": 10, "failed": 0}
+    executor.shutdown()
+
+
+def test_failed_task_does_not_stop_the_session_queue():
+    executor = ThreadPoolExecutor(max_workers=1)
+    queue = SessionTaskQueue(executor)
+    done = []
+
+    def fail():
+        raise RuntimeError("ollama down")
+
+    queue.submit("a", fail)
+    queue.submit("a", done.append, "next turn")
+    wait_idle(queue)
+
+    assert done == ["next turn"]
+    assert (queue.stats()["completed"], queue.stats()["failed"]) == (1, 1)
+    executor.shutdown()
@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app as rag_app
+from document_registry import DocumentRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+    for i in range(25):
+        registry.upsert(f"doc_{i:02d}.pdf", f"hash{i}", chunk_count=i + 1)
+    registry.upsert("report_50%.txt", "hashr", chunk_count=3)
+    return registry
+
+
+def page_through(registry, limit, search=None):
+    names, after = [], None
+    while True:
+        documents, _ = registry.list(after=after, limit=limit, search=search)
+        names.extend(document["filename"] for document in documents)
+        if len(documents) < limit:
+            return names
+        after = documents[-1]["filename"]
+
+
+def test_keyset_pages_cover_every_document_once(registry):
+    assert page_through(registry, 7) == sorted([f"doc_{i:02d}.pdf" for i in range(25)] + ["report_50%.txt"])
+    assert page_through(registry, 5, search="doc_1") == [f"doc_1{i}.pdf" for i in range(10)]
+    assert page_through(registry, 5, search="50%") == ["report_50%.txt"]
+
+
+def test_pages_stay_consistent_when_earlier_rows_are_deleted(registry):
+    first, _ = registry.list(limit=10)
+    registry.delete("doc_00.pdf")
+    second, _ = registry.list(after=first[-1]["filename"], limit=10)
+    assert second[0]["filename"] == "doc_10.pdf"
+
+
+def test_total_is_optional_and_cached_per_version(registry):
+    documents, total = registry.list(limit=3)
+    assert total is None
+    assert registry.list(limit=3, with_total=True)[1] == 26
+    assert registry.list(limit=3, search="doc_2", with_total=True)[1] == 5
+
+    # A cached count is answered without touching the documents table
+    registry._counts[""] = -1
+    assert registry.count() == -1
+    registry.delete("doc_24.pdf")
+    assert registry.count() == 25
+    assert registry.count("doc_2") == 4
+
+
+def test_documents_endpoint_pages_by_cursor(registry, monkeypatch):
+    monkeypatch.setattr(rag_app, "document_registry", registry)
+
+    async def fetch_all():
+        pages = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=rag_app.app), base_url="http://test") as client:
+            params = {"limit": 10}
+            while True:
+                response = await client.get("/documents", params=params)
+                assert response.status_code == 200, response.text
+                page = response.json()
+                pages.append(page)
+                if page["next_after"] is None:
+                    break
+                params["after"] = page["next_after"]
+            cached = await client.get("/documents", params=params, headers={"If-None-Match": response.headers["etag"]})
+            files = await client.get("/files_list", params={"after": "doc_20.pdf", "limit": 3})
+        return pages, cached, files
+
+    pages, cached, files = asyncio.run(fetch_all())
+    assert [len(page["items"]) for page in pages] == [10, 10, 6]
+    assert all(page["total"] == 26 for page in pages)
+    assert cached.status_code == 304
+    assert files.json() == ["doc_21.pdf", "doc_22.pdf", "doc_23.pdf"]
+    assert files.headers["x-total-count"] == "26"
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from embedding_pipeline import EmbeddingBatchError, EmbeddingPipeline
+
+
+class FlakyEmbedder:
+    # Fails the first `failures` calls for batches containing fail_on; tracks every batch sent and concurrency
+    def __init__(self, fail_on=None, failures=1, latency=0.01):
+        self.fail_on = fail_on
+        self.failures = failures
+        self.latency = latency
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.calls.append(list(batch))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            fail = self.fail_on in batch and self.failures > 0
+            if fail:
+                self.failures -= 1
+        time.sleep(self.latency)
+        with self._lock:
+            self.running -= 1
+        if fail:
+            raise ConnectionError("ollama reset the connection")
+        return [[float(item), 1.0] for item in batch]
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = EmbeddingPipeline(batch_size=3, concurrency=2, max_retries=2, retry_backoff=0.0)
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_failed_batch_is_retried_alone(pipeline):
+    embedder = FlakyEmbedder(fail_on=4)
+    received = {}
+
+    def sink(batch, vectors):
+        assert tuple(batch) not in received
+        received[tuple(batch)] = vectors
+
+    stats = pipeline.run(range(10), embedder, sink)
+
+    assert sorted(received) == [(0, 1, 2), (3, 4, 5), (6, 7, 8), (9,)]
+    assert received[(3, 4, 5)] == [[3.0, 1.0], [4.0, 1.0], [5.0, 1.0]]
+    # Only the batch that failed is sent twice
+    assert sorted(embedder.calls) == [[0, 1, 2], [3, 4, 5], [3, 4, 5], [6, 7, 8], [9]]
+    assert (stats["chunks"], stats["batches"], stats["retries"]) == (10, 4, 1)
+    assert embedder.max_running <= 2
+
+
+def test_batch_failing_every_attempt_stops_the_run(pipeline):
+    embedder = FlakyEmbedder(fail_on=0, failures=10)
+    received = []
+
+    with pytest.raises(EmbeddingBatchError, match="after 3 attempts"):
+        pipeline.run(range(10), embedder, lambda batch, vectors: received.append(batch))
+
+    assert [0, 1, 2] not in received
+    assert embedder.calls.count([0, 1, 2]) == 3
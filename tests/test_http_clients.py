@@ -0,0 +1,65 @@
+import shutil
+import socket
+import subprocess
+import time
+
+import httpx
+import pytest
+
+from http_clients import CircuitBreaker, CircuitOpenError, make_chroma_client
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def chroma_port(tmp_path_factory):
+    if shutil.which("chroma") is None:
+        pytest.skip("chroma CLI not installed")
+    port = free_port()
+    process = subprocess.Popen(
+        ["chroma", "run", "--path", str(tmp_path_factory.mktemp("chroma")), "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/api/v2/heartbeat", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            assert time.time() < deadline and process.poll() is None, "chroma run did not start"
+            time.sleep(0.2)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(20)
+
+
+def test_chroma_client_gets_timeouts_and_pool_size(chroma_port):
+    # Fails when a chromadb upgrade moves the HTTP session that make_chroma_client configures
+    client = make_chroma_client("127.0.0.1", chroma_port, pool_size=4, connect_timeout=1.5, read_timeout=7)
+    assert client._server._session.timeout == httpx.Timeout(7, connect=1.5)
+    assert client.get_settings().chroma_http_max_connections == 4
+    collection = client.get_or_create_collection("timeout_test")
+    collection.add(ids=["a"], embeddings=[[0.1, 0.2]], documents=["x"])
+    assert collection.count() == 1
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.1)
+    for _ in range(2):
+        with pytest.raises(ConnectionError), breaker.guard():
+            raise ConnectionError("down")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError), breaker.guard():
+        pass
+    time.sleep(0.15)
+    # One trial call after reset_timeout; its success closes the circuit
+    with breaker.guard():
+        pass
+    assert breaker.state == "closed"
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import threading
+
+import httpx
+import pytest
+
+import app as rag_app
+from document_registry import DocumentRegistry
+from embedding_cache import EmbeddingCache, chunk_hash, embed_with_cache
+from ingest_jobs import IngestError, IngestJob, IngestJobManager
+from lexical_index import LexicalIndex
+
+FILENAME = "ระเบียบ.txt"
+PARAGRAPHS = [f"หัวข้อที่ {i}: " + " ".join(f"word{i}_{j}" for j in range(120)) for i in range(6)]
+
+
+def matches(metadata, where):
+    return all(metadata.get(key) == (condition["$eq"] if isinstance(condition, dict) else condition)
+               for key, condition in (where or {}).items())
+
+
+class MemoryCollection:
+    # The parts of the Collection API run_ingest_job uses; update() can be made to fail after the new
+    # chunks went in, when unchanged chunks get their metadata updated
+    def __init__(self):
+        self.rows = {}
+        self.fail_update = False
+
+    def get(self, ids=None, where=None, include=()):
+        selected = [chunk_id for chunk_id, (_, metadata) in self.rows.items()
+                    if (ids is None or chunk_id in ids) and matches(metadata, where)]
+        return {"ids": selected, "documents": [self.rows[chunk_id][0] for chunk_id in selected]}
+
+    def add(self, ids, embeddings, metadatas=None, documents=None):
+        for chunk_id, metadata, document in zip(ids, metadatas, documents):
+            assert chunk_id not in self.rows, chunk_id
+            self.rows[chunk_id] = (document, metadata)
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        if self.fail_update:
+            raise RuntimeError("connection reset")
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.rows[chunk_id] = (self.rows[chunk_id][0], metadata)
+
+    def delete(self, ids=None, where=None):
+        for chunk_id in ids if ids is not None else self.get(where=where)["ids"]:
+            self.rows.pop(chunk_id, None)
+
+    def count(self):
+        return len(self.rows)
+
+
+def fake_embed(texts, text_hashes):
+    return [[float(len(text)), float(int(h[:8], 16) % 97), 1.0] for text, h in zip(texts, text_hashes)], len(texts)
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    collection = MemoryCollection()
+    monkeypatch.setattr(rag_app, "collection", collection)
+    monkeypatch.setattr(rag_app, "lexical_index", LexicalIndex())
+    monkeypatch.setattr(rag_app, "document_registry", DocumentRegistry(str(tmp_path / "registry.sqlite3")))
+    monkeypatch.setattr(rag_app, "answer_cache", None)
+    monkeypatch.setattr(rag_app, "embed_documents_cached", fake_embed)
+
+    def run(paragraphs):
+        content = "\n\n".join(paragraphs).encode("utf-8")
+        file_path = tmp_path / "upload.tmp"
+        file_path.write_bytes(content)
+        metadata = {"source_filename": FILENAME, "_filename_hash": hashlib.sha256(FILENAME.encode("utf-8")).hexdigest()}
+        file_info = {"content_hash": hashlib.sha256(content).hexdigest(), "byte_size": len(content)}
+        return rag_app.run_ingest_job(IngestJob(FILENAME), str(file_path), FILENAME, metadata, file_info)
+
+    return collection, run
+
+
+def test_failed_reingest_rolls_back_added_chunks(ingest):
+    collection, run = ingest
+    first = run(PARAGRAPHS)
+    assert first["chunks_added"] == first["chunks_total"] > 2
+    before = dict(collection.rows)
+    lexical_before = rag_app.lexical_index.count()
+
+    # Half the document changes: its new chunks are added, then the update of the unchanged ones fails
+    collection.fail_update = True
+    with pytest.raises(IngestError):
+        run(PARAGRAPHS[:3] + [paragraph.replace("word", "changed") for paragraph in PARAGRAPHS[3:]])
+
+    assert collection.rows == before
+    assert rag_app.lexical_index.count() == lexical_before
+    assert rag_app.document_registry.get(FILENAME)["chunk_count"] == first["chunks_total"]
+
+
+def test_reingest_keeps_unchanged_chunks_and_removes_stale_ones(ingest):
+    collection, run = ingest
+    first = run(PARAGRAPHS)
+    second = run(PARAGRAPHS[:4])
+    assert second["chunks_added"] == 0
+    assert second["chunks_embedded"] == 0
+    assert second["chunks_deleted"] == first["chunks_total"] - second["chunks_total"] > 0
+    assert collection.count() == second["chunks_total"]
+    assert rag_app.lexical_index.count() == second["chunks_total"]
+    assert rag_app.document_registry.get(FILENAME)["chunk_count"] == second["chunks_total"]
+
+
+def test_delete_waits_for_a_running_ingest_of_the_same_file(ingest, monkeypatch):
+    collection, run = ingest
+    manager = IngestJobManager(max_workers=2)
+    monkeypatch.setattr(rag_app, "ingest_jobs", manager)
+    parsing, release = threading.Event(), threading.Event()
+
+    def slow_ingest(job):
+        parsing.set()
+        assert release.wait(10)
+        return run(PARAGRAPHS)
+
+    async def ingest_then_delete():
+        ingest_job = manager.submit(FILENAME, slow_ingest)
+        assert await asyncio.to_thread(parsing.wait, 10)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=rag_app.app), base_url="http://test") as client:
+            delete = asyncio.create_task(client.request("DELETE", "/delete_document", json={"filename": FILENAME}))
+            await asyncio.sleep(0.2)
+            # The delete is queued behind the ingest instead of running before its chunks are added
+            assert not delete.done()
+            release.set()
+            return ingest_job, await delete
+
+    ingest_job, response = asyncio.run(ingest_then_delete())
+    assert response.status_code == 200, response.text
+    assert response.json()["chunks_deleted"] == ingest_job.result["chunks_total"] > 0
+    assert collection.count() == 0
+    assert rag_app.lexical_index.count() == 0
+    assert rag_app.document_registry.get(FILENAME) is None
+    manager.shutdown()
+
+
+def test_reingest_embeds_only_the_changed_chunk(ingest, monkeypatch):
+    collection, run = ingest
+    embedded = []
+
+    def recording_embed(texts, text_hashes):
+        embedded.extend(texts)
+        return fake_embed(texts, text_hashes)
+
+    monkeypatch.setattr(rag_app, "embed_documents_cached", recording_embed)
+    first = run(PARAGRAPHS)
+    before = {document for document, _ in collection.rows.values()}
+    embedded.clear()
+
+    changed = PARAGRAPHS[:3] + [PARAGRAPHS[3].replace("word3_60", "แก้ไข")] + PARAGRAPHS[4:]
+    second = run(changed)
+    after = {document for document, _ in collection.rows.values()}
+
+    # Only chunks whose text changed are embedded and added; their old versions are deleted
+    assert set(embedded) == after - before
+    assert len(embedded) == second["chunks_added"] == second["chunks_deleted"] == second["chunks_embedded"] == 1
+    assert "แก้ไข" in embedded[0]
+    [stale] = before - after
+    assert "word3_60" in stale
+    assert second["chunks_unchanged"] == first["chunks_total"] - 1
+    assert collection.count() == second["chunks_total"] == first["chunks_total"]
+    content_hash = hashlib.sha256("\n\n".join(changed).encode("utf-8")).hexdigest()
+    assert rag_app.document_registry.get(FILENAME)["content_hash"] == content_hash
+
+
+def test_reuploaded_file_is_embedded_from_the_cache(ingest, tmp_path, monkeypatch):
+    collection, run = ingest
+    embedded = []
+
+    class Embeddings:
+        def embed_documents(self, texts):
+            embedded.extend(texts)
+            return fake_embed(texts, [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts])[0]
+
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    monkeypatch.setattr(rag_app, "embed_documents_cached",
+                        lambda texts, text_hashes: embed_with_cache(Embeddings(), cache, "model-a", texts, text_hashes))
+    first = run(PARAGRAPHS)
+    ids = sorted(collection.rows)
+    assert first["chunks_embedded"] == len(embedded) == cache.count("model-a") == first["chunks_total"]
+
+    # Deleted and uploaded again: chunk IDs come from the text, and every vector from the cache
+    rag_app.run_delete_job(IngestJob(FILENAME), FILENAME)
+    assert collection.count() == 0
+    second = run(PARAGRAPHS)
+    assert (second["chunks_added"], second["chunks_embedded"]) == (first["chunks_total"], 0)
+    assert sorted(collection.rows) == ids
+    assert len(embedded) == first["chunks_total"]
+    # Vectors are cached per embedding model
+    text = collection.rows[ids[0]][0]
+    assert embed_with_cache(Embeddings(), cache, "model-b", [text], [chunk_hash(text)])[1] == 1
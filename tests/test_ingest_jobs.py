@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+import ingest_jobs
+from ingest_jobs import IngestJobManager, SQLiteJobStore
+from shared_state import LeaseStore
+
+
+def wait_finished(manager, *jobs, timeout=10):
+    deadline = time.time() + timeout
+    while any(job.finished_at is None for job in jobs):
+        assert time.time() < deadline, [job.to_dict() for job in jobs]
+        time.sleep(0.01)
+
+
+class BrokenLeases:
+    # holder() fails the way SQLite does when another process keeps the database locked
+    def holder(self, name):
+        raise RuntimeError("database is locked")
+
+    def hold(self, name, ttl_seconds=3600, poll_interval=0.5):
+        raise AssertionError("not reached")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.sqlite3")
+
+
+def test_jobs_for_one_filename_run_in_order():
+    manager = IngestJobManager(max_workers=4)
+    running = []
+    order = []
+
+    def ingest(job, label):
+        running.append(label)
+        assert len(running) == 1, running
+        time.sleep(0.05)
+        order.append(label)
+        running.remove(label)
+        return label
+
+    jobs = [manager.submit("a.pdf", ingest, i) for i in range(3)]
+    wait_finished(manager, *jobs)
+    assert order == [0, 1, 2]
+    assert [job.status for job in jobs] == ["done"] * 3
+    manager.shutdown()
+
+
+def test_failed_job_does_not_block_the_next_one():
+    manager = IngestJobManager(max_workers=1)
+
+    def fail(job):
+        raise ValueError("อ่านไฟล์ไม่ได้")
+
+    first = manager.submit("a.pdf", fail)
+    second = manager.submit("a.pdf", lambda job: "ok")
+    wait_finished(manager, first, second)
+    assert (first.status, first.error) == ("failed", "อ่านไฟล์ไม่ได้")
+    assert (second.status, second.result) == ("done", "ok")
+    manager.shutdown()
+
+
+def test_lease_error_fails_the_job_and_starts_the_next(db_path):
+    store = SQLiteJobStore(db_path)
+    manager = IngestJobManager(max_workers=1, store=store, leases=BrokenLeases())
+    first = manager.submit("a.pdf", lambda job: "never")
+    second = manager.submit("a.pdf", lambda job: "never")
+    wait_finished(manager, first, second)
+    for job in (first, second):
+        assert job.status == "failed"
+        assert "database is locked" in job.error
+        # The final state reached the store, so other workers do not report the job as still queued
+        assert store.get(job.id)["status"] == "failed"
+    assert manager._pending_by_filename == {}
+    manager.shutdown()
+
+
+def test_filename_lease_is_renewed_while_the_job_runs(db_path, monkeypatch):
+    monkeypatch.setattr(ingest_jobs, "INGEST_LEASE_SECONDS", 1)
+    manager = IngestJobManager(max_workers=1, leases=LeaseStore(db_path), flush_interval=0.1)
+    other_worker = LeaseStore(db_path)
+    started = threading.Event()
+    release = threading.Event()
+    job = manager.submit("a.pdf", lambda job: started.set() or release.wait(10))
+    assert started.wait(5)
+
+    deadline = time.time() + 3
+    while time.time() < deadline:
+        # Well past the TTL, the lease is still held by the running job
+        assert not other_worker.acquire("ingest:a.pdf", 60)
+        time.sleep(0.1)
+    release.set()
+    wait_finished(manager, job)
+    assert job.status == "done"
+    assert other_worker.acquire("ingest:a.pdf", 60)
+    manager.shutdown()
+
+
+def test_jobs_are_visible_from_another_worker(db_path):
+    manager = IngestJobManager(max_workers=1, store=SQLiteJobStore(db_path), flush_interval=0.1)
+    other_worker = IngestJobManager(max_workers=1, store=SQLiteJobStore(db_path))
+    job = manager.submit("a.pdf", lambda job: {"chunks": 3})
+    wait_finished(manager, job)
+    stored = other_worker.get(job.id).to_dict()
+    assert (stored["status"], stored["result"]) == ("done", {"chunks": 3})
+    assert [data["job_id"] for data in other_worker.list()] == [job.id]
+    manager.shutdown()
+    other_worker.shutdown()
+
+
+def test_unfinished_job_of_a_dead_worker_is_reported_failed(db_path):
+    store = SQLiteJobStore(db_path, stale_after=0)
+    job = ingest_jobs.IngestJob("a.pdf")
+    store.save([job])
+    time.sleep(0.01)
+    assert store.get(job.id)["status"] == "failed"
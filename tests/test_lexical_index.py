@@ -0,0 +1,153 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+
+import httpx
+
+import app as rag_app
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from shared_state import ChangeFeed, ChangeFollower
+
+CHUNKS = {
+    "c1": ("แบบฟอร์ม ภ.ง.ด.90 สำหรับยื่นภาษี", {"source_filename": "tax.pdf", "document_type": "form"}),
+    "c2": ("ขมิ้นชันช่วยบรรเทาอาการท้องอืด", {"source_filename": "herbs.pdf", "document_type": "herb"}),
+    "c3": ("policy code HR-204 covers remote work", {"source_filename": "hr.pdf", "document_type": "policy"}),
+    "c4": ("ฟ้าทะลายโจรใช้ลดไข้ ขมิ้นชันใช้ทาแผล", {"source_filename": "herbs.pdf", "document_type": "herb"}),
+}
+
+
+def build_index(ids=None):
+    index = LexicalIndex()
+    ids = ids or list(CHUNKS)
+    index.add(ids, [CHUNKS[chunk_id][0] for chunk_id in ids], [CHUNKS[chunk_id][1] for chunk_id in ids])
+    return index
+
+
+def search_ids(index, query, filters=None):
+    return [chunk_id for chunk_id, _, _ in index.search(query, 10, filters)]
+
+
+def test_exact_terms_and_filters():
+    index = build_index()
+    assert search_ids(index, "HR-204") == ["c3"]
+    assert set(search_ids(index, "ขมิ้นชัน")) == {"c2", "c4"}
+    assert search_ids(index, "ขมิ้นชัน", {"document_type": "form"}) == []
+    assert index.remove_source("herbs.pdf") == 2
+    assert search_ids(index, "ขมิ้นชัน") == []
+    assert index.postings.keys() == {term for chunk_id in ("c1", "c3") for term in tokenize(CHUNKS[chunk_id][0])}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "lexical.jsonl.gz")
+    index = build_index()
+    assert index.save(path, seq=7) == 4
+
+    loaded = LexicalIndex()
+    assert loaded.load(path) == 7
+    assert loaded.ready
+    # Each chunk's distinct terms come back in another order
+    assert {chunk_id: (metadata, length, set(terms)) for chunk_id, (metadata, length, terms) in loaded.chunks.items()} == \
+           {chunk_id: (metadata, length, set(terms)) for chunk_id, (metadata, length, terms) in index.chunks.items()}
+    assert loaded.postings == index.postings
+    assert loaded.total_length == index.total_length
+    for query in ("HR-204", "ขมิ้นชัน", "ภาษี"):
+        assert loaded.search(query, 10) == index.search(query, 10)
+    # Removing after a load leaves nothing behind
+    loaded.remove(list(CHUNKS))
+    assert (loaded.chunks, loaded.postings, loaded.total_length) == ({}, {}, 0)
+
+
+def test_load_keeps_chunks_added_meanwhile(tmp_path):
+    path = str(tmp_path / "lexical.jsonl.gz")
+    build_index(["c1", "c2"]).save(path)
+    index = build_index(["c3"])
+    # c2 is also added locally, with other text: the local copy wins over the saved one
+    index.add(["c2"], ["policy HR-204 appendix"], [{"source_filename": "hr.pdf"}])
+    assert index.load(path) == 0
+    assert set(index.chunks) == {"c1", "c2", "c3"}
+    assert set(search_ids(index, "HR-204")) == {"c2", "c3"}
+    assert search_ids(index, "ขมิ้นชัน") == []
+    assert index.total_length == sum(length for _, length, _ in index.chunks.values())
+
+
+def test_load_rejects_stale_or_incompatible_files(tmp_path, monkeypatch):
+    path = str(tmp_path / "lexical.jsonl.gz")
+    assert LexicalIndex().load(path) is None
+    build_index().save(path, seq=3)
+    assert LexicalIndex().load(path, max_age=3600) == 3
+    assert LexicalIndex().load(path, max_age=-1) is None
+
+    # Built with the other Thai tokenizer: its terms would not match this process's queries
+    with gzip.open(path, "rt", encoding="utf-8") as index_file:
+        lines = index_file.readlines()
+    header = json.loads(lines[0])
+    header["thai_tokenizer"] = "something-else"
+    with gzip.open(path, "wt", encoding="utf-8") as index_file:
+        index_file.writelines([json.dumps(header) + "\n", *lines[1:]])
+    assert LexicalIndex().load(path) is None
+
+
+def test_follower_replays_changes_after_rewind(tmp_path):
+    feed = ChangeFeed(str(tmp_path / "state.sqlite3"))
+    applied = []
+    follower = ChangeFollower(feed, applied.append)
+    saved_at = feed.latest()
+    follower.record("upsert", "own.pdf")
+    feed.append("delete", "other.pdf")
+    assert follower.poll(wait=True) == 1
+    assert [[source for _, _, source in changes] for changes in applied] == [["other.pdf"]]
+
+    # State saved at saved_at misses both changes, this process's own included
+    applied.clear()
+    follower.rewind(saved_at)
+    assert follower.poll(wait=True) == 2
+    assert [source for _, _, source in applied[0]] == ["own.pdf", "other.pdf"]
+
+
+def test_reciprocal_rank_fusion_prefers_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert fused[0][0] == "b"
+    assert {key for key, _ in fused} == {"a", "b", "c", "d"}
+
+
+class DeletingCollection:
+    def delete(self, ids=None, where=None):
+        return {"deleted": 2}
+
+
+def test_delete_does_not_block_the_event_loop_on_the_index_lock(monkeypatch):
+    # A rebuild or change-feed reload can hold the index lock for a long time; meanwhile the API keeps answering
+    index = build_index()
+    monkeypatch.setattr(rag_app, "lexical_index", index)
+    monkeypatch.setattr(rag_app, "collection", DeletingCollection())
+    monkeypatch.setattr(rag_app, "answer_cache", None)
+    monkeypatch.setattr(rag_app, "document_registry", None)
+    monkeypatch.setattr(rag_app, "collection_changes", None)
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with index._lock:
+            locked.set()
+            release.wait(5)
+
+    async def requests():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=rag_app.app), base_url="http://test") as client:
+            started = time.perf_counter()
+            delete = asyncio.create_task(client.request("DELETE", "/delete_document", json={"filename": "herbs.pdf"}))
+            await asyncio.sleep(0.1)
+            live = await client.get("/health/live")
+            elapsed = time.perf_counter() - started
+            release.set()
+            return live, elapsed, await delete
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    assert locked.wait(5)
+    live, elapsed, deleted = asyncio.run(requests())
+    holder.join()
+
+    assert live.status_code == 200 and elapsed < 1
+    assert deleted.json()["chunks_deleted"] == 2
+    assert index.search("ขมิ้นชัน", 5) == []
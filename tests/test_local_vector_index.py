@@ -0,0 +1,181 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from local_vector_index import WAL_FILE, LocalCollection, matches_where
+
+
+def vectors(n, dim=4, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32).tolist()
+
+
+def add_chunks(collection, n, start=0, seed=0):
+    ids = [f"c{i}" for i in range(start, start + n)]
+    collection.add(
+        ids=ids,
+        embeddings=vectors(n, seed=seed),
+        metadatas=[{"source_filename": f"f{i % 3}.txt", "chunk_id": i} for i in range(start, start + n)],
+        documents=[f"chunk {i}" for i in range(start, start + n)],
+    )
+    return ids
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "index")
+
+
+def test_query_matches_brute_force_l2(path):
+    collection = LocalCollection(path, "test", snapshot_every=0)
+    add_chunks(collection, 50)
+    stored = np.asarray(collection.get(include=["embeddings"])["embeddings"])
+    query = vectors(1, seed=7)[0]
+
+    result = collection.query(query_embeddings=[query], n_results=5, where={"source_filename": "f1.txt"})
+
+    rows = [i for i in range(50) if i % 3 == 1]
+    distances = ((stored[rows] - np.asarray(query)) ** 2).sum(axis=1)
+    expected = [f"c{rows[i]}" for i in np.argsort(distances)[:5]]
+    assert result["ids"][0] == expected
+    assert np.allclose(result["distances"][0], np.sort(distances)[:5], rtol=1e-4)
+    assert all(metadata["source_filename"] == "f1.txt" for metadata in result["metadatas"][0])
+    collection.close()
+
+
+def test_wal_is_replayed_after_a_crash(path):
+    collection = LocalCollection(path, "test", snapshot_every=0)
+    add_chunks(collection, 10)
+    collection.delete(ids=["c0", "c1"])
+    collection.update(ids=["c2"], metadatas=[{"source_filename": "moved.txt", "chunk_id": 2}])
+    collection.delete(where={"source_filename": "f2.txt"})
+    expected = collection.get(include=["metadatas", "documents", "embeddings"])
+    # No close(): the process dies with everything only in the write-ahead log, the last line torn
+    collection._wal.write('{"op": "upsert", "ids": ["torn"')
+    collection._wal.flush()
+
+    reopened = LocalCollection(path, "test", snapshot_every=0)
+    result = reopened.get(include=["metadatas", "documents", "embeddings"])
+    assert result["ids"] == expected["ids"]
+    assert result["metadatas"] == expected["metadatas"]
+    assert np.array_equal(result["embeddings"], expected["embeddings"])
+    assert reopened.get(where={"source_filename": "moved.txt"})["ids"] == ["c2"]
+    reopened.close()
+
+
+def test_snapshot_compacts_deleted_rows_and_truncates_the_log(path):
+    collection = LocalCollection(path, "test", snapshot_every=0)
+    add_chunks(collection, 20)
+    collection.delete(ids=[f"c{i}" for i in range(0, 20, 2)])
+    assert collection.stats()["deleted_slots"] == 10
+
+    assert collection.snapshot() == 10
+    assert collection.stats()["deleted_slots"] == 0
+    assert os.path.getsize(os.path.join(path, WAL_FILE)) == 0
+    add_chunks(collection, 5, start=20, seed=1)
+    collection.close()
+
+    reopened = LocalCollection(path, "test")
+    assert reopened.count() == 15
+    assert reopened.get(ids=["c1", "c24"])["documents"] == ["chunk 1", "chunk 24"]
+    reopened.close()
+
+
+def test_paging_keeps_its_order_across_deletes(path):
+    collection = LocalCollection(path, "test", snapshot_every=0)
+    ids = add_chunks(collection, 12)
+    first = collection.get(limit=4, offset=0, include=[])["ids"]
+    collection.delete(ids=first)
+    # Deleted rows leave tombstones, so the next page starts where the first one ended, minus the deletions
+    assert collection.get(limit=4, offset=0, include=[])["ids"] == ids[4:8]
+    collection.close()
+
+
+def test_upsert_replaces_rows_in_place(path):
+    collection = LocalCollection(path, "test", snapshot_every=0)
+    add_chunks(collection, 3)
+    collection.upsert(ids=["c1"], embeddings=[[1.0, 0.0, 0.0, 0.0]], metadatas=[{"source_filename": "new.txt"}],
+                      documents=["replaced"])
+    assert collection.count() == 3
+    result = collection.query(query_embeddings=[[1.0, 0.0, 0.0, 0.0]], n_results=1)
+    assert result["ids"][0] == ["c1"] and result["documents"][0] == ["replaced"]
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-6)
+    collection.close()
+
+
+def test_where_operators():
+    metadata = {"source_filename": "a.txt", "page_number": 3}
+    assert matches_where(metadata, {"source_filename": "a.txt"})
+    assert matches_where(metadata, {"page_number": {"$in": [1, 3]}})
+    assert not matches_where(metadata, {"source_filename": {"$ne": "a.txt"}})
+    assert matches_where(metadata, {"$and": [{"source_filename": "a.txt"}, {"page_number": {"$nin": [4]}}]})
+    assert not matches_where(metadata, {"$or": [{"source_filename": "b.txt"}, {"page_number": 4}]})
+
+
+def test_hnsw_snapshot_saves_the_live_graph(path):
+    pytest.importorskip("hnswlib")
+    collection = LocalCollection(path, "test", index_mode="hnsw", snapshot_every=0)
+    ids = add_chunks(collection, 200)
+    collection.delete(ids=ids[:10])
+    graph = collection._hnsw
+    query = vectors(1, seed=5)[0]
+    expected = collection.query(query_embeddings=[query], n_results=5)["ids"]
+
+    # Few deleted slots: rows keep their numbers and the graph is saved as it is, not rebuilt
+    collection.snapshot()
+    assert collection._hnsw is graph
+    assert collection.stats()["deleted_slots"] == 10
+    collection.close()
+
+    reopened = LocalCollection(path, "test", index_mode="hnsw")
+    assert reopened.count() == 190
+    assert reopened.query(query_embeddings=[query], n_results=5)["ids"] == expected
+    assert reopened.get(ids=ids[:10])["ids"] == []
+    reopened.close()
+
+
+def test_hnsw_compaction_builds_the_graph_outside_the_lock(path, monkeypatch):
+    hnswlib = pytest.importorskip("hnswlib")
+    import local_vector_index
+
+    collection = LocalCollection(path, "test", index_mode="hnsw", snapshot_every=0)
+    ids = add_chunks(collection, 100)
+    collection.delete(ids=ids[:50])
+    building, release = threading.Event(), threading.Event()
+    real_index = hnswlib.Index
+
+    class BlockingIndex:
+        # The compacted graph's build waits until the test has queried and written meanwhile
+        def __init__(self, *args, **kwargs):
+            self._index = real_index(*args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self._index, name)
+
+        def add_items(self, *args, **kwargs):
+            building.set()
+            assert release.wait(10)
+            return self._index.add_items(*args, **kwargs)
+
+    monkeypatch.setattr(local_vector_index.hnswlib, "Index", BlockingIndex)
+    snapshot = threading.Thread(target=collection.snapshot)
+    snapshot.start()
+    assert building.wait(10)
+    assert len(collection.query(query_embeddings=vectors(1, seed=5), n_results=3)["ids"][0]) == 3
+    add_chunks(collection, 5, start=100, seed=2)
+    collection.delete(ids=["c50"])
+    release.set()
+    snapshot.join(10)
+
+    assert collection.stats()["deleted_slots"] == 1
+    assert collection.count() == 54
+    assert collection.stats()["wal_operations"] == 2
+    monkeypatch.undo()
+    collection.close()
+
+    reopened = LocalCollection(path, "test", index_mode="hnsw")
+    assert sorted(reopened.get(include=[])["ids"]) == sorted(ids[51:] + [f"c{i}" for i in range(100, 105)])
+    result = reopened.query(query_embeddings=[vectors(5, seed=2)[4]], n_results=1)
+    assert result["ids"][0] == ["c104"]
+    reopened.close()
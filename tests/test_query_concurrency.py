@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import app as rag_app
+
+LATENCY = 0.3
+CONCURRENT_QUERIES = 8
+
+
+class SlowLLM(FakeListLLM):
+    # Stands in for Ollama: a fixed, blocking generation time
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(LATENCY)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+
+class SummarizerStub(FakeListChatModel):
+    # Short conversations are never summarized, and counting them must not load a tokenizer
+    def get_num_tokens_from_messages(self, messages, tools=None):
+        return 0
+
+
+def slow_retrieval(query, filters, top_k, query_embedding=None):
+    time.sleep(LATENCY)
+    return [Document(page_content=f"เนื้อหาเกี่ยวกับ {query}", metadata={"source_filename": "manual.pdf"})]
+
+
+@pytest.fixture
+def stubbed_app(monkeypatch):
+    monkeypatch.setattr(rag_app, "collection", object())
+    monkeypatch.setattr(rag_app, "embeddings", object())
+    monkeypatch.setattr(rag_app, "llm_qa", SlowLLM(responses=["คำตอบ"]))
+    monkeypatch.setattr(rag_app, "llm_memory_summarizer", SummarizerStub(responses=["สรุป"]))
+    monkeypatch.setattr(rag_app, "retrieve_documents", slow_retrieval)
+    monkeypatch.setattr(rag_app, "answer_cache", None)
+    return rag_app.app
+
+
+async def run_queries(asgi_app, count):
+    async def one(i):
+        # A client per query, so each one gets its own session and conversation
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url="http://test") as client:
+            return await client.post("/query", json={"query": f"คำถามที่ {i}"})
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(one(i) for i in range(count)))
+    return responses, time.perf_counter() - started
+
+
+def test_single_query_returns_answer_and_sources(stubbed_app):
+    responses, _ = asyncio.run(run_queries(stubbed_app, 1))
+    body = responses[0].json()
+    assert responses[0].status_code == 200, body
+    assert body["answer"] == "คำตอบ"
+    assert body["relevant_sources"] == ["manual.pdf"]
+    assert body["cached"] is False
+
+
+def test_concurrent_queries_overlap(stubbed_app):
+    # Retrieval and generation block on worker threads, so N queries should take about as long as one
+    # (retrieval + generation), not N times that
+    single_latency = 2 * LATENCY
+    responses, elapsed = asyncio.run(run_queries(stubbed_app, CONCURRENT_QUERIES))
+    assert [response.status_code for response in responses] == [200] * CONCURRENT_QUERIES
+    assert elapsed < 2 * single_latency, f"{CONCURRENT_QUERIES} queries took {elapsed:.2f}s"
+
+
+def test_pending_summaries_do_not_hold_up_answers(stubbed_app, monkeypatch):
+    # Every finished query leaves a summary task behind; even when they all hang, answers keep coming
+    release = threading.Event()
+    monkeypatch.setattr(rag_app, "summarize_memory", lambda session_id, memory: release.wait(30))
+    try:
+        responses, elapsed = asyncio.run(run_queries(stubbed_app, rag_app.LLM_THREADS + rag_app.SUMMARY_THREADS))
+        assert all(response.status_code == 200 for response in responses)
+        responses, elapsed = asyncio.run(run_queries(stubbed_app, 1))
+        assert responses[0].status_code == 200
+        assert elapsed < 2 * (2 * LATENCY)
+        assert rag_app.summary_queue.stats()["pending"] >= rag_app.SUMMARY_THREADS
+    finally:
+        release.set()
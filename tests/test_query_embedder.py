@@ -0,0 +1,100 @@
+import threading
+import time
+
+from query_embedder import QueryEmbedder
+
+
+class CountingEmbedder:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            self.threads.add(threading.current_thread().name)
+        time.sleep(self.latency)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def embed_concurrently(embedder, texts):
+    results = {}
+
+    def run(text):
+        results[text] = embedder.embed(text)
+
+    threads = [threading.Thread(target=run, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_unbatched_embeds_inline_without_collector():
+    backend = CountingEmbedder()
+    embedder = QueryEmbedder(backend, max_batch_size=1)
+    before = {thread.name for thread in threading.enumerate()}
+
+    assert embedder.embed("abc") == [3.0, 1.0]
+    assert embedder.embed("abc") == [3.0, 1.0]
+
+    assert backend.calls == [["abc"]]
+    assert backend.threads == {threading.current_thread().name}
+    started = {thread.name for thread in threading.enumerate()} - before
+    assert not any(name.startswith("query-embed") for name in started), started
+    stats = embedder.stats()
+    assert stats["batching"] is False
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    embedder.shutdown()
+
+
+def test_unbatched_shares_identical_queries_in_flight():
+    backend = CountingEmbedder(latency=0.2)
+    embedder = QueryEmbedder(backend, max_batch_size=1, cache_size=0)
+
+    results = embed_concurrently(embedder, ["same"] * 4)
+
+    assert results == {"same": [4.0, 1.0]}
+    assert backend.calls == [["same"]]
+    assert embedder.stats()["coalesced"] == 3
+    embedder.shutdown()
+
+
+def test_batched_coalesces_concurrent_queries():
+    backend = CountingEmbedder()
+    embedder = QueryEmbedder(backend, max_batch_size=8, max_wait_ms=200)
+
+    texts = [f"q{'x' * i}" for i in range(6)]
+    results = embed_concurrently(embedder, texts)
+
+    assert results == {text: [float(len(text)), 1.0] for text in texts}
+    assert sum(len(call) for call in backend.calls) == len(texts)
+    assert len(backend.calls) < len(texts)
+    assert embedder.stats()["batching"] is True
+    embedder.shutdown()
+
+
+def test_failed_batch_reaches_every_caller():
+    def broken(texts):
+        raise RuntimeError("ollama down")
+
+    embedder = QueryEmbedder(broken, max_batch_size=4, max_wait_ms=50)
+    errors = []
+
+    def run(text):
+        try:
+            embedder.embed(text)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=run, args=(text,)) for text in ("a", "b", "c")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == ["ollama down"] * 3
+    embedder.shutdown()
@@ -0,0 +1,44 @@
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from rerank import Candidate, mmr_rerank, mmr_select
+
+QUERY = [1.0, 1.0]
+# Relevance order: a near-duplicate of the best match comes second, a different but relevant passage third
+VECTORS = [[1.0, 0.8], [1.0, 0.78], [0.6, 1.0], [1.0, 0.0], [0.0, 1.0]]
+
+
+def test_mmr_skips_near_duplicates_that_relevance_alone_would_pick():
+    assert mmr_select(QUERY, VECTORS, 2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(QUERY, VECTORS, 2, lambda_mult=0.6) == [0, 2]
+    # Weighted towards diversity, even the less relevant orthogonal passage beats the duplicate
+    assert mmr_select(QUERY, VECTORS, 2, lambda_mult=0.5) == [0, 4]
+
+
+def test_max_per_source_caps_chunks_from_one_document():
+    sources = ["a.pdf", "a.pdf", "a.pdf", "b.pdf", "c.pdf"]
+    picks = mmr_select(QUERY, VECTORS, 3, lambda_mult=1.0, sources=sources, max_per_source=1)
+    assert sorted(sources[i] for i in picks) == ["a.pdf", "b.pdf", "c.pdf"]
+
+    # Once every source is at its cap, fewer than k chunks are returned rather than breaking the cap
+    picks = mmr_select(QUERY, VECTORS, 5, lambda_mult=1.0, sources=sources, max_per_source=2)
+    assert len(picks) == 4
+    assert Counter(sources[i] for i in picks)["a.pdf"] == 2
+
+
+def test_past_the_deadline_the_rest_is_filled_in_relevance_order():
+    assert mmr_select(QUERY, VECTORS, 3, lambda_mult=0.5, deadline=0.0) == [0, 1, 2]
+
+
+def test_rerank_uses_retrieval_scores_and_document_sources():
+    candidates = [
+        Candidate(f"c{i}", Document(page_content=f"chunk {i}", metadata={"source_filename": source}),
+                  embedding=vector, score=score)
+        for i, (vector, source, score) in enumerate(zip(VECTORS, ["a.pdf", "a.pdf", "b.pdf", "c.pdf", "c.pdf"],
+                                                        [0.9, 0.8, 0.7, 0.6, 0.1]))
+    ]
+    picked = mmr_rerank("คำถาม", QUERY, candidates, 3, lambda_mult=0.9, max_per_source=1)
+    assert [candidate.chunk_id for candidate in picked] == ["c0", "c2", "c3"]
+    # Without a query vector the retrieval order is kept
+    assert mmr_rerank("คำถาม", None, candidates, 2) == candidates[:2]
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import session_store
+from session_store import SQLiteSessionStore, make_session_store
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path, clock):
+    def make(**limits):
+        return make_session_store(request.param, str(tmp_path / "state.sqlite3"), expire_interval=0, **limits) \
+            if request.param == "sqlite" else make_session_store("memory", **limits)
+
+    return make
+
+
+def new_memory():
+    return SimpleNamespace(moving_summary_buffer="", chat_memory=SimpleNamespace(messages=[]))
+
+
+def open_session(store, session_id, clock):
+    clock.now += 1
+    return store.get_or_create(session_id, new_memory)
+
+
+def add_turn(store, session_id, memory, text):
+    # The in-process store measures the memory object; the SQLite one counts the rows appended to it
+    message = HumanMessage(content=text)
+    if isinstance(store, SQLiteSessionStore):
+        store.append(session_id, [message])
+    else:
+        memory.chat_memory.messages.append(message)
+    store.update_size(session_id)
+
+
+def test_least_recently_used_session_is_evicted_over_the_cap(make_store, clock):
+    store = make_store(max_sessions=2, idle_ttl_seconds=0)
+    open_session(store, "a", clock)
+    open_session(store, "b", clock)
+    open_session(store, "a", clock)
+    open_session(store, "c", clock)
+
+    assert len(store) == 2
+    assert store.stats()["evictions"] == 1
+    # "b" was the least recently used, so it is the one that starts over
+    open_session(store, "b", clock)
+    assert store.stats()["created"] == 4
+
+
+def test_idle_sessions_expire(make_store, clock):
+    store = make_store(idle_ttl_seconds=60)
+    open_session(store, "a", clock)
+    clock.now += 30
+    open_session(store, "b", clock)
+    clock.now += 40
+
+    open_session(store, "c", clock)
+    stats = store.stats()
+    assert (stats["sessions"], stats["expirations"]) == (2, 1)
+    clock.now += 120
+    assert store.stats()["sessions"] == 0
+
+
+def test_byte_budget_evicts_oldest_sessions_but_keeps_the_current_one(make_store, clock):
+    store = make_store(max_sessions=100, idle_ttl_seconds=0, max_total_bytes=5000)
+    for session_id in ("a", "b", "c"):
+        add_turn(store, session_id, open_session(store, session_id, clock), "x" * 300)
+    assert len(store) == 3
+    assert store.stats()["evictions"] == 0
+
+    # Roughly 800 bytes per short session; c's long turn pushes the total just past the budget
+    memory = open_session(store, "c", clock)
+    add_turn(store, "c", memory, "y" * 2200)
+    assert store.stats()["evictions"] == 1
+    assert len(store) == 2 and store.total_bytes <= 5000
+
+    # b is used again, so c is now the least recently used session; growing it evicts b, never c itself
+    open_session(store, "b", clock)
+    add_turn(store, "c", memory, "z" * 5000)
+    assert len(store) == 1
+    assert store.stats()["max_session_bytes"] > 5000
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from local_vector_index import LocalCollection
+from sharding import open_sharded_collection, routing_values, shard_collection_name
+
+
+def rows(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, 4)).astype(np.float32).tolist()
+
+
+@pytest.fixture
+def chunks():
+    types = ["manual", "ใบแจ้งหนี้", None, "manual", "report"]
+    ids = [f"c{i:02d}" for i in range(30)]
+    metadatas = []
+    for i in range(30):
+        metadata = {"source_filename": f"f{i % 6}.pdf", "chunk_id": i}
+        if types[i % 5] is not None:
+            metadata["document_type"] = types[i % 5]
+        metadatas.append(metadata)
+    return ids, rows(30), metadatas
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    collection = open_sharded_collection("local", "docs", "document_type", local_path=str(tmp_path), max_workers=4,
+                                         snapshot_every=0)
+    yield collection
+    collection.close()
+
+
+def test_shard_names_are_valid_collection_names():
+    assert shard_collection_name("docs", None) == "docs"
+    name = shard_collection_name("docs", "ใบแจ้งหนี้")
+    assert name.startswith("docs__") and name.isascii()
+    assert name != shard_collection_name("docs", "ใบเสร็จ")
+    assert routing_values({"$and": [{"source_filename": "a"}, {"document_type": {"$in": ["x", "y"]}}]},
+                          "document_type") == {"x", "y"}
+    assert routing_values({"document_type": {"$ne": "x"}}, "document_type") is None
+
+
+def test_writes_are_routed_and_queries_merge_like_one_collection(sharded, chunks, tmp_path):
+    ids, vectors, metadatas = chunks
+    sharded.add(ids=ids, embeddings=vectors, metadatas=metadatas, documents=[f"text {i}" for i in ids])
+    assert len(sharded.shard_names()) == 4
+    assert sharded.count() == 30
+    assert sharded._shard("docs").count() == 6
+
+    flat = LocalCollection(str(tmp_path / "flat"), "flat", snapshot_every=0)
+    flat.add(ids=ids, embeddings=vectors, metadatas=metadatas, documents=[f"text {i}" for i in ids])
+    queries = rows(3, seed=9)
+    for where in (None, {"source_filename": "f1.pdf"}, {"document_type": "manual"},
+                  {"document_type": {"$in": ["report", "ใบแจ้งหนี้"]}}):
+        merged = sharded.query(query_embeddings=queries, n_results=7, where=where)
+        expected = flat.query(query_embeddings=queries, n_results=7, where=where)
+        assert merged["ids"] == expected["ids"], where
+        assert np.allclose(sum(merged["distances"], []), sum(expected["distances"], []))
+    flat.close()
+
+
+def test_pinned_filters_query_only_their_shard(sharded, chunks):
+    ids, vectors, metadatas = chunks
+    sharded.add(ids=ids, embeddings=vectors, metadatas=metadatas)
+    sharded.query(query_embeddings=rows(1), n_results=3, where={"document_type": "report"})
+    queried = {entry["name"]: entry["queries"] for entry in sharded.stats()["shards"]}
+    assert queried == {name: int(name == shard_collection_name("docs", "report")) for name in sharded.shard_names()}
+
+
+def test_update_moves_chunks_between_shards(sharded, chunks):
+    ids, vectors, metadatas = chunks
+    sharded.add(ids=ids, embeddings=vectors, metadatas=metadatas, documents=[f"text {i}" for i in ids])
+    sharded.update(ids=["c00"], metadatas=[{"source_filename": "f0.pdf", "document_type": "report"}])
+
+    report = sharded._shard(shard_collection_name("docs", "report"))
+    moved = report.get(ids=["c00"], include=["documents", "embeddings"])
+    assert moved["documents"] == ["text c00"]
+    assert np.allclose(moved["embeddings"][0], vectors[0])
+    assert sharded._shard(shard_collection_name("docs", "manual")).get(ids=["c00"])["ids"] == []
+    assert sharded.count() == 30
+
+
+def test_paging_and_deletes_span_shards(sharded, chunks, tmp_path):
+    ids, vectors, metadatas = chunks
+    sharded.add(ids=ids, embeddings=vectors, metadatas=metadatas)
+    pages = [sharded.get(limit=7, offset=offset, include=[])["ids"] for offset in range(0, 30, 7)]
+    assert sorted(sum(pages, [])) == ids
+
+    assert sharded.delete(where={"source_filename": "f2.pdf"}) == {"deleted": 5}
+    assert sharded.count() == 25
+
+    # A second process sees shards created by the first once it refreshes
+    sharded.snapshot()
+    other = open_sharded_collection("local", "docs", "document_type", local_path=str(tmp_path))
+    assert other.shard_names() == sharded.shard_names()
+    assert other.count() == 25
+    other.close()
@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+import httpx
+import pytest
+
+import app as rag_app
+from ingest_jobs import IngestJob
+
+
+class SubmittedJobs:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, filename, fn, *args, **kwargs):
+        self.calls.append((filename, args))
+        return IngestJob(filename)
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    jobs = SubmittedJobs()
+    monkeypatch.setattr(rag_app, "collection", object())
+    monkeypatch.setattr(rag_app, "embeddings", object())
+    monkeypatch.setattr(rag_app, "ingest_jobs", jobs)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    def post(files, data=None):
+        async def send():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=rag_app.app), base_url="http://test") as client:
+                return await client.post("/ingest", files=files, data=data)
+
+        return asyncio.run(send())
+
+    return jobs, post, tmp_path
+
+
+def test_upload_streams_into_one_hashed_temp_file(uploads):
+    jobs, post, tmp_path = uploads
+    content = os.urandom(300 * 1024)
+    response = post({"file": ("คู่มือ.pdf", content, "application/pdf")}, {"metadata": json.dumps({"department": "บัญชี"})})
+
+    assert response.status_code == 202, response.text
+    assert response.json()["metadata"]["department"] == "บัญชี"
+    [(filename, (path, _, metadata, file_info))] = jobs.calls
+    assert filename == metadata["source_filename"] == "คู่มือ.pdf"
+    assert path.endswith(".pdf") and os.listdir(tmp_path) == [os.path.basename(path)]
+    with open(path, "rb") as upload:
+        assert upload.read() == content
+    assert file_info == {"content_hash": hashlib.sha256(content).hexdigest(), "byte_size": len(content)}
+
+
+def test_rejected_uploads_leave_no_temp_file(uploads, monkeypatch):
+    jobs, post, tmp_path = uploads
+    assert post({"file": ("รูป.png", b"png", "image/png")}).status_code == 400
+    assert post({"file": ("a.txt", b"text", "text/plain")}, {"metadata": "{not json"}).status_code == 400
+    assert post({"other": ("a.txt", b"text", "text/plain")}).status_code == 400
+
+    monkeypatch.setattr(rag_app, "MAX_UPLOAD_BYTES", 1024)
+    response = post({"file": ("a.txt", b"x" * 4096, "text/plain")})
+    assert response.status_code == 413
+    assert jobs.calls == []
+    assert os.listdir(tmp_path) == []
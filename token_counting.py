@@ -0,0 +1,47 @@
+# token_counting.py
+# Counts tokens with a Hugging Face tokenizer loaded once per process; when it cannot be loaded, falls back
+# to a byte-based estimate (about 4 UTF-8 bytes per token) so chunking and context packing still work offline.
+
+import threading
+
+from transformers import AutoTokenizer
+
+
+class TokenCounter:
+    def __init__(self, tokenizer_name):
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.tokenizer is None and not self._failed:
+                try:
+                    self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                    print(f"Tokenizer '{self.tokenizer_name}' loaded.")
+                except Exception as e:
+                    print(f"WARNING: Could not load tokenizer '{self.tokenizer_name}'. Estimating tokens from length. Error: {e}")
+                    self._failed = True
+        return self.tokenizer
+
+    def count(self, text):
+        tokenizer = self.load()
+        if tokenizer is None:
+            return -(-len(text.encode("utf-8")) // 4)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def count_many(self, texts):
+        # One batched call; fast tokenizers encode the batch in parallel outside the GIL
+        tokenizer = self.load()
+        if tokenizer is None:
+            return [-(-len(text.encode("utf-8")) // 4) for text in texts]
+        if not texts:
+            return []
+        return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def truncate(self, text, max_tokens):
+        tokenizer = self.load()
+        if tokenizer is None:
+            return text.encode("utf-8")[:max_tokens * 4].decode("utf-8", errors="ignore")
+        return tokenizer.decode(tokenizer.encode(text, add_special_tokens=False)[:max_tokens])
@@ -0,0 +1,194 @@
+# uploads.py
+# Bounded-memory uploads: request bodies over the limit are rejected with 413 before they are buffered, and
+# accepted uploads are parsed as they stream in, the file part going straight to a temp file while being
+# hashed, so no request ever holds a whole file in RAM or writes it to disk twice.
+
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+# Room for the multipart boundaries and the metadata field on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def too_large_detail(max_bytes):
+    return f"ไฟล์มีขนาดใหญ่เกินกำหนด (สูงสุด {max_bytes / (1024 * 1024):.0f} MB)"
+
+
+def decode_header(value):
+    # Browsers and requests send non-ASCII filenames as raw UTF-8
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+class StreamedUpload:
+    # python-multipart callbacks for one upload: the file_field part is written to a named temp file (its
+    # name is only known once the part headers arrive), every other part is kept as a text field
+    def __init__(self, file_field, suffix_for, max_bytes):
+        self.file_field = file_field
+        self.suffix_for = suffix_for
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.filename = None
+        self.path = None
+        self.byte_size = 0
+        self._file = None
+        self._digest = hashlib.sha256()
+        # File bytes parsed from the last network chunk, written by flush() on a worker thread
+        self._pending = []
+        self._in_file = False
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._value = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._value = bytearray()
+        self._in_file = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if decode_header(options.get(b"name", b"")) != self.file_field or b"filename" not in options:
+            return
+        if self.path is not None:
+            raise HTTPException(status_code=400, detail="ส่งไฟล์ได้ครั้งละหนึ่งไฟล์")
+        self.filename = decode_header(options[b"filename"])
+        # May reject the file by its name before any of its bytes are stored
+        suffix = self.suffix_for(self.filename)
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.path = self._file.name
+        self._in_file = True
+
+    def on_part_data(self, data, start, end):
+        if self._in_file:
+            self.byte_size += end - start
+            if self.max_bytes and self.byte_size > self.max_bytes:
+                raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+            self._pending.append(data[start:end])
+            return
+        if len(self._value) + end - start > MULTIPART_OVERHEAD_BYTES:
+            raise HTTPException(status_code=413, detail="ข้อมูลประกอบไฟล์มีขนาดใหญ่เกินกำหนด")
+        self._value += data[start:end]
+
+    def on_part_end(self):
+        if self._in_file:
+            return
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = decode_header(options.get(b"name", b""))
+        if name:
+            self.fields[name] = decode_header(bytes(self._value))
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def flush(self):
+        # Blocking: run it on a worker thread
+        pending, self._pending = self._pending, []
+        for chunk in pending:
+            self._digest.update(chunk)
+            self._file.write(chunk)
+
+    def finish(self):
+        # Blocking: run it on a worker thread
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        return {"content_hash": self._digest.hexdigest(), "byte_size": self.byte_size}
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+
+
+async def receive_upload(request, executor, file_field="file", suffix_for=None, max_bytes=0):
+    # Parses a multipart/form-data request as it arrives; returns (fields, filename, path, file_info) with
+    # file_info = {"content_hash", "byte_size"}. suffix_for(filename) returns the temp file's suffix and may
+    # raise an HTTPException to reject the file. The caller owns the temp file at path afterwards
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="กรุณาส่งไฟล์แบบ multipart/form-data")
+    upload = StreamedUpload(file_field, suffix_for or (lambda filename: os.path.splitext(filename)[1]), max_bytes)
+    parser = MultipartParser(params[b"boundary"], upload.callbacks())
+    loop = asyncio.get_running_loop()
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            # Disk writes and hashing stay off the event loop; the parser itself only slices the chunk
+            if upload.has_pending():
+                await loop.run_in_executor(executor, upload.flush)
+        parser.finalize()
+        file_info = await loop.run_in_executor(executor, upload.finish)
+    except MultipartParseError as e:
+        upload.discard()
+        raise HTTPException(status_code=400, detail=f"ข้อมูล multipart ไม่ถูกต้อง: {e}")
+    except BaseException:
+        upload.discard()
+        raise
+    if upload.path is None:
+        raise HTTPException(status_code=400, detail=f"กรุณาแนบไฟล์ในฟิลด์ '{file_field}'")
+    return upload.fields, upload.filename, upload.path, file_info
+
+
+class UploadLimitMiddleware:
+    # Pure ASGI: checks Content-Length up front and counts the body as it streams in (chunked uploads have
+    # no length), so an oversized upload is cut off before the multipart parser spools all of it
+    def __init__(self, app, max_bytes, paths):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        limit = self.max_bytes + MULTIPART_OVERHEAD_BYTES
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": too_large_detail(self.max_bytes)})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing; FastAPI passes HTTPExceptions through to its 413 response
+                    raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
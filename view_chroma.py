@@ -1,6 +1,8 @@
 import chromadb
 import os
 
+from collection_scanner import iter_chunks
+
 # Configuration (ต้องตรงกับที่ใช้ใน app.py ของคุณ)
 CHROMA_HOST = os.getenv("CHROMA_HOST", "10.10.32.78")
 CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
@@ -27,12 +29,15 @@ try:
             print(f"- {doc_id}")
     else:
         print("No documents found with that filename. This is strange. Let's try getting all IDs.")
-        all_results = collection.get(limit=collection.count(), include=[])
-        if all_results['ids']:
-            print(f"Found {len(all_results['ids'])} total documents in the collection.")
-            print("Please manually copy these IDs for deletion:")
-            for doc_id in all_results['ids']:
-                print(f"- {doc_id}")
+        # อ่านทีละหน้า ไม่ดึง ID ทั้ง Collection มาในครั้งเดียว
+        total_ids = 0
+        for doc_id, _, _ in iter_chunks(collection, include=()):
+            if total_ids == 0:
+                print("Please manually copy these IDs for deletion:")
+            print(f"- {doc_id}")
+            total_ids += 1
+        if total_ids:
+            print(f"Found {total_ids} total documents in the collection.")
         else:
             print("No documents found in the collection at all.")
 
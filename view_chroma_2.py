@@ -1,12 +1,64 @@
 import chromadb
 import os
 import json
-import hashlib
+from collections import Counter
+
+from answer_cache import SQLiteAnswerCache
+from collection_scanner import delete_filenames, delete_orphans, delete_where, file_stats, find_orphans
+from document_registry import DocumentRegistry
+from shared_state import ChangeFeed
 
 # Configuration (ต้องตรงกับที่ใช้ใน app.py ของคุณ)
 CHROMA_HOST = os.getenv("CHROMA_HOST", "10.10.32.78")
 CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
 COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "rag_documents")
+RAG_DATA_DIR = os.getenv("RAG_DATA_DIR", "rag_data")
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", os.path.join(RAG_DATA_DIR, "document_registry.sqlite3"))
+# ฐานข้อมูลที่ API Worker ใช้ร่วมกัน (STATE_BACKEND=sqlite) ถ้ามีไฟล์นี้ การลบจะแจ้งให้ Worker ที่รันอยู่อัปเดต BM25 และ Answer Cache
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(RAG_DATA_DIR, "shared_state.sqlite3"))
+# จำนวน Chunk ต่อหน้าเวลาอ่าน/ลบ เพื่อไม่ให้ดึงทั้ง Collection มาในครั้งเดียว
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "1000"))
+ORPHANS_SHOWN = 20
+
+
+def confirm(prompt):
+    return input(f"{prompt} [y/N]: ").strip().lower() in ("y", "yes")
+
+
+def read_filenames(text):
+    # "a.pdf, b.txt" หรือ "@list.txt" (หนึ่งชื่อไฟล์ต่อบรรทัด)
+    if text.startswith("@"):
+        with open(text[1:], encoding="utf-8") as list_file:
+            return [line.strip() for line in list_file if line.strip()]
+    return [name.strip() for name in text.split(",") if name.strip()]
+
+def open_shared_state():
+    # Only when the API workers already share state; creating the file here would not make them read it
+    if not os.path.exists(STATE_DB_PATH):
+        return None, None
+    try:
+        return ChangeFeed(STATE_DB_PATH), SQLiteAnswerCache(STATE_DB_PATH)
+    except Exception as e:
+        print(f"WARNING: Could not open shared state at '{STATE_DB_PATH}'. Running API workers will keep deleted "
+              f"chunks in keyword search and cached answers until restarted. Error: {e}")
+        return None, None
+
+
+def publish_deletes(change_feed, answer_cache, filenames):
+    # Same as ingest_bulk.py: running workers re-read these files into their BM25 indexes and drop cached
+    # answers that cite them
+    filenames = sorted(filenames)
+    if not filenames:
+        return
+    try:
+        if change_feed:
+            for filename in filenames:
+                change_feed.append("delete", filename)
+        if answer_cache:
+            answer_cache.invalidate_sources(filenames)
+    except Exception as e:
+        print(f"WARNING: Could not tell the API workers about deleted files {filenames}. Error: {e}")
+
 
 try:
     # 1. เชื่อมต่อ ChromaDB Client
@@ -33,21 +85,28 @@ try:
         print("No documents found in collection or peek limit too low.")
 
     # --- ส่วนใหม่: เพิ่มฟังก์ชันการลบและการแสดงรายการ ---
+    registry = DocumentRegistry(DOCUMENT_REGISTRY_PATH) if os.path.exists(DOCUMENT_REGISTRY_PATH) else None
+    change_feed, answer_cache = open_shared_state()
     print("\n--- Document Management Options ---")
     print("1. Delete by ID(s)")
     print("2. Delete by Metadata filter")
-    print("3. Delete by filename (using source_filename metadata)")
+    print("3. Delete by filename(s) (using source_filename metadata)")
     print("4. List all unique filenames") # <--- เพิ่มหัวข้อใหม่
-    print("5. Exit")
+    print("5. Per-file chunk statistics")
+    print("6. Find orphaned chunks")
+    print("7. Exit")
     
-    option = input("Enter option number (1-5): ")
+    option = input("Enter option number (1-7): ")
 
     if option == '1':
         ids_to_delete_str = input("Enter comma-separated IDs to delete (e.g., id1,id2): ")
         ids_to_delete = [id.strip() for id in ids_to_delete_str.split(',')]
         if ids_to_delete:
             print(f"Attempting to delete documents with IDs: {ids_to_delete}")
+            metadatas = collection.get(ids=ids_to_delete, include=["metadatas"])["metadatas"]
             collection.delete(ids=ids_to_delete)
+            publish_deletes(change_feed, answer_cache, {metadata["source_filename"] for metadata in metadatas
+                                                         if metadata and metadata.get("source_filename") is not None})
             print("Deletion by ID completed.")
         else:
             print("No IDs provided for deletion.")
@@ -58,9 +117,16 @@ try:
         try:
             filter_dict = json.loads(filter_str)
             if filter_dict:
-                print(f"Attempting to delete documents with metadata filter: {filter_dict}")
-                collection.delete(where=filter_dict)
-                print("Deletion by metadata filter completed.")
+                # Dry run ก่อน: นับจำนวน Chunk ที่ตรงกับเงื่อนไข
+                matched = delete_where(collection, filter_dict, batch_size=SCAN_BATCH_SIZE, dry_run=True)
+                print(f"{matched} chunks match metadata filter: {filter_dict}")
+                if matched and confirm("Delete them?"):
+                    sources = set()
+                    deleted = delete_where(collection, filter_dict, batch_size=SCAN_BATCH_SIZE, sources=sources)
+                    publish_deletes(change_feed, answer_cache, sources)
+                    print(f"Deletion by metadata filter completed: {deleted} chunks deleted.")
+                else:
+                    print("No documents deleted.")
             else:
                 print("Empty filter provided. No documents deleted.")
         except json.JSONDecodeError:
@@ -69,32 +135,80 @@ try:
             print(f"Error during deletion with metadata filter: {e}")
 
     elif option == '3':
-        filename_to_delete = input("Enter source filename to delete (e.g., herbs_7_with_usage.txt): ")
-        if filename_to_delete:
-            # ใช้ hashlib.sha256 เพื่อให้ลบได้สอดคล้องกับ app.py เวอร์ชันล่าสุด
-            filename_hash = hashlib.sha256(filename_to_delete.encode('utf-8')).hexdigest()
-            print(f"Attempting to delete documents from filename: {filename_to_delete} (hash: {filename_hash})")
-            collection.delete(where={"_filename_hash": filename_hash})
-            print("Deletion by filename completed.")
+        filenames_str = input("Enter comma-separated source filenames, or @file with one filename per line: ")
+        filenames = read_filenames(filenames_str.strip()) if filenames_str.strip() else []
+        if filenames:
+            # ใช้ hash ของชื่อไฟล์ (sha256) เพื่อให้ลบได้สอดคล้องกับ app.py เวอร์ชันล่าสุด
+            matched = delete_filenames(collection, filenames, batch_size=SCAN_BATCH_SIZE, dry_run=True)
+            for filename, chunks in matched.items():
+                print(f"- {filename}: {chunks} chunks")
+            print(f"{sum(matched.values())} chunks in {len(filenames)} files.")
+            if confirm("Delete them?"):
+                deleted = delete_filenames(collection, filenames, registry=registry, batch_size=SCAN_BATCH_SIZE)
+                publish_deletes(change_feed, answer_cache, filenames)
+                print(f"Deletion by filename completed: {sum(deleted.values())} chunks deleted.")
+            else:
+                print("No documents deleted.")
         else:
             print("No filename provided for deletion.")
     
     elif option == '4': # <--- ส่วนใหม่: List all unique filenames
         print("--- All Unique Filenames in Collection ---")
-        results = collection.get(limit=collection.count(), include=['metadatas'])
-        unique_filenames = set()
-        if results['metadatas']:
-            for metadata in results['metadatas']:
-                if 'source_filename' in metadata:
-                    unique_filenames.add(metadata['source_filename'])
-        
-        if unique_filenames:
-            for filename in sorted(list(unique_filenames)):
-                print(f"- {filename}")
+        listed = 0
+        if registry:
+            # อ่านจาก Document Registry ของ app.py ทีละหน้า (เรียงตามชื่อไฟล์อยู่แล้ว) แทนการดึง Metadata ของทุก Chunk
+            after = None
+            while True:
+                documents, _ = registry.list(after=after, limit=SCAN_BATCH_SIZE)
+                for document in documents:
+                    print(f"- {document['filename']}")
+                listed += len(documents)
+                if len(documents) < SCAN_BATCH_SIZE:
+                    break
+                after = documents[-1]['filename']
         else:
+            unique_filenames = {filename for filename in file_stats(collection, batch_size=SCAN_BATCH_SIZE) if filename is not None}
+            for filename in sorted(unique_filenames):
+                print(f"- {filename}")
+            listed = len(unique_filenames)
+
+        if not listed:
             print("No filenames found in the collection.")
-    
+
     elif option == '5':
+        print("--- Chunks per File ---")
+        stats = file_stats(collection, batch_size=SCAN_BATCH_SIZE)
+        for filename, entry in sorted(stats.items(), key=lambda item: -item[1]["chunks"]):
+            line = (f"- {filename if filename is not None else '(no source_filename)'}: {entry['chunks']} chunks, "
+                    f"{entry['characters']} characters, avg {entry['characters'] // entry['chunks']} chars/chunk")
+            if entry["document_type"]:
+                line += f", type: {entry['document_type']}"
+            document = registry.get(filename) if registry and filename is not None else None
+            if registry and filename is not None and (document is None or document["chunk_count"] != entry["chunks"]):
+                line += f" (registry: {document['chunk_count'] if document else 'missing'})"
+            print(line)
+        print(f"{len(stats)} files, {sum(entry['chunks'] for entry in stats.values())} chunks.")
+
+    elif option == '6':
+        print("--- Orphaned Chunks ---")
+        # นับก่อน (แสดงตัวอย่าง ORPHANS_SHOWN รายการ) แล้วค่อยลบทีละหน้า ไม่เก็บ ID ทั้งหมดไว้ในหน่วยความจำ
+        orphan_count, reasons = 0, Counter()
+        for chunk_id, metadata, reason in find_orphans(collection, registry, batch_size=SCAN_BATCH_SIZE):
+            if orphan_count < ORPHANS_SHOWN:
+                print(f"- {chunk_id} ({reason}): {metadata}")
+            orphan_count += 1
+            reasons[reason] += 1
+        if orphan_count:
+            print(f"{orphan_count} orphaned chunks: " + ", ".join(f"{reason}: {n}" for reason, n in reasons.items()))
+            if confirm("Delete them?"):
+                sources = set()
+                deleted = delete_orphans(collection, registry, batch_size=SCAN_BATCH_SIZE, sources=sources)
+                publish_deletes(change_feed, answer_cache, sources)
+                print(f"Deleted {deleted} orphaned chunks.")
+        else:
+            print("No orphaned chunks found.")
+    
+    elif option == '7':
         print("Exiting.")
     
     else: